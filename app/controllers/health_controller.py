@@ -0,0 +1,21 @@
+from fastapi import APIRouter
+from fastapi.responses import JSONResponse
+
+from app.schemas.response_schema import HealthResponse, ReadinessResponse
+from app.services.startup_service import readiness
+
+router = APIRouter()
+
+
+@router.get("/health", response_model=HealthResponse)
+async def health():
+    # Liveness: the process is up and serving, models may still be loading
+    return {"status": "ok"}
+
+
+@router.get("/ready", response_model=ReadinessResponse, responses={503: {"model": ReadinessResponse}})
+async def ready():
+    # Readiness: models are loaded and warmed up, send traffic only when this returns 200
+    if readiness["status"] != "ready":
+        return JSONResponse(status_code=503, content=readiness)
+    return readiness
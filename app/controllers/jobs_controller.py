@@ -0,0 +1,133 @@
+import asyncio
+import logging
+import os
+import tempfile
+from typing import Literal
+
+from fastapi import APIRouter, UploadFile, HTTPException, File, Request, Query, Response
+from fastapi.responses import StreamingResponse
+
+from app.controllers.objects_controller import ALLOWED_EXTENSIONS, MAX_SIZE_MB, STRATEGY_DESCRIPTION
+from app.schemas.response_schema import JobResponse, JobResultsResponse
+from app.services.job_service import FINISHED, job_runner
+from app.utils.image_source import ImageSource
+from app.utils.rasterize_pdf import count_pdf_pages
+from app.utils.save_upload import save_upload, upload_size
+from app.settings import settings
+
+logger = logging.getLogger("process_pdf")
+
+router = APIRouter()
+
+EVENTS_INTERVAL = 1.0
+
+
+async def _get_job(job_id: str) -> dict:
+    job = await job_runner.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+
+@router.post("/api/jobs", response_model=JobResponse, status_code=202)
+async def submit_job(
+    request: Request,
+    file: UploadFile = File(...),
+    bbox_only: bool = Query(False, description="If true, only return bboxes and do not call VLM"),
+    strategy: Literal["crop", "page", "hybrid"] | None = Query(None, description=STRATEGY_DESCRIPTION),
+    first_page: int | None = Query(None, ge=1, description="First PDF page to process (1-based, default: 1)"),
+    last_page: int | None = Query(None, ge=1, description="Last PDF page to process (default: last page of the document)"),
+) -> JobResponse:
+    logger.info(f"Incoming request: {request.method} {request.url.path} from {request.client.host}")
+    logger.info(f"Query params: {dict(request.query_params)}")
+
+    size_bytes = upload_size(file)
+    size_mb = size_bytes / (1024 * 1024)
+    ext = file.filename.split(".")[-1].lower()
+    kind = "pdf" if ext == "pdf" else "image"
+    logger.info(f"Received job file: {file.filename}, size: {size_mb:.2f} MB, content_type: {file.content_type}")
+    if kind == "image" and ext not in ALLOWED_EXTENSIONS:
+        raise HTTPException(status_code=400, detail="File type not allowed. Only pdf, jpg, png, gif are supported.")
+    max_size_mb = settings.pdf_max_size_mb if kind == "pdf" else MAX_SIZE_MB
+    if size_bytes > max_size_mb * 1024 * 1024:
+        logger.warning(f"File too large: {size_mb:.2f} MB (limit: {max_size_mb} MB)")
+        raise HTTPException(status_code=400, detail=f"File too large. Max size is {max_size_mb} MB.")
+
+    # Spooled next to the job directories, so the job takes the file over with a rename
+    os.makedirs(settings.jobs_dir, exist_ok=True)
+    fd, upload_path = tempfile.mkstemp(suffix=f".{ext}", dir=settings.jobs_dir)
+    os.close(fd)
+    try:
+        digest = await asyncio.to_thread(save_upload, file, upload_path)
+        if kind == "pdf":
+            total_pages = await asyncio.to_thread(count_pdf_pages, upload_path)
+            start = first_page or 1
+            end = min(last_page or total_pages, total_pages)
+            pages = list(range(start, end + 1))
+            if not pages:
+                raise ValueError(f"no pages in range {start}-{end}, the document has {total_pages}")
+        else:
+            # Only the header is read, bad or oversized images are refused before they are queued
+            await asyncio.to_thread(ImageSource, upload_path, settings.image_max_pixels)
+            pages = [1]
+    except Exception as e:
+        os.remove(upload_path)
+        logger.error(f"Invalid job file {file.filename}: {e}")
+        raise HTTPException(status_code=400, detail=f"Invalid {kind}: {e}")
+
+    source_id = f"pdf:{digest}" if kind == "pdf" else digest
+    job_id = await job_runner.submit(kind, file.filename, upload_path, source_id, bbox_only, strategy, pages)
+    logger.info(f"Queued job {job_id}: {len(pages)} pages from {file.filename}")
+    return await job_runner.get(job_id)
+
+
+@router.get("/api/jobs/{job_id}", response_model=JobResponse)
+async def get_job(job_id: str) -> JobResponse:
+    return await _get_job(job_id)
+
+
+@router.get("/api/jobs/{job_id}/results", response_model=JobResultsResponse)
+async def get_job_results(job_id: str) -> JobResultsResponse:
+    job = await _get_job(job_id)
+    return {"job": job, "pages": await job_runner.results(job_id)}
+
+
+@router.get(
+    "/api/jobs/{job_id}/events",
+    response_class=StreamingResponse,
+    responses={200: {
+        "description": "One JobResponse JSON object per line on every progress, until the job is finished",
+        "content": {"application/x-ndjson": {"schema": JobResponse.model_json_schema()}},
+    }},
+)
+async def get_job_events(job_id: str) -> StreamingResponse:
+    job = await _get_job(job_id)
+
+    async def stream():
+        nonlocal job
+        last_update = None
+        while job is not None:
+            if job["updated_at"] != last_update:
+                last_update = job["updated_at"]
+                yield JobResponse.model_validate(job).model_dump_json() + "\n"
+            if job["status"] in FINISHED:
+                return
+            await asyncio.sleep(EVENTS_INTERVAL)
+            job = await job_runner.get(job_id)
+
+    return StreamingResponse(stream(), media_type="application/x-ndjson")
+
+
+@router.post("/api/jobs/{job_id}/retry", response_model=JobResponse, status_code=202)
+async def retry_job(job_id: str) -> JobResponse:
+    await _get_job(job_id)
+    if not await job_runner.retry(job_id):
+        raise HTTPException(status_code=409, detail="Job is still queued or running")
+    return await job_runner.get(job_id)
+
+
+@router.delete("/api/jobs/{job_id}", status_code=204)
+async def delete_job(job_id: str) -> Response:
+    if not await job_runner.delete(job_id):
+        raise HTTPException(status_code=404, detail="Job not found")
+    return Response(status_code=204)
@@ -0,0 +1,10 @@
+from fastapi import APIRouter, Response
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
+
+router = APIRouter()
+
+
+@router.get("/metrics", include_in_schema=False)
+async def metrics():
+    # Prometheus text exposition format, scraped by Prometheus or any compatible agent
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
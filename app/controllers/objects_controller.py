@@ -1,15 +1,24 @@
+import asyncio
+import json
+import os
+import tempfile
 import traceback
 import logging
-from PIL import Image
-import io
-import math
+from typing import List, Literal
 
 from fastapi import APIRouter, UploadFile, HTTPException, File, Request, Query
+from fastapi.responses import StreamingResponse
+from PIL import Image
 
-from app.schemas.response_schema import ObjectsResponse
-from app.services.vlm_service import VLMService
-from app.services.segmentator_service import run_segmentation
-from app.utils.pad_to_multiple_of_28 import pad_to_multiple_of_28
+from app.schemas.response_schema import BatchObjectsResponse, ObjectsEvent, ObjectsResponse, PageObjectsResponse
+from app.services.page_service import process_page, process_pdf_pages
+from app.services.admission_service import admission
+from app.services.block_index import BlockIndex, block_indexes
+from app.services.metrics_service import ADMISSION_REJECTED, track_stage
+from app.utils.rasterize_pdf import count_pdf_pages
+from app.utils.image_source import ImageSource
+from app.utils.save_upload import hash_upload, save_upload, upload_size
+from app.settings import settings
 
 logging.basicConfig(
     level=logging.INFO,
@@ -20,95 +29,227 @@ logger = logging.getLogger("process_pdf")
 
 router = APIRouter()
 
-# Allowed types for VLM processing (except Picture)
-ALLOWED_TYPES = {
-    "text", "caption", "section-header", "footnote", "formula", "table",
-    "list-item", "page-header", "page-footer", "title"
-}
-
 ALLOWED_EXTENSIONS = {"jpg", "jpeg", "png", "gif"}
+ALLOWED_FORMATS = {"JPEG", "PNG", "GIF"}
 MAX_SIZE_MB = 25
 MAX_SIZE_BYTES = MAX_SIZE_MB * 1024 * 1024
 
-vlm_service = VLMService()
+STRATEGY_DESCRIPTION = (
+    "crop: one VLM call per detected block; page: one VLM call for the whole page (no segmentation); "
+    "hybrid: adjacent small blocks of compatible types share one VLM call. Default: PROCESSING_STRATEGY setting"
+)
+
 
+def check_admission() -> None:
+    # Rejected before the upload is read, with a hint of how long a page currently takes
+    if admission.overloaded():
+        ADMISSION_REJECTED.inc()
+        retry_after = admission.retry_after()
+        logger.warning(f"Rejecting request: {admission.pending} pages pending (limit: {admission.max_pending})")
+        raise HTTPException(
+            status_code=503,
+            detail=f"Server is overloaded, retry in {retry_after} seconds.",
+            headers={"Retry-After": str(retry_after)},
+        )
+
+
+async def open_image_upload(file: UploadFile) -> tuple[str, ImageSource]:
+    # Checks an uploaded image and opens it without decoding, returns its digest and the source.
+    # Raises HTTPException(400) for uploads that cannot be processed.
+    size_bytes = upload_size(file)
+    size_mb = size_bytes / (1024 * 1024)
+    logger.info(f"Received file: {file.filename}, size: {size_mb:.2f} MB, content_type: {file.content_type}")
+    if size_bytes > MAX_SIZE_BYTES:
+        logger.warning(f"File too large: {size_mb:.2f} MB (limit: {MAX_SIZE_MB} MB)")
+        raise HTTPException(status_code=400, detail=f"File too large. Max size is {MAX_SIZE_MB} MB.")
+
+    ext = (file.filename or "").split(".")[-1].lower()
+    if ext not in ALLOWED_EXTENSIONS:
+        logger.warning(f"File type not allowed: {ext}")
+        raise HTTPException(status_code=400, detail="File type not allowed. Only jpg, png, gif are supported.")
+
+    # The upload stays spooled, it is hashed in chunks and only its header is read here
+    with track_stage("upload_read"):
+        digest = await asyncio.to_thread(hash_upload, file)
+    try:
+        source = await asyncio.to_thread(ImageSource, file.file, settings.image_max_pixels)
+    except (OSError, ValueError, Image.DecompressionBombError) as e:
+        logger.warning(f"Invalid image {file.filename}: {e}")
+        raise HTTPException(status_code=400, detail=f"Invalid image: {e}")
+    if source.format not in ALLOWED_FORMATS:
+        logger.warning(f"Image format not allowed: {source.format}")
+        raise HTTPException(status_code=400, detail="File type not allowed. Only jpg, png, gif are supported.")
+    return digest, source
 
-@router.post("/api/objects", response_model=ObjectsResponse)
+
+def session_index(session: str | None, dedup: bool) -> BlockIndex | None:
+    # Repeated blocks are only looked up across the pages of a session the client names
+    if session is None or not dedup or not settings.dedup_enabled:
+        return None
+    return block_indexes.get(session)
+
+
+def stream_page_events(source: ImageSource, source_id: str, bbox_only: bool, strategy: str | None,
+                       block_index: BlockIndex | None = None):
+    # NDJSON progress events of one page, the last line is the "done" event with the whole response
+    async def stream():
+        events = asyncio.Queue()
+        # Events are serialized when they happen, so later changes to the objects do not leak into them
+        on_event = lambda event: events.put_nowait(json.dumps(event, ensure_ascii=False) + "\n")
+        task = asyncio.create_task(process_page(source, source_id, bbox_only, strategy, on_event, block_index))
+        task.add_done_callback(lambda _: events.put_nowait(None))
+        try:
+            while (line := await events.get()) is not None:
+                yield line
+            try:
+                yield json.dumps({"event": "done", **task.result()}, ensure_ascii=False) + "\n"
+            except Exception as e:
+                logger.error(f"Error in streamed predict_objects: {e}")
+                yield json.dumps({"event": "error", "detail": f"VLM API error: {e}"}) + "\n"
+        finally:
+            # The client went away early, the remaining VLM calls are not needed anymore
+            task.cancel()
+            source.close()
+
+    return StreamingResponse(stream(), media_type="application/x-ndjson")
+
+
+@router.post(
+    "/api/objects",
+    response_model=ObjectsResponse,
+    responses={200: {
+        "description": "With stream=true, one ObjectsEvent JSON object per line, ending with a done event",
+        "content": {"application/x-ndjson": {"schema": ObjectsEvent.model_json_schema()}},
+    }},
+)
 async def predict_objects(
     request: Request,
     file: UploadFile = File(...),
-    bbox_only: bool = Query(False, description="If true, only return bboxes and do not call VLM")
+    bbox_only: bool = Query(False, description="If true, only return bboxes and do not call VLM"),
+    strategy: Literal["crop", "page", "hybrid"] | None = Query(None, description=STRATEGY_DESCRIPTION),
+    stream: bool = Query(False, description="If true, answer with NDJSON events carrying block text while it is generated"),
+    session: str | None = Query(None, max_length=128, description="Pages sent with the same session id (e.g. one per document) reuse the markdown of repeated headers and footers"),
+    dedup: bool = Query(True, description="If false, repeated blocks are not looked up in the session's index"),
 ) -> ObjectsResponse:
+    check_admission()
     try:
         # Log incoming request details
         logger.info(f"Incoming request: {request.method} {request.url.path} from {request.client.host}")
         logger.info(f"Headers: {dict(request.headers)}")
         logger.info(f"Query params: {dict(request.query_params)}")
 
-        file.file.seek(0, 2)
-        size_bytes = file.file.tell()
-        file.file.seek(0)
-        size_mb = size_bytes / (1024 * 1024)
-        logger.info(f"Received file: {file.filename}, size: {size_mb:.2f} MB, content_type: {file.content_type}")
-        if size_bytes > MAX_SIZE_BYTES:
-            logger.warning(f"File too large: {size_mb:.2f} MB (limit: {MAX_SIZE_MB} MB)")
-            raise HTTPException(status_code=400, detail=f"File too large. Max size is {MAX_SIZE_MB} MB.")
-
-        ext = file.filename.split(".")[-1].lower()
-        if ext not in ALLOWED_EXTENSIONS:
-            logger.warning(f"File type not allowed: {ext}")
-            raise HTTPException(status_code=400, detail="File type not allowed. Only jpg, png, gif are supported.")
-
-        image_bytes = await file.read()
-        img = Image.open(io.BytesIO(image_bytes)).convert("RGB")
-        width, height = img.size
-        logger.info(f"Original image size: {width}x{height}")
-
-        # Run segmentation to get layout blocks
-        detections = run_segmentation(img)
-        logger.info(f"Segmentation found {len(detections)} blocks")
-
-        objects = []
-        for det in detections:
-            type = det["type"]
-            bbox = det["bbox"]  # [x1, y1, x2, y2]
-            confidence = det.get("confidence")
-            x1, y1, x2, y2 = map(int, bbox)
-            # Clamp coordinates to image size
-            x1 = max(0, min(x1, width - 1))
-            y1 = max(0, min(y1, height - 1))
-            x2 = max(0, min(x2, width))
-            y2 = max(0, min(y2, height))
-            crop = img.crop((x1, y1, x2, y2))
-            text = None
-            logger.info(f"Detected block type: {type}")
-            if not bbox_only and type.lower() in ALLOWED_TYPES:
-                # Pad the crop to satisfy VLM requirements (min 28px, multiple of 28)
-                crop = pad_to_multiple_of_28(crop)
-                buf = io.BytesIO()
-                crop.save(buf, format="PNG")
-                crop_bytes = buf.getvalue()
-                try:
-                    logger.info(f"Calling VLM for block type: {type} bbox: {bbox}")
-                    text = vlm_service.extract_markdown(crop_bytes)
-                    if text is None:
-                        logger.warning(f"VLM returned None for block type: {type}")
-                        text = ""
-                    else:
-                        logger.info(f"VLM result for block type: {type}: {text}")
-                except Exception as e:
-                    logger.error(f"VLM error for block {type}: {e}")
-                    text = ""
-            obj = {
-                "type":       type,
-                "bbox":       [x1, y1, x2, y2],
-                "confidence": confidence,
-                "text":       text
-            }
-            objects.append(obj)
-        return {"objects": objects}
+        digest, source = await open_image_upload(file)
+        if stream:
+            # The upload is closed when the handler returns, the streamed page reads through its own handle
+            try:
+                handle = os.fdopen(os.dup(file.file.fileno()), "rb")
+            finally:
+                source.close()
+            return stream_page_events(ImageSource(handle), digest, bbox_only, strategy, session_index(session, dedup))
+        return await process_page(source, digest, bbox_only, strategy, block_index=session_index(session, dedup))
 
+    except HTTPException:
+        raise
     except Exception as e:
         tb = traceback.format_exc()
         logger.error(f"Error in predict_objects: {e}\n{tb}")
         raise HTTPException(status_code=502, detail=f"VLM API error: {e}\n{tb}")
+
+
+@router.post("/api/objects/batch", response_model=BatchObjectsResponse)
+async def predict_batch_objects(
+    request: Request,
+    files: List[UploadFile] = File(..., description="Page images, processed together"),
+    bbox_only: bool = Query(False, description="If true, only return bboxes and do not call VLM"),
+    strategy: Literal["crop", "page", "hybrid"] | None = Query(None, description=STRATEGY_DESCRIPTION),
+    session: str | None = Query(None, max_length=128, description="Session whose index of repeated headers and footers the images use (default: one index per batch)"),
+    dedup: bool = Query(True, description="If false, repeated headers and footers are transcribed on every image"),
+) -> BatchObjectsResponse:
+    logger.info(f"Incoming request: {request.method} {request.url.path} from {request.client.host}")
+    logger.info(f"Query params: {dict(request.query_params)}")
+    check_admission()
+    if len(files) > settings.batch_max_files:
+        raise HTTPException(status_code=400, detail=f"Too many files. Max is {settings.batch_max_files} per batch.")
+    logger.info(f"Processing a batch of {len(files)} images")
+
+    block_index = session_index(session, dedup)
+    if block_index is None and session is None and dedup and settings.dedup_enabled:
+        block_index = BlockIndex(settings.dedup_max_items, settings.dedup_max_distance, settings.dedup_reuse_digits)
+    # Images run concurrently, so their segmentation is batched and their VLM calls share the pool
+    slots = asyncio.Semaphore(settings.batch_max_pages_in_flight)
+
+    async def run(index: int, file: UploadFile) -> dict:
+        # Errors are reported per image, the rest of the batch goes on
+        async with slots:
+            try:
+                digest, source = await open_image_upload(file)
+                try:
+                    result = await process_page(source, digest, bbox_only, strategy, block_index=block_index)
+                finally:
+                    source.close()
+                return {"index": index, "filename": file.filename, **result, "error": None}
+            except HTTPException as e:
+                error = e.detail
+            except Exception as e:
+                logger.error(f"Error processing {file.filename} in batch: {e}")
+                error = f"VLM API error: {e}"
+        return {"index": index, "filename": file.filename, "objects": [], "error": error}
+
+    return {"results": await asyncio.gather(*(run(i, file) for i, file in enumerate(files)))}
+
+
+@router.post(
+    "/api/objects/pdf",
+    response_class=StreamingResponse,
+    responses={200: {
+        "description": "One PageObjectsResponse JSON object per line, in the order pages finish",
+        "content": {"application/x-ndjson": {"schema": PageObjectsResponse.model_json_schema()}},
+    }},
+)
+async def predict_pdf_objects(
+    request: Request,
+    file: UploadFile = File(...),
+    bbox_only: bool = Query(False, description="If true, only return bboxes and do not call VLM"),
+    strategy: Literal["crop", "page", "hybrid"] | None = Query(None, description=STRATEGY_DESCRIPTION),
+    first_page: int | None = Query(None, ge=1, description="First page to process (1-based, default: 1)"),
+    last_page: int | None = Query(None, ge=1, description="Last page to process (default: last page of the document)"),
+    dedup: bool = Query(True, description="If false, repeated headers and footers are transcribed on every page"),
+) -> StreamingResponse:
+    logger.info(f"Incoming request: {request.method} {request.url.path} from {request.client.host}")
+    logger.info(f"Query params: {dict(request.query_params)}")
+    check_admission()
+
+    size_bytes = upload_size(file)
+    size_mb = size_bytes / (1024 * 1024)
+    logger.info(f"Received PDF: {file.filename}, size: {size_mb:.2f} MB, content_type: {file.content_type}")
+    if size_bytes > settings.pdf_max_size_mb * 1024 * 1024:
+        logger.warning(f"File too large: {size_mb:.2f} MB (limit: {settings.pdf_max_size_mb} MB)")
+        raise HTTPException(status_code=400, detail=f"File too large. Max size is {settings.pdf_max_size_mb} MB.")
+    if not file.filename.lower().endswith(".pdf"):
+        raise HTTPException(status_code=400, detail="File type not allowed. Only pdf is supported.")
+
+    # pdf2image renders from a path, so the upload is spooled to a temporary file once
+    fd, pdf_path = tempfile.mkstemp(suffix=".pdf")
+    os.close(fd)
+    try:
+        with track_stage("upload_read"):
+            digest = await asyncio.to_thread(save_upload, file, pdf_path)
+        total_pages = await asyncio.to_thread(count_pdf_pages, pdf_path)
+    except Exception as e:
+        os.remove(pdf_path)
+        logger.error(f"Invalid PDF {file.filename}: {e}")
+        raise HTTPException(status_code=400, detail=f"Invalid PDF: {e}")
+
+    start = first_page or 1
+    end = min(last_page or total_pages, total_pages)
+    page_numbers = list(range(start, end + 1))
+    logger.info(f"Processing {len(page_numbers)} of {total_pages} pages from {file.filename}")
+
+    async def stream():
+        try:
+            async for page in process_pdf_pages(pdf_path, page_numbers, f"pdf:{digest}", bbox_only, strategy, dedup):
+                yield json.dumps(page, ensure_ascii=False) + "\n"
+        finally:
+            os.remove(pdf_path)
+
+    return StreamingResponse(stream(), media_type="application/x-ndjson")
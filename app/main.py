@@ -1,9 +1,37 @@
-from fastapi import FastAPI
+import asyncio
+import time
+from contextlib import asynccontextmanager
+
+from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import RedirectResponse
 from app.controllers.objects_controller import router as objects_router
+from app.controllers.health_controller import router as health_router
+from app.controllers.metrics_controller import router as metrics_router
+from app.controllers.jobs_controller import router as jobs_router
+from app.services.job_service import job_runner
+from app.services.metrics_service import REQUEST_SECONDS
+from app.services.page_service import vlm_service
+from app.services.segmentator_service import shutdown_executor
+from app.services.startup_service import warm_up
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Warm up in the background: /health answers right away, /ready once models are loaded
+    warm_up_task = asyncio.create_task(warm_up())
+    # Jobs left running by a previous process are requeued and picked up again
+    await job_runner.start()
+    vlm_service.start_health_checks()
+    yield
+    warm_up_task.cancel()
+    await job_runner.stop()
+    # Release pooled connections and worker threads on shutdown
+    await vlm_service.aclose()
+    await shutdown_executor()
 
-app = FastAPI()
+
+app = FastAPI(lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -13,8 +41,25 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+@app.middleware("http")
+async def track_request_time(request: Request, call_next):
+    # Labelled by route template, not by raw path, to keep the number of series bounded
+    start = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        route = request.scope.get("route")
+        path = route.path if route is not None else "unmatched"
+        REQUEST_SECONDS.labels(path, request.method, str(status)).observe(time.perf_counter() - start)
+
 @app.get("/")
 def root():
     return RedirectResponse(url="/docs")
 
 app.include_router(objects_router)
+app.include_router(jobs_router)
+app.include_router(health_router)
+app.include_router(metrics_router)
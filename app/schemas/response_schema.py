@@ -1,5 +1,5 @@
 from pydantic import BaseModel, Field
-from typing import List, Optional
+from typing import Dict, List, Optional
 
 
 class ObjectBlock(BaseModel):
@@ -7,11 +7,105 @@ class ObjectBlock(BaseModel):
     bbox: List[int] = Field(..., description="Coordinates of the object bounding box [x1, y1, x2, y2]")
     confidence: Optional[float] = Field(None, description="Confidence score for the detection (0.0 to 1.0)")
     text: Optional[str] = Field(None, description="Extracted markdown or text content from the detected area")
+    group: Optional[int] = Field(None, description="Blocks sharing a group id were transcribed by one VLM call; if the answer could not be split per block, the whole text is on the first block of the group")
+
+
+class ProcessingStats(BaseModel):
+    strategy: str = Field(..., description="Processing strategy used for the request (crop, page or hybrid)")
+    vlm_calls: int = Field(0, description="Number of VLM requests made")
+    cached_calls: int = Field(0, description="Number of VLM requests served from the result cache")
+    image_tokens: int = Field(0, description="Image tokens sent to the VLM (one per 28x28 patch)")
+    completion_tokens: int = Field(0, description="Tokens generated by the VLM, when reported by the backend")
+    suppressed_blocks: int = Field(0, description="Detections dropped because they overlap or lie inside another detection")
+    skipped_blocks: int = Field(0, description="Blocks not sent to the VLM because they are too small or almost empty")
+    deduplicated_blocks: int = Field(0, description="Blocks that reused the markdown of a near-identical block seen earlier in the document")
 
 
 class ObjectsResponse(BaseModel):
     objects: List[ObjectBlock]
+    stats: Optional[ProcessingStats] = Field(None, description="VLM usage for this request")
+
+
+class ObjectsEvent(BaseModel):
+    # One line of the streamed /api/objects answer, fields depend on the event
+    event: str = Field(..., description="blocks (detected blocks, text not filled yet), delta (a piece of block text), block (a block is done), done (the whole ObjectsResponse) or error")
+    objects: Optional[List[ObjectBlock]] = Field(None, description="All blocks, in blocks and done events")
+    stats: Optional[ProcessingStats] = Field(None, description="VLM usage for this request, in the done event")
+    block: Optional[int] = Field(None, description="Index of the block in objects, in delta and block events")
+    offset: Optional[int] = Field(None, description="Position of the delta text in the block text; it restarts at 0 when a failed VLM call is retried")
+    text: Optional[str] = Field(None, description="Delta text, or the whole text of a finished block")
+    detail: Optional[str] = Field(None, description="Error message, in the error event")
+
+
+class PageObjectsResponse(ObjectsResponse):
+    page: int = Field(..., description="1-based page number in the source document")
+    error: Optional[str] = Field(None, description="Error message if the page could not be processed")
+
+
+class BatchItemResponse(ObjectsResponse):
+    index: int = Field(..., description="0-based position of the image in the batch request")
+    filename: Optional[str] = Field(None, description="File name of the uploaded image")
+    error: Optional[str] = Field(None, description="Error message if the image could not be processed")
+
+
+class BatchObjectsResponse(BaseModel):
+    results: List[BatchItemResponse] = Field(..., description="One result per uploaded image, in upload order")
+
+
+class LayoutObject(BaseModel):
+    type: str = Field(..., description="Document element type (e.g., heading, paragraph, list, table, image)")
+    bbox: List[int] = Field(..., description="Coordinates of the element bounding box [x1, y1, x2, y2]")
+    text: str = Field(..., description="Markdown content of the element, or the caption for images and tables")
+
+
+class LayoutResponse(BaseModel):
+    # Answer schema for the page-level VLM call
+    objects: List[LayoutObject]
 
 
 class MarkdownResponse(BaseModel):
     markdown: str = Field(..., description="Extracted markdown content from the image")
+
+
+class BlocksResponse(BaseModel):
+    blocks: List[str] = Field(..., description="Extracted markdown content of each block, top to bottom")
+
+
+class HealthResponse(BaseModel):
+    status: str = Field(..., description="Always ok while the process serves requests")
+
+
+class ReadinessResponse(BaseModel):
+    status: str = Field(..., description="Warm-up state: starting, warming_up, ready or failed")
+    error: Optional[str] = Field(None, description="Error message if the warm-up failed")
+    timings: Dict[str, float] = Field(default_factory=dict, description="Duration of each warm-up stage in seconds")
+
+
+class JobPages(BaseModel):
+    total: int = Field(..., description="Pages in the job")
+    done: int = Field(..., description="Pages processed successfully")
+    failed: int = Field(..., description="Pages that failed after all their attempts")
+    pending: int = Field(..., description="Pages not processed yet, or waiting for another attempt")
+
+
+class JobResponse(BaseModel):
+    id: str = Field(..., description="Job id")
+    kind: str = Field(..., description="Input kind: image or pdf")
+    filename: str = Field(..., description="Name of the uploaded file")
+    status: str = Field(..., description="queued, running, completed, failed or cancelled")
+    error: Optional[str] = Field(None, description="Error message if the whole job failed")
+    bbox_only: bool
+    strategy: Optional[str] = None
+    pages: JobPages
+    created_at: float = Field(..., description="Unix time the job was submitted")
+    updated_at: float = Field(..., description="Unix time of the last progress")
+
+
+class JobPageResult(PageObjectsResponse):
+    status: str = Field(..., description="pending, done or failed")
+    attempts: int = Field(..., description="Times the page was processed")
+
+
+class JobResultsResponse(BaseModel):
+    job: JobResponse
+    pages: List[JobPageResult] = Field(..., description="All pages of the job in page order, including unfinished ones")
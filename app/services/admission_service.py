@@ -0,0 +1,41 @@
+import math
+import time
+from contextlib import contextmanager
+
+from app.settings import settings
+
+
+class AdmissionControl:
+    """
+    Counts the pages in process and turns new requests away with 503 once too many are pending,
+    so an overload is absorbed by clients retrying later instead of slowing every request down.
+    """
+
+    def __init__(self, max_pending: int):
+        self.max_pending = max_pending
+        self.pending = 0
+        # Moving average of the page processing time, used for the Retry-After hint
+        self._page_seconds = None
+
+    def retry_after(self) -> int:
+        if self._page_seconds is None:
+            return 1
+        return max(1, min(60, math.ceil(self._page_seconds)))
+
+    def overloaded(self) -> bool:
+        return bool(self.max_pending) and self.pending >= self.max_pending
+
+    @contextmanager
+    def track(self):
+        # Wraps the processing of one page
+        self.pending += 1
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.pending -= 1
+            seconds = time.perf_counter() - start
+            self._page_seconds = seconds if self._page_seconds is None else 0.9 * self._page_seconds + 0.1 * seconds
+
+
+admission = AdmissionControl(settings.admission_max_pending_pages)
@@ -0,0 +1,91 @@
+import asyncio
+import logging
+from collections import OrderedDict
+from typing import Optional
+
+from app.settings import settings
+
+logger = logging.getLogger(__name__)
+
+# Largest ratio of the ink aspects of two matching blocks, re-rendering changes it by a few percent
+MAX_ASPECT_RATIO = 1.2
+
+
+class BlockIndex:
+    """
+    Index of the blocks transcribed so far in one document, so that a near-identical block on a
+    later page (a running header, a footer, a disclaimer) reuses their markdown instead of a VLM
+    call. Blocks match when they have the same type, ink of a similar aspect, and block hashes (see
+    block_hash) within max_distance bits. Markdown with digits is only reused with reuse_digits:
+    a page number or a date can change in pixels too small for the hash. Each entry holds a
+    future that is resolved once its block is transcribed, so pages processed concurrently wait
+    for the first transcription instead of repeating it. The least recently matched entries are
+    evicted above max_items.
+    """
+
+    def __init__(self, max_items: int, max_distance: int, reuse_digits: bool = False):
+        self.max_items = max_items
+        self.max_distance = max_distance
+        self.reuse_digits = reuse_digits
+        self._entries = OrderedDict()
+        self._next_id = 0
+
+    def match(self, block_type: str, key: tuple) -> Optional[asyncio.Future]:
+        # The closest matching entry, its future gives the markdown (None if its transcription failed)
+        aspect, bits = key
+        best, best_distance = None, self.max_distance + 1
+        for entry_id, (entry_type, (entry_aspect, entry_bits), future) in self._entries.items():
+            # Lines of very different length squeezed into the same grid are never the same block
+            if entry_type != block_type or max(aspect, entry_aspect) > MAX_ASPECT_RATIO * min(aspect, entry_aspect):
+                continue
+            distance = (bits ^ entry_bits).bit_count()
+            if distance < best_distance:
+                best, best_distance = entry_id, distance
+        if best is None:
+            return None
+        self._entries.move_to_end(best)
+        return self._entries[best][2]
+
+    def add(self, block_type: str, key: tuple) -> asyncio.Future:
+        # Registers a block whose transcription is about to start, resolve() must be called with its result
+        future = asyncio.get_running_loop().create_future()
+        self._entries[self._next_id] = (block_type, key, future)
+        self._next_id += 1
+        while len(self._entries) > self.max_items:
+            self._entries.popitem(last=False)
+        return future
+
+    def resolve(self, future: asyncio.Future, text: Optional[str]) -> None:
+        # Empty or failed transcriptions are not reused, blocks waiting for them fall back to their own call
+        if text and not self.reuse_digits and any(char.isdigit() for char in text):
+            text = None
+        if not text:
+            for entry_id, entry in list(self._entries.items()):
+                if entry[2] is future:
+                    del self._entries[entry_id]
+        if not future.done():
+            future.set_result(text or None)
+
+
+class BlockIndexStore:
+    """
+    Block indexes of sessions, so that pages of one document sent as separate requests share an
+    index. Only the most recently used max_sessions indexes are kept.
+    """
+
+    def __init__(self, max_sessions: int):
+        self.max_sessions = max_sessions
+        self._indexes = OrderedDict()
+
+    def get(self, session: str) -> BlockIndex:
+        index = self._indexes.get(session)
+        if index is None:
+            index = self._indexes[session] = BlockIndex(settings.dedup_max_items, settings.dedup_max_distance, settings.dedup_reuse_digits)
+            while len(self._indexes) > self.max_sessions:
+                evicted, _ = self._indexes.popitem(last=False)
+                logger.info(f"Evicted block index of session {evicted}")
+        self._indexes.move_to_end(session)
+        return index
+
+
+block_indexes = BlockIndexStore(settings.dedup_max_sessions)
@@ -0,0 +1,144 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import threading
+from collections import OrderedDict
+from typing import Any, Optional
+
+from app.settings import settings
+
+logger = logging.getLogger(__name__)
+
+
+def make_key(*parts) -> str:
+    # Content address of the given parts (bytes are hashed as is, everything else as its str)
+    digest = hashlib.sha256()
+    for part in parts:
+        if not isinstance(part, bytes):
+            part = str(part).encode("utf-8")
+        digest.update(len(part).to_bytes(8, "little"))
+        digest.update(part)
+    return digest.hexdigest()
+
+
+class ResultCache:
+    """
+    Two-tier cache of JSON-serializable results: an in-memory LRU and an optional
+    on-disk tier (one file per key) that survives restarts.
+    """
+
+    def __init__(self, namespace: str, max_items: int, disk_dir: Optional[str] = None, enabled: bool = True):
+        self.namespace = namespace
+        self.max_items = max_items
+        self.disk_dir = os.path.join(disk_dir, namespace) if disk_dir else None
+        self.enabled = enabled
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.disk_dir, key[:2], f"{key}.json")
+
+    def _get_memory(self, key: str) -> Any:
+        with self._lock:
+            value = self._items.get(key)
+            if value is not None:
+                self._items.move_to_end(key)
+                self.hits += 1
+            return value
+
+    def _set_memory(self, key: str, value: Any) -> None:
+        with self._lock:
+            self._items[key] = value
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_items:
+                self._items.popitem(last=False)
+
+    def _get_disk(self, key: str) -> Any:
+        value = None
+        if self.disk_dir is not None:
+            try:
+                with open(self._path(key), "r", encoding="utf-8") as f:
+                    value = json.load(f)
+            except FileNotFoundError:
+                pass
+            except (OSError, ValueError) as e:
+                logger.warning(f"Cache {self.namespace}: unreadable entry {key}: {e}")
+        with self._lock:
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self.disk_hits += 1
+        if value is not None:
+            self._set_memory(key, value)
+        return value
+
+    def _set_disk(self, key: str, value: Any) -> None:
+        if self.disk_dir is None:
+            return
+        path = self._path(key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # Write to a temporary file first so a crash never leaves a half-written entry
+            tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(value, f)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning(f"Cache {self.namespace}: failed to write entry {key}: {e}")
+
+    def get(self, key: str) -> Any:
+        if not self.enabled:
+            return None
+        value = self._get_memory(key)
+        if value is None:
+            value = self._get_disk(key)
+        return value
+
+    def set(self, key: str, value: Any) -> None:
+        if not self.enabled or value is None:
+            return
+        self._set_memory(key, value)
+        self._set_disk(key, value)
+
+    async def aget(self, key: str) -> Any:
+        # Memory hits are served inline, only the disk tier goes to a worker thread
+        if not self.enabled:
+            return None
+        value = self._get_memory(key)
+        if value is None:
+            if self.disk_dir is None:
+                with self._lock:
+                    self.misses += 1
+                return None
+            value = await asyncio.to_thread(self._get_disk, key)
+        return value
+
+    async def aset(self, key: str, value: Any) -> None:
+        if not self.enabled or value is None:
+            return
+        self._set_memory(key, value)
+        if self.disk_dir is not None:
+            await asyncio.to_thread(self._set_disk, key, value)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "items": len(self._items),
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+            }
+
+
+segmentation_cache = ResultCache(
+    "segmentation", settings.cache_max_items, settings.cache_dir, enabled=settings.cache_enabled
+)
+markdown_cache = ResultCache(
+    "markdown", settings.cache_max_items, settings.cache_dir, enabled=settings.cache_enabled
+)
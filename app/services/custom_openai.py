@@ -0,0 +1,29 @@
+from typing import Optional
+
+from guidance.models._openai import OpenAIImageMixin, OpenAIInterpreter
+from guidance.models._base import Model
+
+
+class CustomOpenAI(Model):
+    def __init__(
+        self,
+        model: str,
+        echo: bool = True,
+        *,
+        api_key: Optional[str] = None,
+        sampling_params: Optional[dict] = None,
+        **kwargs,
+    ):
+        interpreter_cls = type(
+            "OpenAIImageInterpreter", (OpenAIImageMixin, OpenAIInterpreter), {}
+        )
+        if sampling_params is None:
+            sampling_params = {
+                "temperature": 0.2,
+                "top_p": 0.95,
+            }
+        super().__init__(
+            interpreter=interpreter_cls(model, api_key=api_key, **kwargs),
+            echo=echo,
+            #sampling_params=sampling_params
+        )
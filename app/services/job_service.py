@@ -0,0 +1,345 @@
+import asyncio
+import json
+import logging
+import os
+import shutil
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Optional
+
+from app.services.page_service import process_page, process_pdf_pages
+from app.utils.image_source import ImageSource
+from app.settings import settings
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    filename TEXT NOT NULL,
+    input_path TEXT NOT NULL,
+    source_id TEXT NOT NULL,
+    bbox_only INTEGER NOT NULL,
+    strategy TEXT,
+    status TEXT NOT NULL,
+    error TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created_at);
+CREATE TABLE IF NOT EXISTS pages (
+    job_id TEXT NOT NULL REFERENCES jobs (id) ON DELETE CASCADE,
+    page INTEGER NOT NULL,
+    status TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    result TEXT,
+    error TEXT,
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (job_id, page)
+);
+"""
+
+# Job statuses: queued -> running -> completed (every page done) or failed (some page gave up)
+# Page statuses: pending -> done, or failed once it ran out of attempts
+FINISHED = {"completed", "failed", "cancelled"}
+
+
+class JobStore:
+    """
+    Persistent job queue in a local SQLite database. Every job keeps one row per page,
+    so progress survives restarts and only unfinished pages are processed again.
+    """
+
+    def __init__(self, path: str):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.row_factory = sqlite3.Row
+        self._lock = threading.Lock()
+        with self._lock:
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA foreign_keys=ON")
+            self._db.executescript(SCHEMA)
+
+    def create(self, job_id: str, kind: str, filename: str, input_path: str, source_id: str,
+               bbox_only: bool, strategy: Optional[str], pages: list) -> None:
+        now = time.time()
+        with self._lock, self._db:
+            self._db.execute("BEGIN")
+            self._db.execute(
+                "INSERT INTO jobs VALUES (?, ?, ?, ?, ?, ?, ?, 'queued', NULL, ?, ?)",
+                (job_id, kind, filename, input_path, source_id, int(bbox_only), strategy, now, now),
+            )
+            self._db.executemany(
+                "INSERT INTO pages (job_id, page, status, updated_at) VALUES (?, ?, 'pending', ?)",
+                [(job_id, page, now) for page in pages],
+            )
+
+    def get(self, job_id: str) -> Optional[dict]:
+        with self._lock:
+            job = self._db.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            if job is None:
+                return None
+            counts = dict(self._db.execute(
+                "SELECT status, COUNT(*) FROM pages WHERE job_id = ? GROUP BY status", (job_id,)
+            ).fetchall())
+        job = dict(job)
+        job["bbox_only"] = bool(job["bbox_only"])
+        job["pages"] = {
+            "total": sum(counts.values()),
+            "done": counts.get("done", 0),
+            "failed": counts.get("failed", 0),
+            "pending": counts.get("pending", 0),
+        }
+        return job
+
+    def results(self, job_id: str) -> list:
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT page, status, attempts, result, error FROM pages WHERE job_id = ? ORDER BY page", (job_id,)
+            ).fetchall()
+        pages = []
+        for row in rows:
+            result = json.loads(row["result"]) if row["result"] else {"objects": []}
+            pages.append({
+                "page": row["page"], **result, "status": row["status"],
+                "attempts": row["attempts"], "error": row["error"],
+            })
+        return pages
+
+    def claim(self) -> Optional[dict]:
+        # Oldest queued job becomes running, the update is atomic so a job is claimed only once
+        now = time.time()
+        with self._lock:
+            row = self._db.execute(
+                "UPDATE jobs SET status = 'running', updated_at = ? WHERE id = ("
+                "SELECT id FROM jobs WHERE status = 'queued' ORDER BY created_at LIMIT 1"
+                ") RETURNING id",
+                (now,),
+            ).fetchone()
+        return self.get(row["id"]) if row else None
+
+    def pending_pages(self, job_id: str) -> list:
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT page FROM pages WHERE job_id = ? AND status = 'pending' ORDER BY page", (job_id,)
+            ).fetchall()
+        return [row["page"] for row in rows]
+
+    def save_page(self, job_id: str, page: int, result: Optional[dict], error: Optional[str], max_attempts: int) -> None:
+        # A failed page stays pending until it used all its attempts
+        now = time.time()
+        with self._lock:
+            if error is None:
+                self._db.execute(
+                    "UPDATE pages SET status = 'done', attempts = attempts + 1, result = ?, error = NULL, updated_at = ? "
+                    "WHERE job_id = ? AND page = ?",
+                    (json.dumps(result, ensure_ascii=False), now, job_id, page),
+                )
+            else:
+                self._db.execute(
+                    "UPDATE pages SET attempts = attempts + 1, error = ?, updated_at = ?, "
+                    "status = CASE WHEN attempts + 1 >= ? THEN 'failed' ELSE 'pending' END "
+                    "WHERE job_id = ? AND page = ?",
+                    (error, now, max_attempts, job_id, page),
+                )
+            self._db.execute("UPDATE jobs SET updated_at = ? WHERE id = ?", (now, job_id))
+
+    def finish(self, job_id: str, status: str, error: Optional[str] = None) -> None:
+        with self._lock:
+            self._db.execute(
+                "UPDATE jobs SET status = ?, error = ?, updated_at = ? WHERE id = ? AND status = 'running'",
+                (status, error, time.time(), job_id),
+            )
+
+    def retry(self, job_id: str) -> bool:
+        # Failed pages get a fresh set of attempts, pages already done are kept
+        now = time.time()
+        with self._lock, self._db:
+            self._db.execute("BEGIN")
+            updated = self._db.execute(
+                "UPDATE jobs SET status = 'queued', error = NULL, updated_at = ? "
+                "WHERE id = ? AND status IN ('completed', 'failed', 'cancelled')",
+                (now, job_id),
+            ).rowcount
+            self._db.execute(
+                "UPDATE pages SET status = 'pending', attempts = 0, updated_at = ? WHERE job_id = ? AND status = 'failed'",
+                (now, job_id),
+            )
+        return bool(updated)
+
+    def cancel(self, job_id: str) -> bool:
+        with self._lock:
+            return bool(self._db.execute(
+                "UPDATE jobs SET status = 'cancelled', updated_at = ? WHERE id = ? AND status IN ('queued', 'running')",
+                (time.time(), job_id),
+            ).rowcount)
+
+    def delete(self, job_id: str) -> bool:
+        with self._lock:
+            return bool(self._db.execute("DELETE FROM jobs WHERE id = ?", (job_id,)).rowcount)
+
+    def requeue_running(self) -> int:
+        # Jobs left running by a previous process are picked up again, done pages are not redone
+        with self._lock:
+            return self._db.execute(
+                "UPDATE jobs SET status = 'queued', updated_at = ? WHERE status = 'running'", (time.time(),)
+            ).rowcount
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
+
+
+class JobRunner:
+    """
+    Pool of asyncio workers that take queued jobs from the store and run them through
+    the page pipeline, saving every page as soon as it is done.
+    """
+
+    def __init__(self, store: JobStore, jobs_dir: str, workers: int, max_attempts: int):
+        self.store = store
+        self.jobs_dir = jobs_dir
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self._wake = None
+        self._tasks = []
+        self._running = {}
+        self._cancelled = set()
+
+    async def submit(self, kind: str, filename: str, upload_path: str, source_id: str,
+                     bbox_only: bool, strategy: Optional[str], pages: list) -> str:
+        """
+        Moves the uploaded file into the job directory and queues the job, returns its id.
+        """
+        job_id = uuid.uuid4().hex
+        job_dir = os.path.join(self.jobs_dir, job_id)
+        input_path = os.path.join(job_dir, f"input{os.path.splitext(filename)[1].lower()}")
+        os.makedirs(job_dir, exist_ok=True)
+        os.replace(upload_path, input_path)
+        await asyncio.to_thread(
+            self.store.create, job_id, kind, filename, input_path, source_id, bbox_only, strategy, pages
+        )
+        if self._wake is not None:
+            self._wake.set()
+        return job_id
+
+    async def get(self, job_id: str) -> Optional[dict]:
+        return await asyncio.to_thread(self.store.get, job_id)
+
+    async def results(self, job_id: str) -> list:
+        return await asyncio.to_thread(self.store.results, job_id)
+
+    async def retry(self, job_id: str) -> bool:
+        retried = await asyncio.to_thread(self.store.retry, job_id)
+        if retried and self._wake is not None:
+            self._wake.set()
+        return retried
+
+    async def cancel(self, job_id: str) -> bool:
+        cancelled = await asyncio.to_thread(self.store.cancel, job_id)
+        task = self._running.get(job_id)
+        if cancelled and task is not None:
+            self._cancelled.add(job_id)
+            task.cancel()
+        return cancelled
+
+    async def delete(self, job_id: str) -> bool:
+        await self.cancel(job_id)
+        deleted = await asyncio.to_thread(self.store.delete, job_id)
+        if deleted:
+            await asyncio.to_thread(shutil.rmtree, os.path.join(self.jobs_dir, job_id), True)
+        return deleted
+
+    async def start(self) -> None:
+        if self._tasks:
+            return
+        requeued = await asyncio.to_thread(self.store.requeue_running)
+        if requeued:
+            logger.info(f"Requeued {requeued} interrupted jobs")
+        self._wake = asyncio.Event()
+        self._tasks = [asyncio.create_task(self._worker(n)) for n in range(self.workers)]
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def _worker(self, n: int) -> None:
+        while True:
+            job = await asyncio.to_thread(self.store.claim)
+            if job is None:
+                # Sleep until a job is submitted, with a timeout in case another process queued it
+                self._wake.clear()
+                try:
+                    await asyncio.wait_for(self._wake.wait(), timeout=5.0)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            task = asyncio.create_task(self._run_job(job))
+            self._running[job["id"]] = task
+            try:
+                await task
+            except asyncio.CancelledError:
+                # Only a job cancelled through the API is swallowed, a stopping worker leaves
+                # its job running in the store so that the next start requeues it
+                if job["id"] not in self._cancelled:
+                    raise
+                logger.info(f"Job {job['id']} cancelled")
+            finally:
+                self._running.pop(job["id"], None)
+                self._cancelled.discard(job["id"])
+
+    async def _run_job(self, job: dict) -> None:
+        job_id = job["id"]
+        logger.info(f"Worker started job {job_id} ({job['kind']}, {job['pages']['total']} pages)")
+        try:
+            # Failed pages stay pending until they run out of attempts, so loop until none is left
+            while pages := await asyncio.to_thread(self.store.pending_pages, job_id):
+                if job["kind"] == "pdf":
+                    await self._run_pdf(job, pages)
+                else:
+                    await self._run_image(job)
+        except Exception as e:
+            logger.error(f"Job {job_id} failed: {e}")
+            await asyncio.to_thread(self.store.finish, job_id, "failed", str(e))
+            return
+        job = await self.get(job_id)
+        status = "failed" if job["pages"]["failed"] else "completed"
+        await asyncio.to_thread(self.store.finish, job_id, status)
+        logger.info(f"Job {job_id} {status}: {job['pages']['done']}/{job['pages']['total']} pages done")
+
+    async def _save(self, job_id: str, page: int, result: Optional[dict], error: Optional[str]) -> None:
+        await asyncio.to_thread(self.store.save_page, job_id, page, result, error, self.max_attempts)
+
+    async def _run_pdf(self, job: dict, pages: list) -> None:
+        async for page in process_pdf_pages(
+            job["input_path"], pages, job["source_id"], job["bbox_only"], job["strategy"]
+        ):
+            error = page.pop("error")
+            page_number = page.pop("page")
+            await self._save(job["id"], page_number, page if error is None else None, error)
+
+    async def _run_image(self, job: dict) -> None:
+        try:
+            source = await asyncio.to_thread(ImageSource, job["input_path"], settings.image_max_pixels)
+            try:
+                result = await process_page(source, job["source_id"], job["bbox_only"], job["strategy"])
+            finally:
+                source.close()
+        except Exception as e:
+            logger.error(f"Error processing job {job['id']}: {e}")
+            await self._save(job["id"], 1, None, str(e))
+            return
+        await self._save(job["id"], 1, result, None)
+
+
+job_runner = JobRunner(
+    JobStore(os.path.join(settings.jobs_dir, "jobs.sqlite3")),
+    settings.jobs_dir,
+    workers=settings.job_workers,
+    max_attempts=settings.job_max_page_attempts,
+)
@@ -0,0 +1,105 @@
+import time
+from contextlib import contextmanager
+
+from prometheus_client import Counter, Gauge, Histogram
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily, REGISTRY
+
+from app.services.admission_service import admission
+from app.services.cache_service import markdown_cache, segmentation_cache
+from app.services.segmentator_service import batcher
+
+# Buckets from a few milliseconds (crop encoding) up to minutes (large pages on a slow VLM)
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+
+REQUEST_SECONDS = Histogram(
+    "img2md_request_duration_seconds",
+    "Time to handle a request, until the response starts",
+    ["route", "method", "status"],
+    buckets=BUCKETS,
+)
+STAGE_SECONDS = Histogram(
+    "img2md_stage_duration_seconds",
+    "Time spent in a processing stage",
+    ["stage", "outcome"],
+    buckets=BUCKETS,
+)
+VLM_CALL_SECONDS = Histogram(
+    "img2md_vlm_call_duration_seconds",
+    "Time of a single VLM call, by block type and outcome (ok, empty, cached or error)",
+    ["block_type", "outcome"],
+    buckets=BUCKETS,
+)
+VLM_BACKEND_SECONDS = Histogram(
+    "img2md_vlm_backend_call_duration_seconds",
+    "Time of a VLM call on one backend, by outcome (ok, invalid, error or cancelled)",
+    ["backend", "outcome"],
+    buckets=BUCKETS,
+)
+VLM_BACKEND_IN_FLIGHT = Gauge("img2md_vlm_backend_in_flight", "VLM calls currently running on a backend", ["backend"])
+VLM_BACKEND_HEALTHY = Gauge("img2md_vlm_backend_healthy", "1 while the backend gets traffic, 0 while it is taken out", ["backend"])
+VLM_STREAM_STOPS = Counter(
+    "img2md_vlm_stream_stops_total",
+    "How streamed VLM answers ended: complete (cut once the JSON closed), stop (ended by the backend) or length (token budget spent)",
+    ["reason"],
+)
+VLM_RETRIES = Counter("img2md_vlm_retries_total", "VLM calls retried, by HTTP status or error type", ["reason"])
+ADMISSION_REJECTED = Counter("img2md_admission_rejected_total", "Requests turned away with 503 because too many pages were pending")
+BLOCKS = Counter("img2md_blocks_total", "Blocks detected by segmentation", ["block_type"])
+SUPPRESSED_BLOCKS = Counter("img2md_suppressed_blocks_total", "Detections dropped because they duplicate another detection", ["block_type"])
+BLANK_BLOCKS = Counter("img2md_blank_blocks_total", "Blocks not sent to the VLM because they are too small or almost empty", ["block_type"])
+DEDUPLICATED_BLOCKS = Counter("img2md_deduplicated_blocks_total", "Blocks that reused the markdown of a near-identical block of the same document", ["block_type"])
+VLM_IN_FLIGHT = Gauge("img2md_vlm_in_flight", "VLM calls currently running")
+SEGMENTATION_IN_FLIGHT = Gauge("img2md_segmentation_in_flight", "Pages currently queued or running in segmentation")
+SEGMENTATION_QUEUE = Gauge("img2md_segmentation_queue_depth", "Pages waiting for a segmentation batch")
+SEGMENTATION_QUEUE.set_function(batcher.queue_depth)
+PAGES_PENDING = Gauge("img2md_pages_pending", "Pages currently in process, compared against the admission threshold")
+PAGES_PENDING.set_function(lambda: admission.pending)
+
+
+@contextmanager
+def track_stage(stage: str):
+    # Observes the time spent in the block, labelled ok or error
+    start = time.perf_counter()
+    outcome = "ok"
+    try:
+        yield
+    except BaseException:
+        outcome = "error"
+        raise
+    finally:
+        STAGE_SECONDS.labels(stage, outcome).observe(time.perf_counter() - start)
+
+
+def observe_stages(timings: dict) -> None:
+    # Records stage timings measured elsewhere in milliseconds, e.g. {"crop_ms": 1.2}
+    for stage, ms in timings.items():
+        STAGE_SECONDS.labels(stage.removesuffix("_ms"), "ok").observe(ms / 1000)
+
+
+class _StatsCollector:
+    """
+    Exposes the counters kept by the result caches and the segmentation batcher.
+    """
+
+    def collect(self):
+        hits = CounterMetricFamily("img2md_cache_hits", "Cache hits, disk tier included", labels=["cache"])
+        disk_hits = CounterMetricFamily("img2md_cache_disk_hits", "Cache hits served by the disk tier", labels=["cache"])
+        misses = CounterMetricFamily("img2md_cache_misses", "Cache misses", labels=["cache"])
+        items = GaugeMetricFamily("img2md_cache_items", "Entries held in memory", labels=["cache"])
+        for cache in (segmentation_cache, markdown_cache):
+            stats = cache.stats()
+            hits.add_metric([cache.namespace], stats["hits"])
+            disk_hits.add_metric([cache.namespace], stats["disk_hits"])
+            misses.add_metric([cache.namespace], stats["misses"])
+            items.add_metric([cache.namespace], stats["items"])
+        yield from (hits, disk_hits, misses, items)
+
+        stats = batcher.stats()
+        yield CounterMetricFamily("img2md_segmentation_batches", "Segmentation batches run", value=stats["batches"])
+        yield CounterMetricFamily("img2md_segmentation_batch_images", "Pages segmented in batches", value=stats["images"])
+        yield GaugeMetricFamily("img2md_segmentation_batch_fill_ratio", "Average batch size over the max batch size", value=stats["batch_fill_rate"])
+        yield GaugeMetricFamily("img2md_segmentation_queue_wait_avg_seconds", "Average wait of a page for its batch", value=stats["queue_wait_avg_ms"] / 1000)
+        yield GaugeMetricFamily("img2md_segmentation_queue_wait_max_seconds", "Longest wait of a page for its batch", value=stats["queue_wait_max_ms"] / 1000)
+
+
+REGISTRY.register(_StatsCollector())
@@ -1,4 +1,6 @@
+import base64
 import requests
+import httpx
 import os
 from app.settings import settings
 
@@ -9,8 +11,13 @@ class OpenAIService:
         self.base_url = self.settings.openai_base_url
         self.model = self.settings.openai_api_model
         self.proxy = getattr(self.settings, 'openai_proxy', None)
+        self._async_client = None
 
-    def predict(self, image_bytes: bytes, prompt: str, model: str = None, **kwargs):
+    @property
+    def chat_completions_url(self) -> str:
+        return self.base_url.rstrip("/") + "/chat/completions"
+
+    def _build_request(self, image_bytes: bytes, prompt: str, model: str = None, mime_type: str = "image/png", **kwargs):
         headers = {
             "Authorization": f"Bearer {self.api_key}",
             "Content-Type": "application/json"
@@ -20,12 +27,34 @@ class OpenAIService:
             "messages": [
                 {"role": "user", "content": [
                     {"type": "text", "text": prompt},
-                    {"type": "image_url", "image_url": "data:image/png;base64," + image_bytes.decode()}
+                    {"type": "image_url", "image_url": {"url": f"data:{mime_type};base64," + base64.b64encode(image_bytes).decode()}}
                 ]}
             ],
             **kwargs
         }
+        return headers, data
+
+    def predict(self, image_bytes: bytes, prompt: str, model: str = None, **kwargs):
+        headers, data = self._build_request(image_bytes, prompt, model, **kwargs)
         proxies = {"http": self.proxy, "https": self.proxy} if self.proxy else None
-        response = requests.post(self.base_url, json=data, headers=headers, proxies=proxies)
+        response = requests.post(self.chat_completions_url, json=data, headers=headers, proxies=proxies)
         response.raise_for_status()
         return response.json()
+
+    def get_async_client(self) -> httpx.AsyncClient:
+        # One pooled client per service, connections are reused across requests
+        if self._async_client is None:
+            self._async_client = httpx.AsyncClient(
+                proxy=self.proxy,
+                timeout=httpx.Timeout(self.settings.vlm_timeout, connect=10.0),
+                limits=httpx.Limits(
+                    max_connections=self.settings.vlm_max_concurrency,
+                    max_keepalive_connections=self.settings.vlm_max_concurrency,
+                ),
+            )
+        return self._async_client
+
+    async def aclose(self) -> None:
+        if self._async_client is not None:
+            await self._async_client.aclose()
+            self._async_client = None
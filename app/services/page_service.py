@@ -0,0 +1,494 @@
+import asyncio
+import io
+import logging
+import math
+import time
+
+import numpy as np
+from PIL import Image
+
+from app.services.vlm_service import VLMService, add_usage
+from app.services.admission_service import admission
+from app.services.segmentator_service import run_segmentation_async
+from app.services.cache_service import segmentation_cache, make_key
+from app.services.metrics_service import (
+    BLANK_BLOCKS, BLOCKS, DEDUPLICATED_BLOCKS, SEGMENTATION_IN_FLIGHT, SUPPRESSED_BLOCKS, VLM_CALL_SECONDS, VLM_IN_FLIGHT, observe_stages, track_stage,
+)
+from app.services.block_index import BlockIndex
+from app.utils.block_hash import block_hash
+from app.utils.encode_crop import encode_crop
+from app.utils.group_blocks import group_blocks
+from app.utils.image_source import ImageSource
+from app.utils.is_blank_crop import is_blank_crop
+from app.utils.suppress_overlaps import suppress_overlaps
+from app.utils.stack_crops import stack_crops
+from app.utils.rasterize_pdf import rasterize_pdf_page
+from app.settings import settings
+
+logger = logging.getLogger(__name__)
+
+# Allowed types for VLM processing (except Picture)
+ALLOWED_TYPES = {
+    "text", "caption", "section-header", "footnote", "formula", "table",
+    "list-item", "page-header", "page-footer", "title"
+}
+
+vlm_service = VLMService()
+
+# Shared across all requests to cap the total number of VLM calls in flight
+_vlm_semaphore = asyncio.Semaphore(settings.vlm_max_concurrency)
+
+
+def _encode_crop(img: Image.Image, bbox: list) -> bytes:
+    crop_bytes, timings = encode_crop(
+        img,
+        bbox,
+        format=settings.crop_format,
+        quality=settings.crop_quality,
+        png_compress_level=settings.crop_png_compress_level,
+        max_pixels=settings.crop_max_pixels,
+    )
+    observe_stages(timings)
+    stages = ", ".join(f"{stage} {ms:.1f}" for stage, ms in timings.items())
+    logger.debug(f"Encoded crop {bbox} as {settings.crop_format}: {len(crop_bytes)} bytes, {stages}")
+    return crop_bytes
+
+
+async def _call_vlm(block_type: str, usage: dict, fn, *args, **kwargs):
+    # Runs one VLM call and records its duration and outcome
+    call_usage = {}
+    outcome = "error"
+    start = time.perf_counter()
+    VLM_IN_FLIGHT.inc()
+    try:
+        result = await fn(*args, usage=call_usage, **kwargs)
+        if call_usage.get("cached_calls"):
+            outcome = "cached"
+        else:
+            outcome = "ok" if result else "empty"
+        return result
+    finally:
+        VLM_IN_FLIGHT.dec()
+        VLM_CALL_SECONDS.labels(block_type, outcome).observe(time.perf_counter() - start)
+        add_usage(usage, **call_usage)
+
+
+def _token_budget(block_type: str, bbox: list) -> int:
+    # The answer grows with the block area, tables and formulas spend more tokens on markup per pixel
+    x1, y1, x2, y2 = bbox
+    factor = settings.vlm_token_budget_factors.get(block_type.lower(), 1.0)
+    budget = settings.vlm_max_tokens_base + math.ceil((x2 - x1) * (y2 - y1) * factor / settings.vlm_pixels_per_token)
+    return min(budget, settings.vlm_max_tokens_limit)
+
+
+async def _extract_block_text(
+    obj: dict,
+    img: Image.Image,
+    semaphore: asyncio.Semaphore,
+    usage: dict,
+    on_text=None,
+) -> None:
+    # Run VLM for a single block, failures are kept local to the block.
+    # With streaming on, on_text(offset, text) gets the transcription while it is generated.
+    type = obj["type"]
+    async with semaphore, _vlm_semaphore:
+        try:
+            crop_bytes = await asyncio.to_thread(_encode_crop, img, obj["bbox"])
+            # Streamed calls are plain chat completions, so only the direct engine streams
+            if settings.vlm_stream_enabled and settings.vlm_engine == "direct":
+                # The token budget guards streams against answers that run away, it only applies to them
+                max_tokens = _token_budget(type, obj["bbox"])
+                logger.info(f"Calling VLM for block type: {type} bbox: {obj['bbox']} max_tokens: {max_tokens}")
+                text = await _call_vlm(type, usage, vlm_service.astream_markdown, crop_bytes, max_tokens, on_text=on_text)
+            else:
+                logger.info(f"Calling VLM for block type: {type} bbox: {obj['bbox']}")
+                text = await _call_vlm(type, usage, vlm_service.aextract_markdown, crop_bytes)
+            if text is None:
+                logger.warning(f"VLM returned None for block type: {type}")
+                text = ""
+            else:
+                logger.info(f"VLM result for block type: {type}: {text}")
+        except Exception as e:
+            logger.error(f"VLM error for block {type}: {e}")
+            text = ""
+    obj["text"] = text
+
+
+async def _extract_deduplicated(
+    obj: dict,
+    img: Image.Image,
+    semaphore: asyncio.Semaphore,
+    usage: dict,
+    on_text,
+    index: BlockIndex,
+    key: tuple,
+) -> None:
+    # Reuses the markdown of a near-identical block seen earlier in the document, waiting for it if it
+    # is still being transcribed. A block without a match is transcribed and recorded in the index.
+    future = index.match(obj["type"], key)
+    if future is not None:
+        # Shielded, a cancelled waiter must not cancel the transcription other blocks wait for
+        text = await asyncio.shield(future)
+        if text:
+            obj["text"] = text
+            DEDUPLICATED_BLOCKS.labels(obj["type"]).inc()
+            add_usage(usage, deduplicated_blocks=1)
+            if on_text is not None:
+                on_text(0, text)
+            return
+        await _extract_block_text(obj, img, semaphore, usage, on_text)
+        return
+    future = index.add(obj["type"], key)
+    try:
+        await _extract_block_text(obj, img, semaphore, usage, on_text)
+    finally:
+        index.resolve(future, obj["text"])
+
+
+def _block_hashes(img: Image.Image, objects: list, indices: list) -> dict:
+    return {i: block_hash(img, objects[i]["bbox"], ink_contrast=settings.blank_ink_contrast) for i in indices}
+
+
+def _postprocess_detections(detections: list, width: int, height: int) -> tuple[list, int]:
+    """
+    Clamps all boxes to the page, drops low confidence and empty boxes, and suppresses boxes that
+    duplicate the pixels of another one, so the same text is never transcribed twice. Transcribed
+    blocks and pictures are suppressed separately, a picture never drops a text block.
+    Returns the objects in detection order and the number of suppressed boxes.
+    """
+    if not detections:
+        return [], 0
+    boxes = np.array([det["bbox"] for det in detections], dtype=np.float64).reshape(-1, 4)
+    boxes = np.clip(np.rint(boxes), 0, [width, height, width, height])
+    scores = np.array([det.get("confidence") or 0.0 for det in detections])
+    valid = (scores >= settings.detection_min_confidence) & (boxes[:, 2] > boxes[:, 0]) & (boxes[:, 3] > boxes[:, 1])
+    keep = valid.copy()
+    if settings.detection_suppression_enabled and valid.sum() > 1:
+        ranking = {type: len(settings.detection_type_priority) - n for n, type in enumerate(settings.detection_type_priority)}
+        priorities = np.array([ranking.get(det["type"].lower(), 0) for det in detections])
+        transcribed = np.array([det["type"].lower() in ALLOWED_TYPES for det in detections])
+        # A picture gives no text, so it must never hide a block that does: each kind only suppresses its own
+        for kind in (valid & transcribed, valid & ~transcribed):
+            keep[kind] = suppress_overlaps(
+                boxes[kind],
+                scores[kind],
+                priorities[kind],
+                iou_threshold=settings.detection_iou_threshold,
+                containment_threshold=settings.detection_containment_threshold,
+                score_gap=settings.detection_score_gap,
+            )
+    for i in np.flatnonzero(valid & ~keep):
+        SUPPRESSED_BLOCKS.labels(detections[i]["type"]).inc()
+    objects = [
+        {
+            "type":       detections[i]["type"],
+            "bbox":       boxes[i].astype(int).tolist(),  # [x1, y1, x2, y2]
+            "confidence": detections[i].get("confidence"),
+            "text":       None,
+        }
+        for i in np.flatnonzero(keep)
+    ]
+    return objects, int((valid & ~keep).sum())
+
+
+def _find_blank_blocks(img: Image.Image, objects: list, indices: list) -> set:
+    return {
+        i for i in indices
+        if is_blank_crop(
+            img,
+            objects[i]["bbox"],
+            min_side=settings.blank_min_side,
+            min_ink_ratio=settings.blank_min_ink_ratio,
+            ink_contrast=settings.blank_ink_contrast,
+        )
+    }
+
+
+def _encode_group(img: Image.Image, bboxes: list) -> bytes:
+    tile = stack_crops(img, bboxes)
+    return _encode_crop(tile, [0, 0, tile.width, tile.height])
+
+
+async def _extract_group_text(
+    group: list,
+    img: Image.Image,
+    semaphore: asyncio.Semaphore,
+    usage: dict,
+    group_id: int,
+) -> None:
+    # Run one VLM call for several blocks stacked on a single tile and split the answer back per block.
+    # If the answer does not have one entry per block, the whole text is attached to the first block.
+    types = ", ".join(obj["type"] for obj in group)
+    async with semaphore, _vlm_semaphore:
+        try:
+            tile_bytes = await asyncio.to_thread(_encode_group, img, [obj["bbox"] for obj in group])
+            logger.info(f"Calling VLM for group {group_id} of {len(group)} blocks: {types}")
+            blocks = await _call_vlm("group", usage, vlm_service.aextract_markdown_blocks, tile_bytes, len(group))
+            if blocks is None:
+                logger.warning(f"VLM returned None for group {group_id}")
+                blocks = []
+            elif len(blocks) != len(group):
+                logger.warning(f"VLM returned {len(blocks)} blocks for group {group_id} of {len(group)}, attaching text to the group")
+                blocks = ["\n\n".join(block for block in blocks if block.strip())]
+        except Exception as e:
+            logger.error(f"VLM error for group {group_id} ({types}): {e}")
+            blocks = []
+    for i, obj in enumerate(group):
+        obj["text"] = blocks[i] if i < len(blocks) else ""
+        obj["group"] = group_id
+
+
+def _clamp_bbox(bbox: list, width: int, height: int) -> list:
+    x1, y1, x2, y2 = map(int, bbox)
+    # Clamp coordinates to image size
+    x1 = max(0, min(x1, width - 1))
+    y1 = max(0, min(y1, height - 1))
+    x2 = max(0, min(x2, width))
+    y2 = max(0, min(y2, height))
+    return [x1, y1, x2, y2]
+
+
+def _encode_page(img: Image.Image) -> tuple[bytes, float, float]:
+    # Encodes the whole page for a single VLM call, returns the bytes and the x and y scales back to page pixels
+    width, height = img.size
+    page_bytes, _ = encode_crop(
+        img,
+        [0, 0, width, height],
+        format=settings.crop_format,
+        quality=settings.crop_quality,
+        png_compress_level=settings.crop_png_compress_level,
+        max_pixels=settings.page_max_pixels,
+    )
+    with Image.open(io.BytesIO(page_bytes)) as encoded:
+        encoded_width, encoded_height = encoded.size
+    # Padding only adds to the right and bottom, so a page that was not resized keeps its coordinates.
+    # A resize snaps each side to the 28-px grid on its own, so the two ratios differ.
+    if encoded_width < width or encoded_height < height:
+        return page_bytes, width / encoded_width, height / encoded_height
+    return page_bytes, 1.0, 1.0
+
+
+async def _process_whole_page(source: ImageSource, usage: dict) -> list:
+    # Single VLM call that finds and transcribes all blocks of the page
+    width, height = source.size
+    # The page is sent within the page_max_pixels budget, so it is decoded at about that size
+    max_side = math.ceil(max(width, height) * min(1.0, math.sqrt(settings.page_max_pixels / (width * height))))
+    with track_stage("decode"):
+        img, sx, sy = await asyncio.to_thread(source.reduced, max_side)
+    page_bytes, scale_x, scale_y = await asyncio.to_thread(_encode_page, img)
+    async with _vlm_semaphore:
+        logger.info(f"Calling VLM for the whole page {width}x{height}")
+        result = await _call_vlm("page", usage, vlm_service.apredict_objects, page_bytes)
+    objects = []
+    for item in result["objects"]:
+        if len(item["bbox"]) != 4:
+            logger.warning(f"VLM returned an invalid bbox for a {item['type']} block: {item['bbox']}")
+            continue
+        # From the encoded page back to the decoded copy, then to full resolution
+        x1, y1, x2, y2 = item["bbox"]
+        x1, y1, x2, y2 = x1 * scale_x * sx, y1 * scale_y * sy, x2 * scale_x * sx, y2 * scale_y * sy
+        type = item["type"].lower()
+        objects.append({
+            # Keep the segmentator naming for graphics, so clients handle both strategies alike
+            "type":       "picture" if type == "image" else type,
+            "bbox":       _clamp_bbox([x1, y1, x2, y2], width, height),
+            "confidence": None,
+            "text":       item["text"],
+        })
+    return objects
+
+
+async def process_page(
+    image: ImageSource | Image.Image,
+    source_id: bytes | str,
+    bbox_only: bool = False,
+    strategy: str | None = None,
+    on_event=None,
+    block_index: BlockIndex | None = None,
+) -> dict:
+    """
+    Segments a page and extracts markdown for its blocks, returns an ObjectsResponse dict.
+    source_id identifies the page content (e.g. the digest of the upload) and keys the segmentation cache.
+    strategy is one of "crop" (one VLM call per block), "page" (one VLM call for the whole page,
+    no segmentation) or "hybrid" (adjacent small blocks of compatible types share one VLM call).
+    Segmentation runs on a reduced copy of the page, the full resolution is only decoded for crops.
+    on_event, if given, is called with progress events of the crop and hybrid strategies:
+    {"event": "blocks", "objects"} once the blocks are known, {"event": "delta", "block", "offset",
+    "text"} while a block is being transcribed (offset restarts at 0 if the call is retried) and
+    {"event": "block", "block", "text"} when a block is done.
+    block_index, if given, is the dedup index of the document the page belongs to: blocks of the
+    types in settings.dedup_block_types that match a block seen earlier reuse its markdown.
+    """
+    source = image if isinstance(image, ImageSource) else ImageSource(image)
+    # Counted as pending for admission control until the page is done
+    with admission.track():
+        return await _process_page(source, source_id, bbox_only, strategy, on_event, block_index)
+
+
+async def _notify_blocks(task, objects: list, indices: list, on_event) -> None:
+    await task
+    for i in indices:
+        on_event({"event": "block", "block": i, "text": objects[i]["text"]})
+
+
+async def _process_page(
+    source: ImageSource,
+    source_id: bytes | str,
+    bbox_only: bool,
+    strategy: str | None,
+    on_event,
+    block_index: BlockIndex | None,
+) -> dict:
+    strategy = strategy or settings.processing_strategy
+    width, height = source.size
+    logger.info(f"Original image size: {width}x{height}, strategy: {strategy}")
+    usage = {}
+
+    if strategy == "page" and not bbox_only:
+        objects = await _process_whole_page(source, usage)
+        return {"objects": objects, "stats": {"strategy": strategy, **usage}}
+
+    # Run segmentation to get layout blocks, unchanged pages are served from the cache
+    cache_key = make_key(
+        "segmentation",
+        settings.segmentator_repo,
+        settings.segmentator_filename,
+        settings.segmentator_backend,
+        settings.segmentator_precision,
+        settings.segmentation_max_side,
+        source_id,
+    )
+    detections = await segmentation_cache.aget(cache_key)
+    if detections is None:
+        with track_stage("decode"):
+            reduced, sx, sy = await asyncio.to_thread(source.reduced, settings.segmentation_max_side)
+        with track_stage("segmentation"), SEGMENTATION_IN_FLIGHT.track_inprogress():
+            detections = await run_segmentation_async(reduced)
+        del reduced
+        # Boxes are cached in full resolution pixels
+        for det in detections:
+            x1, y1, x2, y2 = det["bbox"]
+            det["bbox"] = [x1 * sx, y1 * sy, x2 * sx, y2 * sy]
+        await segmentation_cache.aset(cache_key, detections)
+    logger.info(f"Segmentation found {len(detections)} blocks")
+    for det in detections:
+        logger.info(f"Detected block type: {det['type']}")
+        BLOCKS.labels(det["type"]).inc()
+
+    objects, suppressed = _postprocess_detections(detections, width, height)
+    if suppressed:
+        logger.info(f"Suppressed {suppressed} overlapping blocks")
+        add_usage(usage, suppressed_blocks=suppressed)
+
+    if not bbox_only:
+        indices = [i for i, obj in enumerate(objects) if obj["type"].lower() in ALLOWED_TYPES]
+        if indices:
+            with track_stage("decode"):
+                img = await asyncio.to_thread(source.full)
+        if settings.blank_filter_enabled and indices:
+            # Slivers and empty boxes would only come back as "" after a full VLM round-trip
+            blank = await asyncio.to_thread(_find_blank_blocks, img, objects, indices)
+            for i in blank:
+                objects[i]["text"] = ""
+                BLANK_BLOCKS.labels(objects[i]["type"]).inc()
+            if blank:
+                logger.info(f"Skipping {len(blank)} blank blocks")
+                add_usage(usage, skipped_blocks=len(blank))
+            indices = [i for i in indices if i not in blank]
+        hashes = {}
+        if block_index is not None and indices:
+            # Repeated blocks are looked up one by one, they are never grouped with other blocks
+            dedup_types = {block_type.lower() for block_type in settings.dedup_block_types}
+            repeated = [i for i in indices if objects[i]["type"].lower() in dedup_types]
+            hashes = await asyncio.to_thread(_block_hashes, img, objects, repeated)
+        if strategy == "hybrid":
+            # Layout-aware grouping: adjacent small blocks of compatible types share one VLM call
+            groups = group_blocks(
+                objects,
+                [i for i in indices if i not in hashes],
+                small_block_pixels=settings.hybrid_small_block_pixels,
+                max_gap=settings.hybrid_max_gap,
+                max_group_pixels=settings.hybrid_max_group_pixels,
+                max_group_blocks=settings.hybrid_max_group_blocks,
+            ) + [[i] for i in hashes]
+        else:
+            groups = [[i] for i in indices]
+        if on_event is not None:
+            on_event({"event": "blocks", "objects": objects})
+        semaphore = asyncio.Semaphore(settings.vlm_max_concurrency_per_request)
+        tasks = []
+        for n, group in enumerate(groups):
+            if len(group) == 1:
+                i = group[0]
+                on_text = None
+                if on_event is not None:
+                    on_text = lambda offset, text, i=i: on_event({"event": "delta", "block": i, "offset": offset, "text": text})
+                if i in hashes:
+                    task = _extract_deduplicated(objects[i], img, semaphore, usage, on_text, block_index, hashes[i])
+                else:
+                    task = _extract_block_text(objects[i], img, semaphore, usage, on_text)
+            else:
+                task = _extract_group_text([objects[i] for i in group], img, semaphore, usage, group_id=n)
+            tasks.append(task if on_event is None else _notify_blocks(task, objects, group, on_event))
+        # Blocks are extracted concurrently, each task fills its own objects so detection order is kept
+        await asyncio.gather(*tasks)
+    return {"objects": objects, "stats": {"strategy": strategy, **usage}}
+
+
+async def process_pdf_pages(
+    pdf_path: str,
+    page_numbers: list,
+    source_id: str,
+    bbox_only: bool = False,
+    strategy: str | None = None,
+    dedup: bool = True,
+):
+    """
+    Pipelines a PDF: pages are rasterized lazily one at a time while earlier pages are being
+    segmented and extracted. Yields {"page", "objects", "error"} dicts in completion order.
+    At most settings.pdf_max_pages_in_flight rendered pages are held in memory.
+    With dedup (and settings.dedup_enabled), the pages share one index of repeated blocks.
+    """
+    block_index = None
+    if dedup and settings.dedup_enabled:
+        block_index = BlockIndex(settings.dedup_max_items, settings.dedup_max_distance, settings.dedup_reuse_digits)
+    results = asyncio.Queue()
+    slots = asyncio.Semaphore(settings.pdf_max_pages_in_flight)
+    tasks = set()
+
+    async def run_page(page_number: int, img: Image.Image) -> None:
+        try:
+            page_id = f"{source_id}:{page_number}:{settings.pdf_dpi}"
+            result = await process_page(img, page_id, bbox_only, strategy, block_index=block_index)
+            await results.put({"page": page_number, **result, "error": None})
+        except Exception as e:
+            logger.error(f"Error processing page {page_number} of {pdf_path}: {e}")
+            await results.put({"page": page_number, "objects": [], "error": str(e)})
+        finally:
+            slots.release()
+
+    async def produce() -> None:
+        for page_number in page_numbers:
+            # Wait for a free slot before rendering, so rasterization never runs far ahead
+            await slots.acquire()
+            try:
+                with track_stage("rasterize"):
+                    img = await asyncio.to_thread(rasterize_pdf_page, pdf_path, page_number, settings.pdf_dpi)
+            except Exception as e:
+                slots.release()
+                logger.error(f"Error rasterizing page {page_number} of {pdf_path}: {e}")
+                await results.put({"page": page_number, "objects": [], "error": str(e)})
+                continue
+            task = asyncio.create_task(run_page(page_number, img))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+
+    producer = asyncio.create_task(produce())
+    try:
+        for _ in page_numbers:
+            yield await results.get()
+    finally:
+        # Stop the remaining work if the consumer goes away early (e.g. client disconnect)
+        producer.cancel()
+        for task in list(tasks):
+            task.cancel()
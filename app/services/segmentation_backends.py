@@ -0,0 +1,265 @@
+import json
+import logging
+import os
+import shutil
+import threading
+
+import cv2
+import numpy as np
+from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+# Same defaults as the ultralytics predictor, so every backend returns the same detections
+CONF_THRESHOLD = 0.25
+IOU_THRESHOLD = 0.7
+MAX_DETECTIONS = 300
+STRIDE = 32
+
+# Exports are slow and write to disk, only one thread may run them at a time
+_export_lock = threading.Lock()
+
+
+def export_path(export_dir: str, model_path: str, backend: str, precision: str) -> str:
+    stem = os.path.splitext(os.path.basename(model_path))[0]
+    suffix = ".onnx" if backend == "onnx" else "_openvino_model"
+    return os.path.join(export_dir, f"{stem}-{precision}{suffix}")
+
+
+def export_model(model_path: str, backend: str, precision: str, export_dir: str, int8_data: str | None = None) -> str:
+    """
+    Exports the PyTorch weights to ONNX or OpenVINO once and returns the path of the cached export.
+    Class names and the input size are stored next to it, so loading an export never needs PyTorch.
+    """
+    path = export_path(export_dir, model_path, backend, precision)
+    with _export_lock:
+        if os.path.exists(path):
+            return path
+        if backend == "onnx" and precision == "fp16":
+            raise ValueError("fp16 is not supported by the onnx backend on CPU, use fp32 or int8")
+
+        from ultralytics import YOLO
+
+        logger.info(f"Exporting {model_path} to {backend} ({precision}), this is done only once")
+        model = YOLO(model_path)
+        imgsz = model.overrides.get("imgsz", 640)
+        options = {"imgsz": imgsz, "dynamic": True, "device": "cpu"}
+        if backend == "openvino":
+            options.update(half=precision == "fp16", int8=precision == "int8")
+            if precision == "int8" and int8_data:
+                options["data"] = int8_data
+        exported = str(model.export(format=backend, **options)).rstrip(os.sep)
+
+        os.makedirs(export_dir, exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        if backend == "onnx" and precision == "int8":
+            # ultralytics has no INT8 ONNX export, quantize the weights of the FP32 export instead
+            from onnxruntime.quantization import QuantType, quantize_dynamic
+            quantize_dynamic(exported, tmp_path, weight_type=QuantType.QUInt8)
+            os.remove(exported)
+        else:
+            shutil.move(exported, tmp_path)
+        if backend == "openvino":
+            meta_path = os.path.join(tmp_path, "segmentator.json")
+        else:
+            meta_path = f"{path}.json"
+        with open(meta_path, "w", encoding="utf-8") as f:
+            json.dump({"names": model.names, "imgsz": imgsz}, f)
+        # Publish the export last, so an interrupted export is never picked up as complete
+        os.replace(tmp_path, path)
+        logger.info(f"Exported segmentator to {path}")
+        return path
+
+
+def _read_meta(path: str) -> tuple[dict, int]:
+    meta_path = os.path.join(path, "segmentator.json") if os.path.isdir(path) else f"{path}.json"
+    with open(meta_path, "r", encoding="utf-8") as f:
+        meta = json.load(f)
+    names = {int(k): v for k, v in meta["names"].items()}
+    imgsz = meta["imgsz"]
+    return names, imgsz if isinstance(imgsz, int) else max(imgsz)
+
+
+def _as_array(image) -> np.ndarray:
+    if isinstance(image, str):
+        image = Image.open(image)
+    return np.asarray(image.convert("RGB"))
+
+
+def _letterbox(image: np.ndarray, size: int, auto: bool) -> tuple[np.ndarray, float, tuple]:
+    # Mirrors ultralytics LetterBox: resize keeping the aspect ratio, then pad with gray around
+    height, width = image.shape[:2]
+    ratio = min(size / height, size / width)
+    new_width, new_height = round(width * ratio), round(height * ratio)
+    dw, dh = size - new_width, size - new_height
+    if auto:
+        # Minimal rectangle, only pad up to the network stride
+        dw, dh = dw % STRIDE, dh % STRIDE
+    dw, dh = dw / 2, dh / 2
+    if (width, height) != (new_width, new_height):
+        image = cv2.resize(image, (new_width, new_height), interpolation=cv2.INTER_LINEAR)
+    top, bottom = round(dh - 0.1), round(dh + 0.1)
+    left, right = round(dw - 0.1), round(dw + 0.1)
+    image = cv2.copyMakeBorder(image, top, bottom, left, right, cv2.BORDER_CONSTANT, value=(114, 114, 114))
+    return image, ratio, (left, top)
+
+
+def _nms(boxes: np.ndarray, scores: np.ndarray, iou_threshold: float) -> list:
+    order = scores.argsort()[::-1]
+    areas = (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+    keep = []
+    while order.size and len(keep) < MAX_DETECTIONS:
+        i = order[0]
+        keep.append(i)
+        rest = order[1:]
+        x1 = np.maximum(boxes[i, 0], boxes[rest, 0])
+        y1 = np.maximum(boxes[i, 1], boxes[rest, 1])
+        x2 = np.minimum(boxes[i, 2], boxes[rest, 2])
+        y2 = np.minimum(boxes[i, 3], boxes[rest, 3])
+        inter = np.clip(x2 - x1, 0, None) * np.clip(y2 - y1, 0, None)
+        iou = inter / (areas[i] + areas[rest] - inter + 1e-7)
+        order = rest[iou <= iou_threshold]
+    return keep
+
+
+def _postprocess(output: np.ndarray, names: dict, ratio: float, pad: tuple, shape: tuple) -> list:
+    # output is (4 + classes, anchors): box centers and sizes, then one score per class
+    predictions = output.T
+    scores = predictions[:, 4:].max(axis=1)
+    predictions = predictions[scores > CONF_THRESHOLD]
+    scores = scores[scores > CONF_THRESHOLD]
+    if not len(predictions):
+        return []
+    classes = predictions[:, 4:].argmax(axis=1)
+    xy, wh = predictions[:, :2], predictions[:, 2:4]
+    boxes = np.concatenate([xy - wh / 2, xy + wh / 2], axis=1)
+    # Offset boxes by class, so that suppression only happens within a class
+    keep = _nms(boxes + classes[:, None] * 7680.0, scores, IOU_THRESHOLD)
+    height, width = shape
+    detections = []
+    for i in keep:
+        x1, y1, x2, y2 = boxes[i]
+        x1, x2 = ((v - pad[0]) / ratio for v in (x1, x2))
+        y1, y2 = ((v - pad[1]) / ratio for v in (y1, y2))
+        detections.append({
+            "type": names[int(classes[i])],
+            "bbox": [
+                float(np.clip(x1, 0, width)), float(np.clip(y1, 0, height)),
+                float(np.clip(x2, 0, width)), float(np.clip(y2, 0, height)),
+            ],
+            "confidence": float(scores[i]),
+        })
+    return detections
+
+
+class TorchSegmentator:
+    """
+    Original PyTorch model through ultralytics.
+    """
+
+    def __init__(self, model_path: str, threads: int | None = None):
+        from ultralytics import YOLO
+
+        if threads:
+            import torch
+            torch.set_num_threads(threads)
+        self.model = YOLO(model_path)
+
+    def fuse(self) -> None:
+        # ultralytics fuses conv and batch norm layers on first predict, unless already done
+        self.model.fuse()
+
+    def predict(self, images: list) -> list:
+        results = self.model(source=images, show_labels=False, show_conf=False, show_boxes=True)
+        detections = []
+        for result in results:
+            # One device-to-host copy per page instead of one per box
+            boxes = result.boxes.xyxy.cpu().numpy().tolist()
+            classes = result.boxes.cls.cpu().numpy().astype(int).tolist()
+            scores = result.boxes.conf.cpu().numpy().tolist()
+            detections.append([
+                {"type": result.names[cls], "bbox": box, "confidence": score}
+                for box, cls, score in zip(boxes, classes, scores)
+            ])
+        return detections
+
+
+class ExportedSegmentator:
+    """
+    Base for exported models: letterboxing and box decoding are done with numpy,
+    so neither PyTorch nor ultralytics is loaded at serving time.
+    """
+
+    def __init__(self, path: str):
+        self.names, self.imgsz = _read_meta(path)
+
+    def _infer(self, batch: np.ndarray) -> np.ndarray:
+        raise NotImplementedError
+
+    def predict(self, images: list) -> list:
+        arrays = [_as_array(image) for image in images]
+        # Like ultralytics, use minimal padding only when all pages have the same size
+        auto = len({array.shape for array in arrays}) == 1
+        inputs = [_letterbox(array, self.imgsz, auto) for array in arrays]
+        batch = np.stack([image for image, _, _ in inputs])
+        batch = np.ascontiguousarray(batch.transpose(0, 3, 1, 2), dtype=np.float32) / 255.0
+        outputs = self._infer(batch)
+        return [
+            _postprocess(output, self.names, ratio, pad, array.shape[:2])
+            for output, (_, ratio, pad), array in zip(outputs, inputs, arrays)
+        ]
+
+
+class OnnxSegmentator(ExportedSegmentator):
+    def __init__(self, path: str, threads: int | None = None):
+        import onnxruntime
+
+        super().__init__(path)
+        options = onnxruntime.SessionOptions()
+        if threads:
+            options.intra_op_num_threads = threads
+            options.inter_op_num_threads = 1
+        self.session = onnxruntime.InferenceSession(path, options, providers=["CPUExecutionProvider"])
+        self.input_name = self.session.get_inputs()[0].name
+
+    def _infer(self, batch: np.ndarray) -> np.ndarray:
+        return self.session.run(None, {self.input_name: batch})[0]
+
+
+class OpenVINOSegmentator(ExportedSegmentator):
+    def __init__(self, path: str, threads: int | None = None):
+        import openvino as ov
+
+        super().__init__(path)
+        xml_path = next(os.path.join(path, name) for name in os.listdir(path) if name.endswith(".xml"))
+        config = {"PERFORMANCE_HINT": "LATENCY"}
+        if threads:
+            config["INFERENCE_NUM_THREADS"] = threads
+        self.model = ov.Core().compile_model(xml_path, "CPU", config)
+
+    def _infer(self, batch: np.ndarray) -> np.ndarray:
+        return self.model(batch)[0]
+
+
+def create_segmentator(
+    model_path: str,
+    backend: str = "torch",
+    precision: str = "fp32",
+    threads: int | None = None,
+    export_dir: str | None = None,
+    int8_data: str | None = None,
+):
+    """
+    Returns a segmentator for the given backend, exporting the weights on first use.
+    Every segmentator has predict(images) -> list of detections per image.
+    """
+    if backend == "torch":
+        return TorchSegmentator(model_path, threads)
+    path = export_model(
+        model_path, backend, precision, export_dir or os.path.dirname(model_path), int8_data
+    )
+    if backend == "onnx":
+        return OnnxSegmentator(path, threads)
+    if backend == "openvino":
+        return OpenVINOSegmentator(path, threads)
+    raise ValueError(f"Unsupported segmentator backend: {backend}")
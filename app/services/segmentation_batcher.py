@@ -0,0 +1,122 @@
+import asyncio
+import logging
+import time
+from concurrent.futures import Executor
+from typing import Callable
+
+logger = logging.getLogger(__name__)
+
+
+class SegmentationBatcher:
+    """
+    Collects pages submitted by concurrent requests and runs them through the model as one batch.
+    A batch is dispatched when it reaches max_batch_size or when its oldest page waited max_wait_ms.
+    """
+
+    def __init__(
+        self,
+        batch_fn: Callable[[list], list],
+        executor: Executor,
+        max_batch_size: int,
+        max_wait_ms: float,
+        max_concurrent_batches: int = 1,
+    ):
+        self.batch_fn = batch_fn
+        self.executor = executor
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.max_concurrent_batches = max_concurrent_batches
+        self._queue = None
+        self._task = None
+        self._batch_slots = None
+        self._inflight = set()
+        # Metrics
+        self.batches = 0
+        self.images = 0
+        self.queue_wait_total = 0.0
+        self.queue_wait_max = 0.0
+
+    def start(self) -> None:
+        if self._task is not None:
+            return
+        self._queue = asyncio.Queue()
+        self._batch_slots = asyncio.Semaphore(self.max_concurrent_batches)
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        # Fail pages that never made it into a batch
+        while not self._queue.empty():
+            _, _, future = self._queue.get_nowait()
+            if not future.done():
+                future.set_exception(RuntimeError("Segmentation batcher stopped"))
+
+    async def submit(self, img) -> list:
+        self.start()
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((img, time.perf_counter(), future))
+        return await future
+
+    def queue_depth(self) -> int:
+        return self._queue.qsize() if self._queue is not None else 0
+
+    def stats(self) -> dict:
+        return {
+            "batches": self.batches,
+            "images": self.images,
+            "batch_fill_rate": self.images / (self.batches * self.max_batch_size) if self.batches else 0.0,
+            "queue_wait_avg_ms": 1000 * self.queue_wait_total / self.images if self.images else 0.0,
+            "queue_wait_max_ms": 1000 * self.queue_wait_max,
+            "queue_depth": self.queue_depth(),
+        }
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            # While every worker is busy, pages keep piling up in the queue and fill the next batch
+            await self._batch_slots.acquire()
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            task = asyncio.create_task(self._process(batch))
+            self._inflight.add(task)
+            task.add_done_callback(self._inflight.discard)
+
+    async def _process(self, batch: list) -> None:
+        try:
+            now = time.perf_counter()
+            for _, enqueued_at, _ in batch:
+                wait = now - enqueued_at
+                self.queue_wait_total += wait
+                self.queue_wait_max = max(self.queue_wait_max, wait)
+            self.batches += 1
+            self.images += len(batch)
+            logger.info(f"Segmentation batch of {len(batch)}/{self.max_batch_size} pages")
+
+            loop = asyncio.get_running_loop()
+            try:
+                results = await loop.run_in_executor(self.executor, self.batch_fn, [img for img, _, _ in batch])
+            except Exception as e:
+                for _, _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                return
+            for (_, _, future), result in zip(batch, results):
+                if not future.done():
+                    future.set_result(result)
+        finally:
+            self._batch_slots.release()
@@ -1,20 +1,43 @@
 import os
-from ultralytics import YOLO
+import asyncio
+import logging
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from huggingface_hub import hf_hub_download
 from app.settings import settings
+from app.services.segmentation_batcher import SegmentationBatcher
+from app.services.segmentation_backends import create_segmentator
 from PIL import Image
 import io
 
 MODEL_REPO = settings.segmentator_repo
 MODEL_FILENAME = settings.segmentator_filename
 MODEL_DIR = settings.segmentator_models_dir
+EXPORT_DIR = settings.segmentator_export_dir or os.path.join(MODEL_DIR, "exports")
 
-_model_instance = None
+logger = logging.getLogger(__name__)
+
+# Predictors and inference sessions are not shared, so every segmentation thread gets its own model
+_local = threading.local()
+
+# Model loaded in the API process before the worker processes are forked, see _load_shared_model
+_shared_model = None
+_shared_model_lock = asyncio.Lock()
+
+# Makes every worker take exactly one warm-up task, created before the fork so processes inherit it
+_warm_up_barrier = (
+    multiprocessing.get_context("fork") if settings.segmentation_pool == "process" else threading
+).Barrier(settings.segmentation_workers)
 
 def ensure_dir(directory: str) -> None:
     os.makedirs(directory, exist_ok=True)
 
 def download_model_to_dir(repo_id: str, filename: str, dest_dir: str) -> str:
+    # Weights already in dest_dir are used as is, so a warm start needs no network
+    local_path = os.path.join(dest_dir, filename)
+    if os.path.isfile(local_path):
+        return local_path
     ensure_dir(dest_dir)
     model_path = hf_hub_download(
         repo_id=repo_id,
@@ -24,38 +47,115 @@ def download_model_to_dir(repo_id: str, filename: str, dest_dir: str) -> str:
     )
     return model_path
 
-def load_segmentator_model() -> YOLO:
-    global _model_instance
-    if _model_instance is not None:
-        return _model_instance
+def _create_model():
+    # Backend is picked in settings, exported models are created once and reused on next starts
     model_path = download_model_to_dir(MODEL_REPO, MODEL_FILENAME, MODEL_DIR)
-    _model_instance = YOLO(model_path)
-    return _model_instance
+    return create_segmentator(
+        model_path,
+        backend=settings.segmentator_backend,
+        precision=settings.segmentator_precision,
+        threads=settings.segmentator_threads,
+        export_dir=EXPORT_DIR,
+        int8_data=settings.segmentator_int8_data,
+    )
 
-def run_segmentation(img) -> list:
+def load_segmentator_model():
+    if _shared_model is not None:
+        return _shared_model
+    model = getattr(_local, "model", None)
+    if model is None:
+        model = _local.model = _create_model()
+    return model
+
+def _init_worker_process() -> None:
+    # Load the model up front, so the first page sent to a worker does not pay for it
+    load_segmentator_model()
+
+def _create_executor():
+    # Inference is CPU/GPU bound, keep it on its own pool so it never blocks the event loop
+    if settings.segmentation_pool == "process":
+        # Fork, so that workers inherit the model loaded by _load_shared_model instead of loading a copy
+        return ProcessPoolExecutor(
+            max_workers=settings.segmentation_workers,
+            mp_context=multiprocessing.get_context("fork"),
+            initializer=_init_worker_process,
+        )
+    return ThreadPoolExecutor(max_workers=settings.segmentation_workers, thread_name_prefix="segmentation")
+
+_executor = _create_executor()
+
+def _warm_up_worker(timeout: float) -> int:
+    model = load_segmentator_model()
+    # First inference pays for lazy initialization (layer fusion, kernel selection), do it before requests
+    model.predict([Image.new("RGB", (640, 640), (255, 255, 255))])
+    # Hold this worker until all others took their own warm-up task
+    _warm_up_barrier.wait(timeout)
+    return os.getpid()
+
+async def _load_shared_model() -> None:
+    """
+    For the process pool the PyTorch weights are loaded once in the API process and shared
+    copy-on-write. The pool forks its workers on the first task submitted to it, so this must be
+    awaited before any submit (warm-up or request), otherwise every worker loads its own copy.
+    Exported backends keep native thread pools that do not survive a fork, so each worker process
+    loads its own.
+    """
+    global _shared_model
+    if settings.segmentation_pool != "process" or settings.segmentator_backend != "torch" or _shared_model is not None:
+        return
+    # Requests that arrive while the warm-up loads the model wait for it instead of forking the pool
+    async with _shared_model_lock:
+        if _shared_model is None:
+            model = await asyncio.to_thread(_create_model)
+            # Fuse layers before the fork, so workers do not rewrite (and copy) the shared weights
+            model.fuse()
+            _shared_model = model
+
+async def warm_up_segmentation(timeout: float = 600.0) -> None:
+    """
+    Loads the model in every segmentation worker and runs one inference in each.
+    """
+    await _load_shared_model()
+    loop = asyncio.get_running_loop()
+    pids = await asyncio.gather(*[
+        loop.run_in_executor(_executor, _warm_up_worker, timeout) for _ in range(settings.segmentation_workers)
+    ])
+    logger.info(f"Segmentation workers warmed up: {settings.segmentation_workers} ({settings.segmentation_pool}, pids {sorted(set(pids))})")
+
+def _load_image(img):
     # Accepts PIL.Image, bytes, or file path
+    if isinstance(img, bytes):
+        return Image.open(io.BytesIO(img)).convert("RGB")
+    if isinstance(img, (str, Image.Image)):
+        # str: file path, passed to the model as is
+        return img
+    raise ValueError("Unsupported image type for segmentation")
+
+def run_segmentation_batch(imgs: list) -> list:
+    # Runs a single forward pass over all pages, returns detections per page in input order
     model = load_segmentator_model()
-    if isinstance(img, (str, bytes)):
-        # If str: treat as file path; if bytes: open as image
-        if isinstance(img, bytes):
-            img = Image.open(io.BytesIO(img)).convert("RGB")
-        # else: str (file path), pass as is
-        results = model(source=[img], show_labels=False, show_conf=False, show_boxes=True)
-    elif isinstance(img, Image.Image):
-        results = model(source=[img], show_labels=False, show_conf=False, show_boxes=True)
-    else:
-        raise ValueError("Unsupported image type for segmentation")
-    result = results[0]
-    detections = []
-    for box in result.boxes:
-        x1, y1, x2, y2 = box.xyxy.tolist()[0]
-        label_id = int(box.cls.tolist()[0])
-        label_name = result.names[label_id]
-        confidence = float(box.conf.tolist()[0])
-        detections.append({
-            "type": label_name,
-            "bbox": [x1, y1, x2, y2],
-            "confidence": confidence
-        })
-    return detections
- 
\ No newline at end of file
+    sources = [_load_image(img) for img in imgs]
+    return model.predict(sources)
+
+def run_segmentation(img) -> list:
+    return run_segmentation_batch([img])[0]
+
+# Gathers pages from concurrent requests into batches, see settings.segmentation_batch_*
+batcher = SegmentationBatcher(
+    run_segmentation_batch,
+    _executor,
+    max_batch_size=settings.segmentation_batch_size,
+    max_wait_ms=settings.segmentation_batch_wait_ms,
+    max_concurrent_batches=settings.segmentation_workers,
+)
+
+async def run_segmentation_async(img) -> list:
+    await _load_shared_model()
+    if settings.segmentation_batch_size > 1:
+        return await batcher.submit(img)
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor, run_segmentation, img)
+
+async def shutdown_executor() -> None:
+    await batcher.stop()
+    _executor.shutdown(wait=False, cancel_futures=True)
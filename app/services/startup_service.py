@@ -0,0 +1,43 @@
+import asyncio
+import logging
+import time
+
+from app.services.page_service import vlm_service
+from app.services.segmentator_service import warm_up_segmentation
+from app.settings import settings
+
+logger = logging.getLogger(__name__)
+
+# Readiness of this instance as reported by /ready: starting, warming_up, ready or failed
+readiness = {"status": "starting", "error": None, "timings": {}}
+
+
+async def _timed(name: str, awaitable) -> None:
+    start = time.perf_counter()
+    await awaitable
+    readiness["timings"][f"{name}_seconds"] = time.perf_counter() - start
+
+
+async def warm_up() -> None:
+    """
+    Loads the segmentation model in every worker with one warm-up inference, and builds the VLM
+    client (guidance import, prompt prefixes) concurrently. Marks the instance ready when done.
+    """
+    if not settings.startup_warm_up:
+        # Models are loaded lazily by the first requests
+        readiness["status"] = "ready"
+        return
+    readiness["status"] = "warming_up"
+    start = time.perf_counter()
+    try:
+        await asyncio.gather(
+            _timed("segmentation", warm_up_segmentation()),
+            _timed("vlm", asyncio.to_thread(vlm_service.warm_up)),
+        )
+    except Exception as e:
+        logger.error(f"Warm-up failed: {e}")
+        readiness.update(status="failed", error=str(e))
+        return
+    readiness["timings"]["total_seconds"] = time.perf_counter() - start
+    readiness["status"] = "ready"
+    logger.info(f"Warm-up done in {readiness['timings']['total_seconds']:.2f}s")
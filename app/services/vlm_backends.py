@@ -0,0 +1,275 @@
+import asyncio
+import email.utils
+import itertools
+import logging
+import random
+import threading
+import time
+from typing import List, Optional
+
+import httpx
+
+from app.services.metrics_service import (
+    VLM_BACKEND_HEALTHY, VLM_BACKEND_IN_FLIGHT, VLM_BACKEND_SECONDS, VLM_RETRIES,
+)
+
+logger = logging.getLogger(__name__)
+
+# Statuses worth another attempt: timeouts, conflicts, rate limits and server errors
+RETRYABLE_STATUSES = {408, 409, 429}
+
+
+class IncompleteAnswerError(ValueError):
+    """
+    An answer that was cut off before its JSON was complete (e.g. by max_tokens). It is the
+    model's fault like any invalid answer, but another attempt may well complete it.
+    """
+
+
+def _status_code(error: BaseException) -> Optional[int]:
+    # openai errors carry the status themselves, httpx errors on their response
+    status = getattr(error, "status_code", None)
+    if status is None and isinstance(error, httpx.HTTPStatusError):
+        status = error.response.status_code
+    return status
+
+
+def _retry_after(error: BaseException) -> Optional[float]:
+    # Retry-After of an HTTP error, in seconds or as an HTTP date
+    response = getattr(error, "response", None)
+    value = response.headers.get("retry-after") if response is not None else None
+    if value is None:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def _is_retryable(error: BaseException) -> bool:
+    # openai comes with guidance and is imported on first use like it
+    import openai
+
+    status = _status_code(error)
+    if status is not None:
+        return status in RETRYABLE_STATUSES or status >= 500
+    return isinstance(error, (
+        IncompleteAnswerError, openai.APIConnectionError, httpx.TransportError, ConnectionError, TimeoutError,
+    ))
+
+
+class VLMBackend:
+    """
+    One OpenAI-compatible endpoint of the pool, with its own guidance model, load and health state.
+    """
+
+    def __init__(self, base_url: str, api_key: str, model: str, weight: float, max_concurrency: int, timeout: float):
+        self.base_url = base_url
+        self.api_key = api_key
+        self.model = model
+        self.weight = weight
+        self.max_concurrency = max_concurrency
+        self.timeout = timeout
+        self.in_flight = 0
+        # Circuit breaker: consecutive failed calls, and the time until which the backend gets no traffic
+        self.failures = 0
+        self.down_until = 0.0
+        self._base_lm = None
+        self._base_lm_lock = threading.Lock()
+        self._prefixes = {}
+        VLM_BACKEND_HEALTHY.labels(base_url).set_function(lambda: float(self.healthy))
+
+    @property
+    def healthy(self) -> bool:
+        return time.monotonic() >= self.down_until
+
+    @property
+    def base_lm(self):
+        # Clean base model, never extended in place: every call forks its own session from it
+        with self._base_lm_lock:
+            if self._base_lm is None:
+                # guidance takes most of the import time, so it is imported on first use
+                from app.services.custom_openai import CustomOpenAI
+
+                self._base_lm = CustomOpenAI(
+                    model=self.model,
+                    echo=False,
+                    api_key=self.api_key,
+                    base_url=self.base_url,
+                    timeout=self.timeout,
+                    # Retries are made by the pool, which can move them to another backend
+                    max_retries=0,
+                )
+            return self._base_lm
+
+    def prompt_prefix(self, prompt: str):
+        # Prebuilt model state with an open user turn that already holds the prompt text
+        from guidance._ast import RoleStart
+
+        prefix = self._prefixes.get(prompt)
+        if prefix is None:
+            prefix = self.base_lm + RoleStart("user") + prompt
+            self._prefixes[prompt] = prefix
+        return prefix
+
+
+class VLMBackendPool:
+    """
+    Routes every VLM call to the least loaded healthy backend, relative to its weight.
+    A backend is taken out for a cooldown after consecutive failed calls (passive check)
+    or a failed probe of its /models endpoint (active check), and gets a single trial call
+    once the cooldown is over. Retryable failures are retried with exponential backoff on
+    a fresh pick, so a retry usually lands on another backend.
+    """
+
+    def __init__(
+        self,
+        backends: List[VLMBackend],
+        failure_threshold: int,
+        cooldown: float,
+        health_check_interval: float,
+        retries: int = 0,
+        retry_base_delay: float = 0.5,
+        retry_max_delay: float = 20.0,
+    ):
+        self.backends = backends
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.health_check_interval = health_check_interval
+        self.retries = retries
+        self.retry_base_delay = retry_base_delay
+        self.retry_max_delay = retry_max_delay
+        self._available = asyncio.Condition()
+        self._health_task = None
+
+    def _capacity(self, backend: VLMBackend) -> int:
+        # Half-open after the cooldown: a single trial call decides whether the breaker closes again
+        return 1 if backend.failures >= self.failure_threshold else backend.max_concurrency
+
+    def _pick(self) -> Optional[VLMBackend]:
+        candidates = [b for b in self.backends if b.healthy]
+        # With every backend out there is nothing better to do than to keep trying all of them
+        if not candidates:
+            candidates = self.backends
+        candidates = [b for b in candidates if b.in_flight < self._capacity(b)]
+        if not candidates:
+            return None
+        return min(candidates, key=lambda b: (b.in_flight + 1) / b.weight)
+
+    async def acquire(self) -> VLMBackend:
+        async with self._available:
+            while (backend := self._pick()) is None:
+                await self._available.wait()
+            backend.in_flight += 1
+        VLM_BACKEND_IN_FLIGHT.labels(backend.base_url).inc()
+        return backend
+
+    async def release(self, backend: VLMBackend, seconds: float, error: Optional[BaseException]) -> None:
+        # Answers that fail validation are the model's fault, they do not count against the backend
+        if error is None or isinstance(error, ValueError):
+            outcome = "ok" if error is None else "invalid"
+            backend.failures = 0
+        elif isinstance(error, asyncio.CancelledError):
+            outcome = "cancelled"
+        elif _status_code(error) == 429:
+            # A rate limited backend works, it only gets no traffic for as long as it asks
+            outcome = "throttled"
+            retry_after = _retry_after(error)
+            if retry_after:
+                backend.down_until = max(backend.down_until, time.monotonic() + retry_after)
+        else:
+            outcome = "error"
+            self._mark_failed(backend, error)
+        VLM_BACKEND_SECONDS.labels(backend.base_url, outcome).observe(seconds)
+        VLM_BACKEND_IN_FLIGHT.labels(backend.base_url).dec()
+        async with self._available:
+            backend.in_flight -= 1
+            self._available.notify()
+
+    def retry_delay(self, error: BaseException, attempt: int) -> Optional[float]:
+        # Seconds to wait before the next attempt, None if the error is final
+        if attempt >= self.retries or not _is_retryable(error):
+            return None
+        retry_after = _retry_after(error)
+        if retry_after is not None:
+            return min(retry_after, self.retry_max_delay)
+        # Full jitter, so calls that failed together do not come back together
+        return random.uniform(0, min(self.retry_max_delay, self.retry_base_delay * 2 ** attempt))
+
+    async def run(self, call):
+        """
+        Runs call(backend) on the least loaded healthy backend and returns its result,
+        retrying retryable failures after a backoff.
+        """
+        for attempt in itertools.count():
+            backend = await self.acquire()
+            start = time.perf_counter()
+            try:
+                result = await call(backend)
+            except BaseException as e:
+                await self.release(backend, time.perf_counter() - start, e)
+                delay = self.retry_delay(e, attempt)
+                if delay is None:
+                    raise
+                reason = str(_status_code(e) or type(e).__name__)
+                VLM_RETRIES.labels(reason).inc()
+                logger.warning(
+                    f"VLM call on {backend.base_url} failed ({reason}: {e}), "
+                    f"retry {attempt + 1}/{self.retries} in {delay:.2f}s"
+                )
+                await asyncio.sleep(delay)
+                continue
+            await self.release(backend, time.perf_counter() - start, None)
+            return result
+
+    def _mark_failed(self, backend: VLMBackend, error: BaseException) -> None:
+        backend.failures += 1
+        if backend.failures >= self.failure_threshold and backend.healthy:
+            backend.down_until = time.monotonic() + self.cooldown
+            logger.warning(
+                f"VLM backend {backend.base_url} taken out for {self.cooldown:.0f}s "
+                f"after {backend.failures} failed calls: {error}"
+            )
+
+    async def check(self, client: httpx.AsyncClient) -> None:
+        # Probes every backend once, a backend that answers is put back right away
+        async def probe(backend: VLMBackend) -> None:
+            try:
+                response = await client.get(
+                    backend.base_url.rstrip("/") + "/models",
+                    headers={"Authorization": f"Bearer {backend.api_key}"},
+                    timeout=5.0,
+                )
+                # Any answer below 500 means the server is up, some backends do not serve /models at all
+                if response.status_code >= 500:
+                    response.raise_for_status()
+            except httpx.HTTPError as e:
+                if backend.healthy:
+                    logger.warning(f"VLM backend {backend.base_url} failed its health check: {e}")
+                backend.down_until = time.monotonic() + self.cooldown
+                return
+            if not backend.healthy:
+                logger.info(f"VLM backend {backend.base_url} is back")
+            backend.failures = 0
+            backend.down_until = 0.0
+
+        await asyncio.gather(*[probe(backend) for backend in self.backends])
+
+    async def _health_loop(self, client: httpx.AsyncClient) -> None:
+        while True:
+            await self.check(client)
+            await asyncio.sleep(self.health_check_interval)
+
+    def start_health_checks(self, client: httpx.AsyncClient) -> None:
+        if self.health_check_interval > 0 and self._health_task is None:
+            self._health_task = asyncio.create_task(self._health_loop(client))
+
+    async def stop_health_checks(self) -> None:
+        if self._health_task is not None:
+            self._health_task.cancel()
+            await asyncio.gather(self._health_task, return_exceptions=True)
+            self._health_task = None
@@ -1,20 +1,78 @@
+import asyncio
 import base64
-import guidance
+import io
+import json
+import math
+from PIL import Image
+from concurrent.futures import ThreadPoolExecutor
 from typing import Optional
 import logging
-
-from guidance.models._openai import OpenAIImageMixin, OpenAIInterpreter
-from guidance.models._base import Model
-from guidance.models._openai_base import ImageBlob
+import re
 
 from app.services.openai_service import OpenAIService
-from app.schemas.response_schema import ObjectsResponse
-from app.schemas.response_schema import MarkdownResponse
-from app.settings import settings
+from app.services.vlm_backends import IncompleteAnswerError, VLMBackend, VLMBackendPool
+from app.services.cache_service import markdown_cache, make_key
+from app.services.metrics_service import VLM_STREAM_STOPS
+from app.schemas.response_schema import LayoutResponse
+from app.schemas.response_schema import MarkdownResponse, BlocksResponse
+from app.settings import VLMBackendSettings
+from app.utils.json_stream import JsonStream
 
 logger = logging.getLogger(__name__)
 
 
+def image_tokens(image_bytes: bytes) -> int:
+    # Qwen2.5-VL style models spend one token per 28x28 patch, only the image header is read here
+    with Image.open(io.BytesIO(image_bytes)) as image:
+        width, height = image.size
+    return math.ceil(width / 28) * math.ceil(height / 28)
+
+
+def strip_code_fence(markdown: str) -> str:
+    # Remove ```markdown ... ``` or ``` ... ``` wrappers if present
+    return re.sub(r"^```[a-zA-Z]*\n([\s\S]*?)\n```$", r"\1", markdown.strip())
+
+
+def parse_answer(answer: str, schema):
+    """
+    Tolerant parser of the direct engine, which has no grammar to hold the model to the schema:
+    code fences and text around the JSON object are ignored. A markdown answer that is no JSON at
+    all is taken as the markdown itself. An answer that starts as JSON but does not parse (e.g. it
+    was cut off by max_tokens) raises IncompleteAnswerError, so it is retried and never cached.
+    """
+    # A cut-off answer has no closing fence, so its opening fence is removed on its own
+    text = re.sub(r"^```[a-zA-Z]*\n", "", strip_code_fence(answer))
+    start, end = text.find("{"), text.rfind("}")
+    if start != -1 and end > start:
+        try:
+            return schema.model_validate_json(text[start:end + 1])
+        except ValueError as e:
+            if text.startswith(("{", "[")):
+                raise IncompleteAnswerError(f"Incomplete JSON in the VLM answer: {answer[:200]!r}") from e
+            # Braces inside plain markdown (e.g. LaTeX) are not an object
+            if schema is not MarkdownResponse:
+                raise
+    if text.startswith(("{", "[")):
+        raise IncompleteAnswerError(f"Incomplete JSON in the VLM answer: {answer[:200]!r}")
+    if schema is MarkdownResponse:
+        return MarkdownResponse(markdown=text)
+    raise ValueError(f"No {schema.__name__} object in the VLM answer: {answer[:200]!r}")
+
+
+def partial_markdown(answer: str) -> str:
+    # Text of the markdown value generated before the answer was cut off by its token budget
+    stream = JsonStream("markdown")
+    stream.feed(answer)
+    return strip_code_fence(stream.value)
+
+
+def add_usage(usage: Optional[dict], **counts) -> None:
+    if usage is None:
+        return
+    for key, value in counts.items():
+        usage[key] = usage.get(key, 0) + value
+
+
 OBJECTS_PROMPT = f"""\
 Detect all distinct text blocks, tables, and images (including diagrams, UI elements, or any other graphical information) in the document image.
 For images and tables, if there is a caption or label, the bounding box must include both the object and its caption.
@@ -35,83 +93,288 @@ Do NOT add any explanations or additional text. Return ONLY the JSON object.
 If the image contains no readable text, return {"markdown": ""}.
 """
 
-
-class CustomOpenAI(Model):
-    def __init__(
-        self,
-        model: str,
-        echo: bool = True,
-        *,
-        api_key: Optional[str] = None,
-        sampling_params: Optional[dict] = None,
-        **kwargs,
-    ):
-        interpreter_cls = type(
-            "OpenAIImageInterpreter", (OpenAIImageMixin, OpenAIInterpreter), {}
-        )
-        if sampling_params is None:
-            sampling_params = {
-                "temperature": 0.2,
-                "top_p": 0.95,
-            }
-        super().__init__(
-            interpreter=interpreter_cls(model, api_key=api_key, **kwargs),
-            echo=echo,
-            #sampling_params=sampling_params
-        )
+GROUP_MARKDOWN_PROMPT = """\
+The provided image contains {count} separate document blocks stacked from top to bottom and separated by blank space.
+Extract the content of each block and return it as markdown.
+You MUST respond in the following JSON format: {{"blocks": ["<markdown of block 1>", ..., "<markdown of block {count}>"]}}
+The list MUST contain exactly {count} strings, one per block, in top to bottom order. Use "" for a block with no readable text.
+Do NOT wrap your answer in triple backticks, code blocks, or any other formatting.
+Do NOT add any explanations or additional text. Return ONLY the JSON object.
+"""
 
 
 class VLMService(OpenAIService):
     def __init__(self):
         super().__init__()
-        self.lm = CustomOpenAI(
-            model=self.model,
-            api_key=self.api_key,
-            base_url=self.base_url,
-            # proxy=self.proxy,
-            # sampling_params can be customized here if needed
+        # Without a backend list, OPENAI_BASE_URL is a pool of one
+        backends = self.settings.vlm_backends or [
+            VLMBackendSettings(base_url=self.base_url, max_concurrency=self.settings.vlm_max_concurrency)
+        ]
+        self.pool = VLMBackendPool(
+            [
+                VLMBackend(
+                    base_url=backend.base_url,
+                    api_key=backend.api_key or self.api_key,
+                    model=backend.model or self.model,
+                    weight=backend.weight,
+                    max_concurrency=backend.max_concurrency,
+                    timeout=self.settings.vlm_timeout,
+                )
+                for backend in backends
+            ],
+            failure_threshold=self.settings.vlm_backend_failure_threshold,
+            cooldown=self.settings.vlm_backend_cooldown,
+            health_check_interval=self.settings.vlm_health_check_interval,
+            retries=self.settings.vlm_retries,
+            retry_base_delay=self.settings.vlm_retry_base_delay,
+            retry_max_delay=self.settings.vlm_retry_max_delay,
         )
+        # guidance models are synchronous, so their calls run on a dedicated pool off the event loop
+        self._executor = ThreadPoolExecutor(max_workers=self.settings.vlm_max_concurrency, thread_name_prefix="vlm")
 
-    def predict_objects(self, image_bytes: bytes, prompt: str = OBJECTS_PROMPT, **kwargs):
-        # user_content = [
-        #     {"type": "text", "text": prompt},
-        #     {"type": "image", "data": base64.b64encode(image_bytes).decode()}
-        # ]
-        with guidance.user():
-            self.lm += prompt
-            self.lm += ImageBlob(data=base64.b64encode(image_bytes))
+    def warm_up(self) -> None:
+        # Imports guidance and builds the models and prompt prefixes ahead of the first request
+        if self.settings.vlm_engine == "direct":
+            return
+        for backend in self.pool.backends:
+            for prompt in (SIMPLE_MARKDOWN_PROMPT, OBJECTS_PROMPT):
+                backend.prompt_prefix(prompt)
+
+    def start_health_checks(self) -> None:
+        self.pool.start_health_checks(self.get_async_client())
+
+    def _generate_json(self, image_bytes: bytes, prompt: str, name: str, schema, usage: Optional[dict] = None,
+                       backend: Optional[VLMBackend] = None, max_tokens: Optional[int] = None) -> str:
+        import guidance
+        from guidance._ast import RoleEnd
+        from guidance.models._openai_base import ImageBlob
+
+        # Fork the prefix for a single request, so no state is shared or accumulated between calls
+        add_usage(usage, vlm_calls=1, image_tokens=image_tokens(image_bytes))
+        lm = (backend or self.pool.backends[0]).prompt_prefix(prompt)
+        lm += ImageBlob(data=base64.b64encode(image_bytes))
+        lm += RoleEnd("user")
         with guidance.assistant():
-            self.lm += guidance.json(name="objects", schema=ObjectsResponse)
-        result_json = self.lm["objects"]
-        return ObjectsResponse.model_validate_json(result_json).model_dump()
+            lm += guidance.json(name=name, schema=schema, max_tokens=max_tokens)
+        # token_count only counts tokens the backend reported with logprobs, it stays 0 otherwise
+        add_usage(usage, completion_tokens=lm.token_count)
+        return lm[name]
 
-    def extract_markdown(self, image_bytes: bytes, prompt: str = SIMPLE_MARKDOWN_PROMPT, **kwargs) -> str:
+    def predict_objects(self, image_bytes: bytes, prompt: str = OBJECTS_PROMPT, usage: Optional[dict] = None,
+                        backend: Optional[VLMBackend] = None, **kwargs):
+        result_json = self._generate_json(image_bytes, prompt, "objects", LayoutResponse, usage, backend)
+        return LayoutResponse.model_validate_json(result_json).model_dump()
+
+    def extract_markdown(self, image_bytes: bytes, prompt: str = SIMPLE_MARKDOWN_PROMPT, usage: Optional[dict] = None,
+                         backend: Optional[VLMBackend] = None, max_tokens: Optional[int] = None, **kwargs) -> str:
         # Run VLM on a cropped image fragment to get markdown only
-        with guidance.user():
-            self.lm += prompt
-            self.lm += ImageBlob(data=base64.b64encode(image_bytes))
-        with guidance.assistant():
-            self.lm += guidance.json(name="markdown", schema=MarkdownResponse)
-        
-        result_json = self.lm["markdown"]
+        return self._extract_markdown(image_bytes, prompt, usage, backend, max_tokens)[0]
+
+    def _extract_markdown(self, image_bytes: bytes, prompt: str, usage: Optional[dict] = None,
+                          backend: Optional[VLMBackend] = None, max_tokens: Optional[int] = None) -> tuple[Optional[str], bool]:
+        # Returns the markdown and whether the answer is complete (it is not if max_tokens cut it off)
+        result_json = self._generate_json(image_bytes, prompt, "markdown", MarkdownResponse, usage, backend, max_tokens)
         logger.info(f"Raw VLM response: {result_json}")
         
         # Handle empty or invalid responses
         if not result_json or result_json.strip() == "":
             logger.warning("VLM returned empty response")
-            return None
-            
-        result_model = MarkdownResponse.model_validate_json(result_json).model_dump()
+            return None, True
+
+        try:
+            result_model = MarkdownResponse.model_validate_json(result_json).model_dump()
+        except ValueError:
+            # The grammar only lets valid JSON through, so a broken object was cut off by max_tokens.
+            # The same budget would cut it again: the text so far is kept instead of retrying.
+            if not max_tokens:
+                raise
+            logger.warning(f"VLM answer cut at its budget of {max_tokens} tokens")
+            return partial_markdown(result_json), False
 
         # Return None if VLM returned None
         if result_model is None or result_model.get("markdown") is None:
             logger.warning("VLM returned None")
+            return None, True
+        return strip_code_fence(result_model["markdown"]), True
+
+    def extract_markdown_blocks(self, image_bytes: bytes, count: int, usage: Optional[dict] = None,
+                                backend: Optional[VLMBackend] = None, max_tokens: Optional[int] = None, **kwargs) -> Optional[list]:
+        # Run VLM on a tile of several stacked blocks, returns the markdown of each block in order
+        prompt = GROUP_MARKDOWN_PROMPT.format(count=count)
+        result_json = self._generate_json(image_bytes, prompt, "blocks", BlocksResponse, usage, backend, max_tokens)
+        logger.info(f"Raw VLM response: {result_json}")
+        if not result_json or result_json.strip() == "":
+            logger.warning("VLM returned empty response")
             return None
-        markdown = result_model["markdown"]
-
-        # Remove triple backticks and code block wrappers if present
-        if markdown is not None:
-            import re
-            # Remove ```markdown ... ``` or ``` ... ```
-            markdown = re.sub(r"^```[a-zA-Z]*\n([\s\S]*?)\n```$", r"\1", markdown.strip())
-        return markdown
+        blocks = BlocksResponse.model_validate_json(result_json).blocks
+        return [strip_code_fence(block) for block in blocks]
+
+    def _chat_request(self, backend: VLMBackend, image_bytes: bytes, prompt: str, schema,
+                      max_tokens: Optional[int] = None, **kwargs) -> tuple[str, dict, dict]:
+        # A plain chat completion that asks the backend itself for JSON, no grammar is involved
+        with Image.open(io.BytesIO(image_bytes)) as image:
+            mime_type = Image.MIME[image.format]
+        if self.settings.vlm_response_format == "json_schema":
+            kwargs["response_format"] = {
+                "type": "json_schema",
+                "json_schema": {"name": "json_schema", "schema": schema.model_json_schema(), "strict": True},
+            }
+        elif self.settings.vlm_response_format == "json_object":
+            kwargs["response_format"] = {"type": "json_object"}
+        headers, data = self._build_request(image_bytes, prompt, backend.model, mime_type, **kwargs)
+        headers["Authorization"] = f"Bearer {backend.api_key}"
+        if max_tokens:
+            data["max_tokens"] = max_tokens
+        return backend.base_url.rstrip("/") + "/chat/completions", headers, data
+
+    async def _generate_json_direct(self, backend: VLMBackend, image_bytes: bytes, prompt: str, schema,
+                                    usage: Optional[dict] = None, max_tokens: Optional[int] = None) -> tuple[str, Optional[str]]:
+        # The direct engine: one request on the event loop, returns the answer and its finish_reason
+        add_usage(usage, vlm_calls=1, image_tokens=image_tokens(image_bytes))
+        url, headers, data = self._chat_request(backend, image_bytes, prompt, schema, max_tokens)
+        response = await self.get_async_client().post(url, json=data, headers=headers)
+        response.raise_for_status()
+        result = response.json()
+        add_usage(usage, completion_tokens=(result.get("usage") or {}).get("completion_tokens") or 0)
+        choice = result["choices"][0]
+        answer = choice["message"]["content"] or ""
+        logger.info(f"Raw VLM response: {answer}")
+        return answer, choice.get("finish_reason")
+
+    async def _run_direct(self, image_bytes: bytes, prompt: str, schema, usage: Optional[dict],
+                          max_tokens: Optional[int] = None) -> tuple:
+        """
+        Returns the parsed answer and whether it is complete. Parsing happens inside the pool call,
+        so a malformed answer counts as invalid, not as a backend failure. An answer cut off by
+        max_tokens is not retried, the same budget would cut it again: a markdown answer keeps the
+        text generated so far, any other schema fails.
+        """
+        async def call(backend: VLMBackend):
+            answer, finish_reason = await self._generate_json_direct(backend, image_bytes, prompt, schema, usage, max_tokens)
+            try:
+                result = parse_answer(answer, schema)
+            except IncompleteAnswerError:
+                if finish_reason != "length":
+                    raise
+                if schema is not MarkdownResponse:
+                    raise ValueError(f"VLM answer cut at its budget of {max_tokens} tokens: {answer[:200]!r}") from None
+                logger.warning(f"VLM answer cut at its budget of {max_tokens} tokens")
+                return MarkdownResponse(markdown=partial_markdown(answer)), False
+            return result, finish_reason != "length"
+        return await self.pool.run(call)
+
+    async def _stream_markdown(self, backend: VLMBackend, image_bytes: bytes, prompt: str, max_tokens: Optional[int],
+                               usage: Optional[dict], on_text) -> tuple[str, bool]:
+        """
+        Streams one transcription from the backend and closes the stream as soon as the JSON object
+        is complete, so trailing output is never waited for. Decoded text is passed to
+        on_text(offset, text) as it arrives. Returns the markdown and whether the answer is complete
+        (it is not if the token budget ran out first).
+        """
+        add_usage(usage, vlm_calls=1, image_tokens=image_tokens(image_bytes))
+        url, headers, data = self._chat_request(backend, image_bytes, prompt, MarkdownResponse, max_tokens, stream=True)
+        answer = JsonStream("markdown")
+        reason = "stop"
+        async with self.get_async_client().stream("POST", url, json=data, headers=headers) as response:
+            if response.status_code >= 400:
+                await response.aread()
+                response.raise_for_status()
+            async for line in response.aiter_lines():
+                if not line.startswith("data:"):
+                    continue
+                payload = line[len("data:"):].strip()
+                if payload == "[DONE]":
+                    break
+                chunk = json.loads(payload)
+                if chunk.get("usage"):
+                    add_usage(usage, completion_tokens=chunk["usage"].get("completion_tokens") or 0)
+                if not chunk.get("choices"):
+                    continue
+                choice = chunk["choices"][0]
+                text = answer.feed((choice.get("delta") or {}).get("content") or "")
+                if text and on_text is not None:
+                    on_text(len(answer.value) - len(text), text)
+                if answer.complete:
+                    # Leaving the block closes the connection, the backend stops generating
+                    reason = "complete"
+                    break
+                if choice.get("finish_reason"):
+                    reason = "length" if choice["finish_reason"] == "length" else "stop"
+        VLM_STREAM_STOPS.labels(reason).inc()
+        if reason == "length" and not answer.complete:
+            logger.warning(f"VLM answer cut at its budget of {max_tokens} tokens, keeping {len(answer.value)} characters")
+            return strip_code_fence(answer.value), False
+        # Same tolerant parsing as the direct engine: a fence or prose around the object is fine
+        return strip_code_fence(parse_answer(answer.text, MarkdownResponse).markdown), True
+
+    async def _run_in_executor(self, fn, usage: Optional[dict], *args, **kwargs):
+        # Usage is collected per call and merged back on the event loop thread
+        call_usage = {}
+        loop = asyncio.get_running_loop()
+        try:
+            return await self.pool.run(lambda backend: loop.run_in_executor(
+                self._executor, lambda: fn(*args, usage=call_usage, backend=backend, **kwargs)
+            ))
+        finally:
+            add_usage(usage, **call_usage)
+
+    def _cache_key(self, kind: str, *parts) -> str:
+        # Answers differ per engine and per model actually called, and a backend may override the
+        # model of OPENAI_API_MODEL. Any backend of the pool may serve a call, so all their models count.
+        models = ",".join(sorted({backend.model for backend in self.pool.backends}))
+        return make_key(kind, self.settings.vlm_engine, models, *parts)
+
+    async def _run_cached(self, cache_key: str, usage: Optional[dict], run):
+        # Same image, engine, models and prompt always give the same answer, so serve repeats from the cache.
+        # run() returns the result and whether it is complete, answers cut by the token budget are not cached.
+        result = await markdown_cache.aget(cache_key)
+        if result is not None:
+            add_usage(usage, cached_calls=1)
+            return result
+        result, complete = await run()
+        if complete:
+            await markdown_cache.aset(cache_key, result)
+        return result
+
+    async def aextract_markdown(self, image_bytes: bytes, prompt: str = SIMPLE_MARKDOWN_PROMPT, usage: Optional[dict] = None, **kwargs) -> str:
+        cache_key = self._cache_key("markdown", prompt, image_bytes)
+        if self.settings.vlm_engine == "direct":
+            async def run():
+                result, complete = await self._run_direct(image_bytes, prompt, MarkdownResponse, usage, kwargs.get("max_tokens"))
+                return strip_code_fence(result.markdown), complete
+        else:
+            def run():
+                return self._run_in_executor(self._extract_markdown, usage, image_bytes, prompt, max_tokens=kwargs.get("max_tokens"))
+        return await self._run_cached(cache_key, usage, run)
+
+    async def astream_markdown(self, image_bytes: bytes, max_tokens: Optional[int] = None, prompt: str = SIMPLE_MARKDOWN_PROMPT,
+                               usage: Optional[dict] = None, on_text=None) -> str:
+        # Shares the cache with aextract_markdown
+        cache_key = self._cache_key("markdown", prompt, image_bytes)
+
+        def run():
+            return self.pool.run(lambda backend: self._stream_markdown(backend, image_bytes, prompt, max_tokens, usage, on_text))
+        return await self._run_cached(cache_key, usage, run)
+
+    async def aextract_markdown_blocks(self, image_bytes: bytes, count: int, usage: Optional[dict] = None, **kwargs) -> Optional[list]:
+        cache_key = self._cache_key("markdown-blocks", GROUP_MARKDOWN_PROMPT, count, image_bytes)
+        if self.settings.vlm_engine == "direct":
+            async def run():
+                prompt = GROUP_MARKDOWN_PROMPT.format(count=count)
+                result, complete = await self._run_direct(image_bytes, prompt, BlocksResponse, usage, kwargs.get("max_tokens"))
+                return [strip_code_fence(block) for block in result.blocks], complete
+        else:
+            async def run():
+                return await self._run_in_executor(self.extract_markdown_blocks, usage, image_bytes, count, **kwargs), True
+        return await self._run_cached(cache_key, usage, run)
+
+    async def apredict_objects(self, image_bytes: bytes, prompt: str = OBJECTS_PROMPT, usage: Optional[dict] = None, **kwargs) -> dict:
+        if self.settings.vlm_engine == "direct":
+            result, _ = await self._run_direct(image_bytes, prompt, LayoutResponse, usage)
+            return result.model_dump()
+        return await self._run_in_executor(self.predict_objects, usage, image_bytes, prompt, **kwargs)
+
+    async def aclose(self) -> None:
+        await self.pool.stop_health_checks()
+        await super().aclose()
+        self._executor.shutdown(wait=False, cancel_futures=True)
@@ -1,6 +1,17 @@
-from pydantic import Field
+from typing import Dict, List, Literal
+
+from pydantic import BaseModel, Field
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
+
+class VLMBackendSettings(BaseModel):
+    base_url: str = Field(description="OpenAI-compatible base URL of the backend")
+    api_key: str | None = Field(default=None, description="API key (default: OPENAI_API_KEY)")
+    model: str | None = Field(default=None, description="Model name on this backend (default: OPENAI_API_MODEL)")
+    weight: float = Field(default=1.0, gt=0, description="Share of the load relative to the other backends")
+    max_concurrency: int = Field(default=8, ge=1, description="Max VLM calls in flight on this backend")
+
+
 class Settings(BaseSettings):
     # Server configuration
     host: str = Field(default="0.0.0.0", description="Server host (default: %(default)s)")
@@ -17,6 +28,130 @@ class Settings(BaseSettings):
     segmentator_filename: str = Field(default="yolov8x-doclaynet-epoch64-imgsz640-initiallr1e-4-finallr1e-5.pt", description="YOLO segmentator model filename")
     segmentator_models_dir: str = Field(default="models", description="Directory for segmentator model weights")
 
+    # Segmentation backend configuration
+    segmentator_backend: Literal["torch", "onnx", "openvino"] = Field(default="torch", description="Inference backend of the segmentator")
+    segmentator_precision: Literal["fp32", "fp16", "int8"] = Field(default="fp32", description="Precision of the exported model (fp16 is OpenVINO only)")
+    segmentator_threads: int | None = Field(default=None, ge=1, description="Inference threads per segmentation worker (optional, backend default otherwise)")
+    segmentator_export_dir: str | None = Field(default=None, description="Directory for exported models (default: <segmentator_models_dir>/exports)")
+    segmentator_int8_data: str | None = Field(default=None, description="ultralytics dataset YAML used to calibrate the OpenVINO INT8 export (optional)")
+
+    # VLM concurrency configuration
+    vlm_max_concurrency_per_request: int = Field(default=8, ge=1, description="Max VLM calls in flight for a single request")
+    vlm_max_concurrency: int = Field(default=32, ge=1, description="Max VLM calls in flight across all requests")
+    vlm_timeout: float = Field(default=600.0, gt=0, description="Timeout in seconds for a single VLM call")
+
+    # VLM backend pool configuration
+    vlm_backends: List[VLMBackendSettings] = Field(default_factory=list, description="VLM endpoints as a JSON list, the single OPENAI_BASE_URL backend if empty")
+    vlm_backend_failure_threshold: int = Field(default=3, ge=1, description="Consecutive failed calls before a backend is taken out")
+    vlm_backend_cooldown: float = Field(default=30.0, gt=0, description="Seconds a failing backend stays out before it gets traffic again")
+    vlm_health_check_interval: float = Field(default=15.0, ge=0, description="Seconds between active health checks of the backends, 0 disables them")
+
+    # VLM retry configuration
+    vlm_retries: int = Field(default=2, ge=0, description="Retries of a VLM call after a connection error, 429 or 5xx")
+    vlm_retry_base_delay: float = Field(default=0.5, ge=0, description="Backoff before the first retry in seconds, doubled on every retry, with full jitter")
+    vlm_retry_max_delay: float = Field(default=20.0, ge=0, description="Max backoff in seconds, also caps a Retry-After sent by the backend")
+
+    # VLM engine configuration
+    vlm_engine: Literal["guidance", "direct"] = Field(
+        default="guidance",
+        description="guidance constrains decoding with a grammar, direct sends plain chat completions and parses the answer tolerantly",
+    )
+    vlm_response_format: Literal["json_schema", "json_object", "none"] = Field(
+        default="json_schema",
+        description="response_format of the direct engine (streamed calls included): the JSON schema, JSON mode, or none for backends without either",
+    )
+
+    # VLM token budget configuration
+    vlm_stream_enabled: bool = Field(
+        default=True,
+        description="With the direct engine, stream block transcriptions and close the stream as soon as the JSON answer is complete (the guidance engine never streams)",
+    )
+    # The budget is max_tokens of streamed block calls only, sized for dense text at 96 dpi so it only cuts runaway answers
+    vlm_max_tokens_base: int = Field(default=256, ge=1, description="Tokens every streamed block may generate regardless of its size (covers the JSON wrapping)")
+    vlm_pixels_per_token: int = Field(default=200, ge=1, description="Block area in pixels that earns one more token of budget")
+    vlm_max_tokens_limit: int = Field(default=4096, ge=1, description="Upper bound of the token budget of a streamed block call")
+    vlm_token_budget_factors: Dict[str, float] = Field(
+        default={"table": 2.0, "formula": 2.0},
+        description="Budget multipliers by block type, for blocks with more markup per pixel than plain text",
+    )
+
+    # Admission control configuration
+    admission_max_pending_pages: int = Field(default=64, ge=0, description="Pages in process above which new requests get 503, 0 disables admission control")
+
+    # Image ingest configuration
+    image_max_pixels: int = Field(default=150_000_000, ge=784, description="Images declaring more pixels than this are rejected before decoding")
+    segmentation_max_side: int = Field(default=1280, ge=64, description="Longest side of the reduced copy the segmentator runs on, boxes are mapped back to full resolution")
+
+    # Processing strategy configuration
+    processing_strategy: Literal["crop", "page", "hybrid"] = Field(default="crop", description="Default strategy: one VLM call per block, per page, or per group of small blocks")
+    page_max_pixels: int = Field(default=1605632, ge=784, description="Pixel budget of the page image in the page strategy")
+    hybrid_small_block_pixels: int = Field(default=60000, ge=0, description="Blocks below this area may be grouped in the hybrid strategy")
+    hybrid_max_gap: int = Field(default=24, ge=0, description="Max vertical gap in pixels between grouped blocks")
+    hybrid_max_group_pixels: int = Field(default=400000, ge=784, description="Max total block area of one group in the hybrid strategy")
+    hybrid_max_group_blocks: int = Field(default=8, ge=2, description="Max blocks in one group in the hybrid strategy")
+
+    # Detection post-processing configuration
+    detection_min_confidence: float = Field(default=0.25, ge=0, le=1, description="Detections below this confidence are dropped (the model already drops those below 0.25)")
+    detection_suppression_enabled: bool = Field(default=True, description="Drop detections that duplicate the pixels of another detection")
+    detection_iou_threshold: float = Field(default=0.5, gt=0, le=1, description="IoU above which the lower ranked of two overlapping detections is dropped")
+    detection_containment_threshold: float = Field(default=0.8, gt=0, le=1, description="Share of a detection inside another one above which it is dropped")
+    detection_type_priority: List[str] = Field(
+        default=["table", "picture", "formula", "list-item", "title", "section-header", "caption", "footnote", "text", "page-header", "page-footer"],
+        description="Block types from highest to lowest priority when detections overlap, unlisted types rank last",
+    )
+    detection_score_gap: float = Field(
+        default=0.25, ge=0, le=1,
+        description="Confidence lead by which a detection wins over an overlapping one of higher type priority",
+    )
+
+    # Blank block filter configuration
+    blank_filter_enabled: bool = Field(default=True, description="Skip the VLM call for blocks that are too small or almost empty")
+    blank_min_side: int = Field(default=8, ge=0, description="Blocks with a side shorter than this many pixels are skipped")
+    blank_min_ink_ratio: float = Field(default=0.005, ge=0, le=1, description="Blocks with a smaller share of ink pixels are skipped")
+    blank_ink_contrast: int = Field(default=48, ge=1, le=254, description="Grayscale difference from the block background that counts as ink")
+
+    # Block dedup configuration
+    dedup_enabled: bool = Field(default=True, description="Reuse the markdown of near-identical blocks seen earlier in the same document or session")
+    dedup_block_types: List[str] = Field(default=["page-header", "page-footer"], description="Block types looked up in the dedup index")
+    dedup_max_distance: int = Field(default=64, ge=0, le=256, description="Max differing bits of the 256-bit hashes of matching blocks, a re-rendered line flips up to about 45, a different one 90 or more")
+    dedup_reuse_digits: bool = Field(default=False, description="Also reuse markdown with digits, which the hash cannot tell apart (page numbers, dates)")
+    dedup_max_items: int = Field(default=256, ge=1, description="Blocks kept in the index of one document or session")
+    dedup_max_sessions: int = Field(default=64, ge=1, description="Session indexes of /api/objects kept, the least recently used are dropped")
+
+    # Crop encoding configuration
+    crop_format: Literal["png", "jpeg", "webp"] = Field(default="png", description="Image format of crops sent to the VLM")
+    crop_png_compress_level: int = Field(default=1, ge=0, le=9, description="PNG compression level (0 fastest, 9 smallest)")
+    crop_quality: int = Field(default=90, ge=1, le=100, description="JPEG/WebP quality")
+    crop_max_pixels: int | None = Field(default=None, ge=784, description="Downscale crops to at most this many pixels on the 28-px grid (optional)")
+
+    # Segmentation execution configuration
+    segmentation_workers: int = Field(default=1, ge=1, description="Threads or processes dedicated to segmentation inference")
+    segmentation_pool: Literal["thread", "process"] = Field(default="thread", description="Run segmentation workers as threads of the API process or as forked processes")
+    segmentation_batch_size: int = Field(default=4, ge=1, description="Max pages per segmentation batch, 1 disables batching")
+    segmentation_batch_wait_ms: float = Field(default=10.0, ge=0, description="Max time a page waits for its batch to fill")
+
+    # PDF processing configuration
+    pdf_dpi: int = Field(default=200, ge=36, description="Resolution used to rasterize PDF pages")
+    pdf_max_pages_in_flight: int = Field(default=4, ge=1, description="Max rendered pages processed at once per PDF")
+    pdf_max_size_mb: int = Field(default=200, ge=1, description="Max size of an uploaded PDF in MB")
+
+    # Batch endpoint configuration
+    batch_max_files: int = Field(default=32, ge=1, description="Max images in one /api/objects/batch request")
+    batch_max_pages_in_flight: int = Field(default=8, ge=1, description="Max images of one batch processed at once")
+
+    # Result cache configuration
+    cache_enabled: bool = Field(default=True, description="Cache segmentation and VLM results by content hash")
+    cache_max_items: int = Field(default=10000, ge=1, description="Max entries per cache kept in memory (LRU)")
+    cache_dir: str | None = Field(default=None, description="Directory for the on-disk cache tier (optional)")
+
+    # Job queue configuration
+    jobs_dir: str = Field(default="jobs", description="Directory for the job database and uploaded job files")
+    job_workers: int = Field(default=2, ge=1, description="Jobs processed at the same time")
+    job_max_page_attempts: int = Field(default=3, ge=1, description="Attempts per page before it is marked as failed")
+
+    # Startup configuration
+    startup_warm_up: bool = Field(default=True, description="Load models and run a warm-up inference at startup, before /ready reports ready")
+
     model_config = SettingsConfigDict(
         env_file=".env",
         env_file_encoding="utf-8",
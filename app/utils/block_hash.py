@@ -0,0 +1,28 @@
+import numpy as np
+from PIL import Image
+
+HASH_ROWS = 8
+HASH_COLUMNS = 32
+
+
+def block_hash(img: Image.Image, bbox: list, ink_contrast: int = 48) -> tuple[float, int]:
+    """
+    Perceptual difference hash of a block, returns (aspect, bits). img is the page.
+    The block is first trimmed to its ink, so a detection box shifted by a few pixels gives the
+    same hash. The ink is then reduced to a fixed grid of HASH_ROWS x HASH_COLUMNS cells whatever
+    its size, so any two hashes are comparable, and each bit tells whether a cell is brighter than
+    its left neighbour. Re-rendering the same line of text (sub-pixel shifts, a scale a few percent
+    off) flips up to about 45 of the 256 bits, a different line 90 or more. The grid is too coarse
+    to see a changed digit. The aspect of the ink keeps lines of very different length apart.
+    """
+    x1, y1, x2, y2 = map(int, bbox)
+    view = np.asarray(img.crop((x1, y1, x2, y2)).convert("L"), dtype=np.int16)
+    # Same ink test as the blank filter: anything far enough from the block background (its median)
+    ink = np.abs(view - int(np.median(view))) > ink_contrast
+    rows, cols = np.flatnonzero(ink.any(axis=1)), np.flatnonzero(ink.any(axis=0))
+    if len(rows):
+        x1, y1, x2, y2 = x1 + cols[0], y1 + rows[0], x1 + cols[-1] + 1, y1 + rows[-1] + 1
+    grid = img.resize((HASH_COLUMNS + 1, HASH_ROWS), Image.Resampling.BILINEAR, box=(x1, y1, x2, y2)).convert("L")
+    pixels = np.asarray(grid, dtype=np.int16)
+    bits = pixels[:, 1:] > pixels[:, :-1]
+    return (x2 - x1) / max(1, y2 - y1), int.from_bytes(np.packbits(bits).tobytes(), "big")
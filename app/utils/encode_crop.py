@@ -0,0 +1,65 @@
+import io
+import math
+import time
+from PIL import Image
+
+from app.utils.pad_to_multiple_of_28 import pad_to_multiple_of_28
+
+MIME_TYPES = {"png": "image/png", "jpeg": "image/jpeg", "webp": "image/webp"}
+
+
+def fit_to_pixel_budget(image: Image.Image, max_pixels: int) -> Image.Image:
+    """
+    Downscales the image so that, once padded to the 28-px patch grid, it has at most max_pixels pixels.
+    Both sides are snapped to multiples of 28 (like the Qwen2.5-VL processor does), so no padding is needed after.
+    """
+    width, height = image.size
+    padded_pixels = max(28, math.ceil(width / 28) * 28) * max(28, math.ceil(height / 28) * 28)
+    if padded_pixels <= max_pixels:
+        return image
+    scale = math.sqrt(max_pixels / (width * height))
+    new_width = max(28, math.floor(width * scale / 28) * 28)
+    new_height = max(28, math.floor(height * scale / 28) * 28)
+    # reducing_gap lets PIL shrink by an integer factor first, which is much cheaper on large crops
+    return image.resize((new_width, new_height), Image.Resampling.BICUBIC, reducing_gap=2.0)
+
+
+def encode_crop(
+    image: Image.Image,
+    bbox: list,
+    format: str = "png",
+    quality: int = 90,
+    png_compress_level: int = 1,
+    max_pixels: int | None = None,
+) -> tuple[bytes, dict]:
+    """
+    Crops, optionally downscales, pads to the 28-px grid and encodes a block exactly once.
+    Returns the encoded bytes and the time spent in each stage, in milliseconds.
+    """
+    timings = {}
+    start = time.perf_counter()
+    crop = image.crop(tuple(bbox))
+    timings["crop_ms"] = (time.perf_counter() - start) * 1000
+
+    start = time.perf_counter()
+    if max_pixels:
+        crop = fit_to_pixel_budget(crop, max_pixels)
+    timings["resize_ms"] = (time.perf_counter() - start) * 1000
+
+    start = time.perf_counter()
+    # Pad the crop to satisfy VLM requirements (min 28px, multiple of 28)
+    crop = pad_to_multiple_of_28(crop)
+    timings["pad_ms"] = (time.perf_counter() - start) * 1000
+
+    start = time.perf_counter()
+    buf = io.BytesIO()
+    if format == "png":
+        crop.save(buf, format="PNG", compress_level=png_compress_level)
+    elif format == "jpeg":
+        crop.save(buf, format="JPEG", quality=quality)
+    elif format == "webp":
+        crop.save(buf, format="WEBP", quality=quality, method=0)
+    else:
+        raise ValueError(f"Unsupported crop format: {format}")
+    timings["encode_ms"] = (time.perf_counter() - start) * 1000
+    return buf.getvalue(), timings
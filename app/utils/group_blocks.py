@@ -0,0 +1,81 @@
+# Block types that may share one VLM call, mapped to a family: only blocks of the same family are merged.
+# Tables, formulas and pictures are never grouped.
+GROUP_FAMILIES = {
+    "text": "body",
+    "list-item": "body",
+    "section-header": "body",
+    "caption": "caption",
+    "footnote": "footnote",
+    "page-header": "page-header",
+    "page-footer": "page-footer",
+}
+
+
+def union_bbox(bboxes: list) -> list:
+    return [
+        min(b[0] for b in bboxes),
+        min(b[1] for b in bboxes),
+        max(b[2] for b in bboxes),
+        max(b[3] for b in bboxes),
+    ]
+
+
+def _area(bbox: list) -> int:
+    return max(0, bbox[2] - bbox[0]) * max(0, bbox[3] - bbox[1])
+
+
+def _overlaps_horizontally(a: list, b: list) -> bool:
+    return min(a[2], b[2]) > max(a[0], b[0])
+
+
+def group_blocks(
+    objects: list,
+    indices: list,
+    small_block_pixels: int,
+    max_gap: int,
+    max_group_pixels: int,
+    max_group_blocks: int,
+) -> list:
+    """
+    Groups vertically adjacent small blocks of compatible types so that they can share one VLM call.
+    Blocks are walked top to bottom; a block joins the current group when it is small, belongs to the
+    same type family, sits in the same column at most max_gap pixels below, and the group stays within
+    max_group_pixels (sum of block areas) and max_group_blocks. Other blocks stay on their own.
+    Returns a list of groups, each a list of indices into objects in reading order.
+    """
+    groups = []
+    current = []
+    current_bbox = None
+    current_family = None
+    current_pixels = 0
+    for i in sorted(indices, key=lambda i: (objects[i]["bbox"][1], objects[i]["bbox"][0])):
+        bbox = objects[i]["bbox"]
+        area = _area(bbox)
+        family = GROUP_FAMILIES.get(objects[i]["type"].lower())
+        groupable = family is not None and area < small_block_pixels
+        if (
+            current
+            and groupable
+            and family == current_family
+            and bbox[1] - current_bbox[3] <= max_gap
+            and _overlaps_horizontally(bbox, current_bbox)
+            and current_pixels + area <= max_group_pixels
+            and len(current) < max_group_blocks
+        ):
+            current.append(i)
+            current_bbox = union_bbox([current_bbox, bbox])
+            current_pixels += area
+            continue
+        if current:
+            groups.append(current)
+        current = [i]
+        current_bbox = bbox
+        current_family = family
+        current_pixels = area
+        if not groupable:
+            # Large or non-text blocks are never extended
+            groups.append(current)
+            current = []
+    if current:
+        groups.append(current)
+    return groups
@@ -0,0 +1,77 @@
+import io
+import math
+
+from PIL import Image, UnidentifiedImageError
+
+
+class ImageSource:
+    """
+    A page image that is decoded on demand: a reduced copy for segmentation, and the full
+    resolution only once crops are made. Opening it reads the header alone, so the format and
+    pixel count are checked before anything is decoded.
+    data is encoded bytes, a binary file object, a path, or an already decoded image (e.g. a
+    rasterized PDF page).
+    """
+
+    def __init__(self, data, max_pixels: int | None = None):
+        self._image = data if isinstance(data, Image.Image) else None
+        self._fp = io.BytesIO(data) if isinstance(data, bytes) else data
+        if self._image is not None:
+            self.format, self.size = self._image.format, self._image.size
+        else:
+            try:
+                with self._open() as image:
+                    self.format, self.size = image.format, image.size
+            except UnidentifiedImageError:
+                raise ValueError("Unknown or corrupt image format")
+        width, height = self.size
+        # Decompression bomb guard: a small file can declare a huge canvas
+        if max_pixels and width * height > max_pixels:
+            raise ValueError(f"Image too large: {width}x{height} pixels, the limit is {max_pixels}")
+
+    def _open(self) -> Image.Image:
+        if hasattr(self._fp, "seek"):
+            self._fp.seek(0)
+        return Image.open(self._fp)
+
+    def reduced(self, max_side: int) -> tuple[Image.Image, float, float]:
+        """
+        Returns an RGB copy whose longest side is at most max_side, and the x and y scales that
+        map its coordinates back to the full resolution. JPEGs are decoded straight at 1/2, 1/4
+        or 1/8 scale, so their full resolution is never held in memory.
+        """
+        width, height = self.size
+        factor = max_side / max(width, height)
+        if factor >= 1:
+            return self.full(), 1.0, 1.0
+        target = (max(1, math.floor(width * factor)), max(1, math.floor(height * factor)))
+        if self._image is not None:
+            image = _resize(self._image, target)
+        else:
+            with self._open() as opened:
+                opened.draft("RGB", target)
+                image = _resize(opened, target)
+        return image, width / image.width, height / image.height
+
+    def full(self) -> Image.Image:
+        # Decoded once and kept, every crop of the page is cut from the same image
+        if self._image is None or self._image.mode != "RGB":
+            image = self._image if self._image is not None else self._open()
+            self._image = image if image.mode == "RGB" else image.convert("RGB")
+            self._image.load()
+        return self._image
+
+    def close(self) -> None:
+        # Drops the decoded image and closes the file object the image is read from, if any
+        self._image = None
+        if isinstance(self._fp, io.IOBase):
+            self._fp.close()
+
+
+def _resize(image: Image.Image, size: tuple) -> Image.Image:
+    # Palette images are converted first, other modes are only converted once small
+    if image.mode not in ("RGB", "RGBA", "L"):
+        image = image.convert("RGB")
+    # reducing_gap shrinks by an integer factor first, which is much cheaper on large pages
+    image = image.resize(size, Image.Resampling.BILINEAR, reducing_gap=2.0)
+    return image if image.mode == "RGB" else image.convert("RGB")
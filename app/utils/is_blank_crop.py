@@ -0,0 +1,33 @@
+import math
+
+import numpy as np
+from PIL import Image
+
+# Pixels sampled per block at most, enough to estimate the ink share of any block size
+MAX_SAMPLES = 64 * 1024
+
+
+def is_blank_crop(
+    img: Image.Image,
+    bbox: list,
+    min_side: int = 8,
+    min_ink_ratio: float = 0.005,
+    ink_contrast: int = 48,
+) -> bool:
+    """
+    Tells whether a block is too small or holds too little ink to be worth a VLM call.
+    img is the page. The block is sampled with a nearest-neighbour resize, so large blocks cost
+    no more than small ones and no grayscale copy of the page is made; a pixel is ink if it
+    differs from the block background (its median) by more than ink_contrast, which works for
+    dark text on light paper as well as light text on dark fills.
+    """
+    x1, y1, x2, y2 = bbox
+    width, height = x2 - x1, y2 - y1
+    if min(width, height) < min_side:
+        return True
+    stride = max(1, math.ceil(math.sqrt(width * height / MAX_SAMPLES)))
+    size = (math.ceil(width / stride), math.ceil(height / stride))
+    view = np.asarray(img.resize(size, Image.Resampling.NEAREST, box=(x1, y1, x2, y2)).convert("L"))
+    background = np.median(view)
+    ink = np.abs(view.astype(np.int16) - int(background)) > ink_contrast
+    return ink.mean() < min_ink_ratio
@@ -0,0 +1,81 @@
+import json
+import re
+
+# A trailing escape that cannot be decoded yet: a lone backslash, a partial \uXXXX, or a high
+# surrogate that still waits for its low half
+_INCOMPLETE_ESCAPE = re.compile(r'(\\u[dD][89abAB][0-9a-fA-F]{2}(\\u?[0-9a-fA-F]{0,3})?|\\(u[0-9a-fA-F]{0,3})?)$')
+
+
+class JsonStream:
+    """
+    Incremental scanner of a JSON object that arrives in chunks. It tells when the object is
+    complete, so the stream can be cut right there, and decodes the string value of one
+    top-level key while it is still being generated. Anything before the first { (a code fence,
+    prose) is skipped, so brackets in it do not count.
+    """
+
+    def __init__(self, key: str):
+        self.key = key
+        self.text = ""
+        self.complete = False
+        self.value = ""
+        self._depth = 0
+        self._in_string = False
+        self._escaped = False
+        self._in_value = False
+        self._decoded_end = 0
+
+    def feed(self, chunk: str) -> str:
+        """
+        Adds a chunk of the answer and returns the text of the key's value decoded from it.
+        Anything after the end of the object is ignored.
+        """
+        if self.complete:
+            return ""
+        start = len(self.text)
+        self.text += chunk
+        for i in range(start, len(self.text)):
+            char = self.text[i]
+            if self._depth == 0:
+                # Waiting for the object to start
+                self._depth = int(char == "{")
+            elif self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif char == "\\":
+                    self._escaped = True
+                elif char == '"':
+                    self._in_string = False
+                    if self._in_value:
+                        delta = self._decode(i)
+                        self._in_value = False
+                        # The rest of the chunk may still close the object
+                        rest = self.text[i + 1:]
+                        self.text = self.text[:i + 1]
+                        return delta + self.feed(rest)
+            elif char == '"':
+                self._in_string = True
+                # Only a string right after "key": at the top level holds the value
+                if self._depth == 1 and re.search(rf'"{re.escape(self.key)}"\s*:\s*$', self.text[:i]):
+                    self._in_value = True
+                    self._decoded_end = i + 1
+            elif char in "{[":
+                self._depth += 1
+            elif char in "}]":
+                self._depth -= 1
+                if self._depth == 0:
+                    self.complete = True
+                    self.text = self.text[:i + 1]
+                    return ""
+        return self._decode(len(self.text)) if self._in_value else ""
+
+    def _decode(self, end: int) -> str:
+        raw = self.text[self._decoded_end:end]
+        match = _INCOMPLETE_ESCAPE.search(raw)
+        # An odd run of backslashes before the match means it is itself escaped text, not an escape
+        if match and (len(raw[:match.start()]) - len(raw[:match.start()].rstrip("\\"))) % 2 == 0:
+            raw = raw[:match.start()]
+        delta = json.loads(f'"{raw}"', strict=False)
+        self._decoded_end += len(raw)
+        self.value += delta
+        return delta
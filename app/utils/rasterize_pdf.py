@@ -0,0 +1,20 @@
+from PIL import Image
+from pdf2image import convert_from_path, pdfinfo_from_path
+
+
+def count_pdf_pages(pdf_path: str) -> int:
+    """
+    Returns the number of pages in the PDF without rendering any of them.
+    """
+    return int(pdfinfo_from_path(pdf_path)["Pages"])
+
+
+def rasterize_pdf_page(pdf_path: str, page_number: int, dpi: int = 200) -> Image.Image:
+    """
+    Renders a single PDF page (1-based) to an RGB PIL image, so a document is never
+    held in memory as a full list of pages.
+    """
+    images = convert_from_path(pdf_path, dpi=dpi, first_page=page_number, last_page=page_number)
+    if not images:
+        raise ValueError(f"Page {page_number} could not be rendered")
+    return images[0].convert("RGB")
@@ -0,0 +1,30 @@
+import hashlib
+
+from fastapi import UploadFile
+
+
+def upload_size(file: UploadFile) -> int:
+    file.file.seek(0, 2)
+    size_bytes = file.file.tell()
+    file.file.seek(0)
+    return size_bytes
+
+
+def save_upload(file: UploadFile, path: str) -> str:
+    # Copy the upload to disk in chunks, returns the SHA-256 of its content
+    digest = hashlib.sha256()
+    with open(path, "wb") as out:
+        while chunk := file.file.read(1024 * 1024):
+            digest.update(chunk)
+            out.write(chunk)
+    return digest.hexdigest()
+
+
+def hash_upload(file: UploadFile) -> str:
+    # SHA-256 of the upload read in chunks, the file is rewound for the next reader
+    digest = hashlib.sha256()
+    file.file.seek(0)
+    while chunk := file.file.read(1024 * 1024):
+        digest.update(chunk)
+    file.file.seek(0)
+    return digest.hexdigest()
@@ -0,0 +1,18 @@
+from PIL import Image
+
+
+def stack_crops(image: Image.Image, bboxes: list, gap: int = 28) -> Image.Image:
+    """
+    Cuts the given boxes out of the image and stacks them top to bottom on a white tile,
+    separated by gap pixels, so that several small blocks can be sent to the VLM as one image
+    without the unrelated content between them.
+    """
+    crops = [image.crop(tuple(bbox)) for bbox in bboxes]
+    width = max(crop.width for crop in crops)
+    height = sum(crop.height for crop in crops) + gap * (len(crops) - 1)
+    tile = Image.new("RGB", (max(1, width), max(1, height)), (255, 255, 255))
+    y = 0
+    for crop in crops:
+        tile.paste(crop, (0, y))
+        y += crop.height + gap
+    return tile
@@ -0,0 +1,44 @@
+import numpy as np
+
+
+def suppress_overlaps(
+    boxes: np.ndarray,
+    scores: np.ndarray,
+    priorities: np.ndarray,
+    iou_threshold: float = 0.5,
+    containment_threshold: float = 0.8,
+    score_gap: float = 1.0,
+) -> np.ndarray:
+    """
+    Cross-class suppression of duplicate detections, returns a boolean mask of the boxes to keep.
+    Boxes are ranked by type priority, then area (so a container wins over its content), then score.
+    A box is dropped when more than containment_threshold of its area lies inside a kept box ranked
+    before it, or when its IoU with such a box is above iou_threshold. A duplicate scored more than
+    score_gap above a box ranked before it overrules the ranking: that box is dropped instead.
+    The pairwise overlaps are computed at once on (N, N) matrices, the greedy pass only walks the rows.
+    """
+    count = len(boxes)
+    keep = np.ones(count, dtype=bool)
+    if count < 2:
+        return keep
+    x1, y1, x2, y2 = boxes.T
+    area = (x2 - x1) * (y2 - y1)
+    width = np.clip(np.minimum(x2[:, None], x2[None, :]) - np.maximum(x1[:, None], x1[None, :]), 0, None)
+    height = np.clip(np.minimum(y2[:, None], y2[None, :]) - np.maximum(y1[:, None], y1[None, :]), 0, None)
+    intersection = width * height
+    iou = intersection / (area[:, None] + area[None, :] - intersection)
+    # covers[i, j]: share of box j that lies inside box i
+    covers = intersection / area[None, :]
+    duplicates = (covers > containment_threshold) | (iou > iou_threshold)
+    np.fill_diagonal(duplicates, False)
+
+    order = np.lexsort((-scores, -area, -priorities))
+    rank = np.empty(count, dtype=np.int64)
+    rank[order] = np.arange(count)
+    # A box only suppresses the boxes ranked after it
+    duplicates &= rank[:, None] < rank[None, :]
+    keep &= ~(duplicates & (scores[None, :] - scores[:, None] > score_gap)).any(axis=1)
+    for i in order:
+        if keep[i]:
+            keep &= ~duplicates[i]
+    return keep
@@ -0,0 +1,136 @@
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+import httpx
+
+from benchmarks.e2e import free_port, make_pngs, percentiles, wait_http
+
+
+async def post_page(client: httpx.AsyncClient, url: str, png: bytes, i: int) -> tuple:
+    start = time.perf_counter()
+    try:
+        response = await client.post(url, files={"file": (f"page_{i}.png", png, "image/png")})
+        status = str(response.status_code)
+    except httpx.HTTPError as e:
+        status = type(e).__name__
+    return time.perf_counter() - start, status
+
+
+async def probe_health(client: httpx.AsyncClient, url: str, interval: float, stop: asyncio.Event) -> list:
+    # A handler that blocks the event loop shows up as a slow /health while pages are processed
+    latencies = []
+    while not stop.is_set():
+        start = time.perf_counter()
+        try:
+            await client.get(url)
+        except httpx.HTTPError:
+            pass
+        latencies.append(time.perf_counter() - start)
+        try:
+            await asyncio.wait_for(stop.wait(), interval)
+        except asyncio.TimeoutError:
+            pass
+    return latencies
+
+
+async def bench(app_url: str, pages: list, concurrency: list, baseline_runs: int, probe_interval: float) -> dict:
+    url = f"{app_url}/api/objects"
+    async with httpx.AsyncClient(timeout=600.0, limits=httpx.Limits(max_connections=max(concurrency) + 1)) as client:
+        # One untimed request opens the connections and loads whatever is loaded lazily
+        await post_page(client, url, pages[0], 0)
+        single = [(await post_page(client, url, pages[i % len(pages)], i))[0] for i in range(baseline_runs)]
+        single_s = statistics.median(single)
+        levels = []
+        for n in concurrency:
+            stop = asyncio.Event()
+            probe = asyncio.create_task(probe_health(client, f"{app_url}/health", probe_interval, stop))
+            start = time.perf_counter()
+            results = await asyncio.gather(*(post_page(client, url, pages[i % len(pages)], i) for i in range(n)))
+            wall = time.perf_counter() - start
+            stop.set()
+            health = await probe
+            statuses = {}
+            for _, status in results:
+                statuses[status] = statuses.get(status, 0) + 1
+            levels.append({
+                "concurrency": n,
+                "wall_s": wall,
+                # 1 means the requests were handled one after another, n means they fully overlapped
+                "overlap": n * single_s / wall,
+                "wall_over_single": wall / single_s,
+                "latency_s": percentiles([latency for latency, _ in results]),
+                "health_latency_ms": {key: value * 1000 for key, value in percentiles(health).items()},
+                "statuses": statuses,
+            })
+    return {"single_request_s": single_s, "levels": levels}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Overlap of concurrent /api/objects requests against a local stub VLM, compared to a single request.")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[4, 16], help="Requests sent at once")
+    parser.add_argument("--blocks", type=int, default=8, help="Text blocks per synthetic page")
+    parser.add_argument("--baseline-runs", type=int, default=3, help="Sequential requests whose median is the single-request latency")
+    parser.add_argument("--latency-ms", type=float, default=200.0, help="Stub VLM latency")
+    parser.add_argument("--probe-interval", type=float, default=0.05, help="Seconds between /health probes during the load")
+    parser.add_argument("--env", action="append", default=[], help="Extra KEY=VALUE settings for the service")
+    parser.add_argument("--timeout", type=float, default=600.0, help="Max seconds to wait for the service to be ready")
+    parser.add_argument("--out", default=None, help="Write results as JSON to this file")
+    args = parser.parse_args()
+
+    stub_url = f"http://127.0.0.1:{free_port()}"
+    app_port = free_port()
+    app_url = f"http://127.0.0.1:{app_port}"
+    # Caching would turn repeated pages into no-ops, so it is off unless overridden with --env
+    env = {
+        **os.environ,
+        "OPENAI_API_KEY": "stub",
+        "OPENAI_BASE_URL": f"{stub_url}/v1",
+        "OPENAI_API_MODEL": "stub",
+        "CACHE_ENABLED": "false",
+    }
+    env.update(item.split("=", 1) for item in args.env)
+    stub = subprocess.Popen(
+        [sys.executable, "-m", "benchmarks.stub_vlm", "--port", stub_url.rsplit(":", 1)[1], "--latency-ms", str(args.latency_ms)],
+    )
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.main:app", "--host", "127.0.0.1", "--port", str(app_port),
+         "--log-level", "warning"],
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    try:
+        wait_http(f"{stub_url}/stats", args.timeout, stub)
+        wait_http(f"{app_url}/ready", args.timeout, server)
+        # Distinct pages, so no request is served from another's work
+        pages = make_pngs([args.blocks] * max(args.concurrency))
+        results = {
+            "config": {
+                "blocks": args.blocks,
+                "latency_ms": args.latency_ms,
+                "env": args.env,
+            },
+            **asyncio.run(bench(app_url, pages, args.concurrency, args.baseline_runs, args.probe_interval)),
+            "stub": httpx.get(f"{stub_url}/stats").json(),
+        }
+    finally:
+        for process in (server, stub):
+            process.terminate()
+        for process in (server, stub):
+            process.wait()
+
+    output = json.dumps(results, indent=2)
+    print(output)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            f.write(output + "\n")
+
+
+if __name__ == "__main__":
+    main()
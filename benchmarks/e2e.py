@@ -0,0 +1,275 @@
+import argparse
+import asyncio
+import io
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import httpx
+
+from benchmarks.synthetic_pages import make_page
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def process_rss_mb(pid: int) -> float:
+    # Resident memory of a process and its direct children (e.g. segmentation worker processes)
+    total_kb = 0
+    pids = [pid]
+    try:
+        with open(f"/proc/{pid}/task/{pid}/children", "r") as f:
+            pids += [int(child) for child in f.read().split()]
+    except OSError:
+        pass
+    for each in pids:
+        try:
+            with open(f"/proc/{each}/status", "r") as f:
+                for line in f:
+                    if line.startswith("VmRSS:"):
+                        total_kb += int(line.split()[1])
+        except OSError:
+            pass
+    return total_kb / 1024
+
+
+class MemorySampler:
+    """
+    Samples the resident memory of a process tree in a background thread and keeps the peak.
+    """
+
+    def __init__(self, pid: int, interval: float = 0.1):
+        self.pid = pid
+        self.interval = interval
+        self.peak_mb = 0.0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            self.peak_mb = max(self.peak_mb, process_rss_mb(self.pid))
+            self._stop.wait(self.interval)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+
+def percentiles(values: list) -> dict:
+    if not values:
+        return {}
+    values = sorted(values)
+
+    def pick(q: float) -> float:
+        return values[min(len(values) - 1, int(round(q * (len(values) - 1))))]
+
+    return {
+        "mean": statistics.mean(values),
+        "p50": pick(0.50),
+        "p95": pick(0.95),
+        "p99": pick(0.99),
+        "max": values[-1],
+    }
+
+
+def wait_http(url: str, timeout: float, process: subprocess.Popen) -> None:
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"{process.args} exited with code {process.returncode}")
+        try:
+            if httpx.get(url, timeout=2.0).status_code == 200:
+                return
+        except httpx.TransportError:
+            pass
+        time.sleep(0.1)
+    raise TimeoutError(f"{url} not ready after {timeout}s")
+
+
+def make_pngs(block_counts: list) -> list:
+    pages = []
+    for i, blocks in enumerate(block_counts):
+        buf = io.BytesIO()
+        make_page(blocks, seed=i).save(buf, format="PNG")
+        pages.append(buf.getvalue())
+    return pages
+
+
+async def bench_objects(url: str, pages: list, concurrency: int, requests: int, params: dict) -> dict:
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies, statuses = [], {}
+
+    async def one(client: httpx.AsyncClient, i: int) -> None:
+        png = pages[i % len(pages)]
+        async with semaphore:
+            start = time.perf_counter()
+            try:
+                response = await client.post(url, files={"file": (f"page_{i}.png", png, "image/png")}, params=params)
+                status = str(response.status_code)
+            except httpx.HTTPError as e:
+                status = type(e).__name__
+            latencies.append(time.perf_counter() - start)
+            statuses[status] = statuses.get(status, 0) + 1
+
+    limits = httpx.Limits(max_connections=concurrency)
+    async with httpx.AsyncClient(timeout=600.0, limits=limits) as client:
+        start = time.perf_counter()
+        await asyncio.gather(*[one(client, i) for i in range(requests)])
+        elapsed = time.perf_counter() - start
+    return {
+        "concurrency": concurrency,
+        "requests": requests,
+        "seconds": elapsed,
+        "requests_per_second": requests / elapsed,
+        "latency_seconds": percentiles(latencies),
+        "statuses": statuses,
+    }
+
+
+def run_cli(args: list, cwd: str) -> dict:
+    # Runs a CLI tool as a fresh process and measures its wall time and peak memory
+    start = time.perf_counter()
+    process = subprocess.Popen(args, cwd=cwd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+    with MemorySampler(process.pid) as memory:
+        _, stderr = process.communicate()
+    result = {
+        "seconds": time.perf_counter() - start,
+        "peak_rss_mb": memory.peak_mb,
+        "returncode": process.returncode,
+    }
+    if process.returncode != 0:
+        result["error"] = stderr.strip().splitlines()[-1] if stderr.strip() else ""
+    return result
+
+
+def bench_cli(api_url: str, block_counts: list, pdf_pages: int, concurrency: int, workdir: str) -> dict:
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    pdf_path = os.path.join(workdir, "bench.pdf")
+    pages = [make_page(block_counts[i % len(block_counts)], seed=i) for i in range(pdf_pages)]
+    pages[0].save(pdf_path, format="PDF", save_all=True, append_images=pages[1:], resolution=150)
+
+    out_dir = os.path.join(workdir, "pages")
+    results = {"pdf_pages": pdf_pages}
+    results["process_pdf"] = run_cli(
+        [sys.executable, "process_pdf.py", "-i", pdf_path, "-a", api_url, "-o", out_dir,
+         "-c", str(concurrency), "--no-resume"],
+        cwd=root,
+    )
+    results["merge_markdown"] = run_cli(
+        [sys.executable, "merge_markdown.py", "-i", out_dir, "-o", os.path.join(workdir, "merged.md"),
+         "-m", os.path.join(workdir, "media")],
+        cwd=root,
+    )
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="End-to-end benchmark of the service against a local stub VLM.")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16], help="Concurrent clients to compare")
+    parser.add_argument("--requests", type=int, default=32, help="Requests per concurrency level")
+    parser.add_argument("--blocks", type=int, nargs="+", default=[4, 12, 24], help="Text blocks per synthetic page, cycled")
+    parser.add_argument("--strategy", default=None, help="Processing strategy sent with every request")
+    parser.add_argument("--latency-ms", type=float, default=200.0, help="Mean stub VLM latency")
+    parser.add_argument("--jitter-ms", type=float, default=50.0, help="Standard deviation of the stub VLM latency")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of stub VLM calls that fail")
+    parser.add_argument("--token-ms", type=float, default=0.0, help="Delay of every token streamed by the stub VLM")
+    parser.add_argument("--trailing-tokens", type=int, default=0, help="Whitespace tokens the stub VLM streams after each answer")
+    parser.add_argument("--runaway-rate", type=float, default=0.0, help="Share of stub VLM answers that repeat until max_tokens")
+    parser.add_argument("--stubs", type=int, default=1, help="Stub VLM servers, more than one are given to the service as a backend pool")
+    parser.add_argument("--pdf-pages", type=int, default=8, help="Pages of the PDF given to process_pdf.py, 0 to skip the CLI tools")
+    parser.add_argument("--env", action="append", default=[], help="Extra KEY=VALUE settings for the service")
+    parser.add_argument("--timeout", type=float, default=600.0, help="Max seconds to wait for the service to be ready")
+    parser.add_argument("--out", default=None, help="Write results as JSON to this file")
+    args = parser.parse_args()
+
+    stub_urls = [f"http://127.0.0.1:{free_port()}" for _ in range(args.stubs)]
+    app_port = free_port()
+    app_url = f"http://127.0.0.1:{app_port}"
+    # Caching would turn repeated pages into no-ops, so it is off unless overridden with --env
+    env = {
+        **os.environ,
+        "OPENAI_API_KEY": "stub",
+        "OPENAI_BASE_URL": f"{stub_urls[0]}/v1",
+        "OPENAI_API_MODEL": "stub",
+        "CACHE_ENABLED": "false",
+    }
+    if args.stubs > 1:
+        env["VLM_BACKENDS"] = json.dumps([{"base_url": f"{url}/v1"} for url in stub_urls])
+    env.update(item.split("=", 1) for item in args.env)
+    stubs = [
+        subprocess.Popen(
+            [sys.executable, "-m", "benchmarks.stub_vlm", "--port", url.rsplit(":", 1)[1], "--seed", str(i),
+             "--latency-ms", str(args.latency_ms), "--jitter-ms", str(args.jitter_ms), "--error-rate", str(args.error_rate),
+             "--token-ms", str(args.token_ms), "--trailing-tokens", str(args.trailing_tokens),
+             "--runaway-rate", str(args.runaway_rate)],
+        )
+        for i, url in enumerate(stub_urls)
+    ]
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.main:app", "--host", "127.0.0.1", "--port", str(app_port),
+         "--log-level", "warning"],
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    try:
+        for url, stub in zip(stub_urls, stubs):
+            wait_http(f"{url}/stats", args.timeout, stub)
+        wait_http(f"{app_url}/ready", args.timeout, server)
+        pages = make_pngs(args.blocks)
+        params = {"strategy": args.strategy} if args.strategy else {}
+        results = {
+            "config": {
+                "blocks": args.blocks,
+                "strategy": args.strategy,
+                "latency_ms": args.latency_ms,
+                "jitter_ms": args.jitter_ms,
+                "error_rate": args.error_rate,
+                "token_ms": args.token_ms,
+                "trailing_tokens": args.trailing_tokens,
+                "runaway_rate": args.runaway_rate,
+                "stubs": args.stubs,
+                "env": args.env,
+            },
+            "idle_rss_mb": process_rss_mb(server.pid),
+            "objects": [],
+        }
+        for concurrency in args.concurrency:
+            with MemorySampler(server.pid) as memory:
+                level = asyncio.run(bench_objects(f"{app_url}/api/objects", pages, concurrency, args.requests, params))
+            level["peak_rss_mb"] = memory.peak_mb
+            results["objects"].append(level)
+        if args.pdf_pages:
+            with tempfile.TemporaryDirectory() as workdir:
+                results["cli"] = bench_cli(
+                    f"{app_url}/api/objects", args.blocks, args.pdf_pages, max(args.concurrency), workdir
+                )
+        results["stubs"] = [httpx.get(f"{url}/stats").json() for url in stub_urls]
+    finally:
+        for process in [server, *stubs]:
+            process.terminate()
+        for process in [server, *stubs]:
+            process.wait()
+
+    output = json.dumps(results, indent=2)
+    print(output)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            f.write(output + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+import argparse
+import glob
+import json
+import logging
+import os
+import statistics
+import time
+
+# CPU benchmark: hide GPUs unless explicitly requested
+os.environ.setdefault("CUDA_VISIBLE_DEVICES", "")
+
+from PIL import Image
+
+from app.services.segmentation_backends import create_segmentator
+from app.services.segmentator_service import EXPORT_DIR, MODEL_DIR, MODEL_FILENAME, MODEL_REPO, download_model_to_dir
+from app.settings import settings
+from benchmarks.synthetic_pages import make_pages
+
+logging.basicConfig(
+    level=logging.WARNING,
+    format='[%(asctime)s] %(levelname)s: %(message)s',
+    datefmt='%Y-%m-%d %H:%M:%S'
+)
+logger = logging.getLogger("segmentation_backends")
+
+
+def iou(a: list, b: list) -> float:
+    x1, y1 = max(a[0], b[0]), max(a[1], b[1])
+    x2, y2 = min(a[2], b[2]), min(a[3], b[3])
+    inter = max(0.0, x2 - x1) * max(0.0, y2 - y1)
+    union = (a[2] - a[0]) * (a[3] - a[1]) + (b[2] - b[0]) * (b[3] - b[1]) - inter
+    return inter / union if union > 0 else 0.0
+
+
+def agreement(reference: list, detections: list, threshold: float = 0.5) -> dict:
+    # Greedy one-to-one matching of detections of the same type, highest IoU first
+    pairs = sorted(
+        (
+            (iou(ref["bbox"], det["bbox"]), i, j)
+            for i, ref in enumerate(reference)
+            for j, det in enumerate(detections)
+            if ref["type"] == det["type"]
+        ),
+        reverse=True,
+    )
+    used_ref, used_det, ious = set(), set(), []
+    for score, i, j in pairs:
+        if score < threshold:
+            break
+        if i in used_ref or j in used_det:
+            continue
+        used_ref.add(i)
+        used_det.add(j)
+        ious.append(score)
+    matched = len(ious)
+    return {
+        "reference": len(reference),
+        "detections": len(detections),
+        "matched": matched,
+        "mean_iou": statistics.mean(ious) if ious else 0.0,
+    }
+
+
+def bench_backend(model_path: str, backend: str, precision: str, threads: int | None, pages: list, repeats: int) -> tuple:
+    start = time.perf_counter()
+    segmentator = create_segmentator(
+        model_path, backend, precision, threads, EXPORT_DIR, settings.segmentator_int8_data
+    )
+    load_seconds = time.perf_counter() - start
+    # Warm-up, the first call pays for lazy initialization in every backend
+    segmentator.predict([pages[0]])
+    latencies = []
+    detections = []
+    for _ in range(repeats):
+        detections = []
+        for page in pages:
+            start = time.perf_counter()
+            detections.append(segmentator.predict([page])[0])
+            latencies.append((time.perf_counter() - start) * 1000)
+    latencies.sort()
+    result = {
+        "backend": backend,
+        "precision": precision,
+        "load_seconds": load_seconds,
+        "latency_ms_mean": statistics.mean(latencies),
+        "latency_ms_p50": latencies[len(latencies) // 2],
+        "latency_ms_p95": latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))],
+    }
+    return result, detections
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare latency and detection agreement of segmentation backends.")
+    parser.add_argument(
+        "--backends", nargs="+", default=["torch:fp32", "onnx:fp32", "openvino:fp32"],
+        help="backend:precision pairs to compare, the first one is the reference",
+    )
+    parser.add_argument("--images", default=None, help="Glob of page images to use instead of synthetic pages")
+    parser.add_argument("--pages", type=int, default=8, help="Number of synthetic pages")
+    parser.add_argument("--repeats", type=int, default=3, help="Times every page is segmented")
+    parser.add_argument("--threads", type=int, default=None, help="Inference threads per backend")
+    parser.add_argument("--out", default=None, help="Write results as JSON to this file")
+    args = parser.parse_args()
+
+    if args.images:
+        pages = [Image.open(path).convert("RGB") for path in sorted(glob.glob(args.images))]
+    else:
+        pages = make_pages(args.pages)
+    model_path = download_model_to_dir(MODEL_REPO, MODEL_FILENAME, MODEL_DIR)
+
+    results = {"pages": len(pages), "repeats": args.repeats, "threads": args.threads, "backends": []}
+    reference = None
+    for spec in args.backends:
+        backend, _, precision = spec.partition(":")
+        result, detections = bench_backend(
+            model_path, backend, precision or "fp32", args.threads, pages, args.repeats
+        )
+        if reference is None:
+            reference = detections
+        pages_agreement = [agreement(ref, det) for ref, det in zip(reference, detections)]
+        matched = sum(page["matched"] for page in pages_agreement)
+        total = sum(max(page["reference"], page["detections"]) for page in pages_agreement)
+        result["agreement"] = matched / total if total else 1.0
+        result["mean_iou"] = statistics.mean(page["mean_iou"] for page in pages_agreement)
+        results["backends"].append(result)
+
+    output = json.dumps(results, indent=2)
+    print(output)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            f.write(output + "\n")
+
+
+if __name__ == "__main__":
+    main()
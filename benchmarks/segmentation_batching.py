@@ -0,0 +1,91 @@
+import argparse
+import asyncio
+import json
+import logging
+import os
+import time
+
+# CPU benchmark: hide GPUs unless explicitly requested
+os.environ.setdefault("CUDA_VISIBLE_DEVICES", "")
+
+from app.services.segmentator_service import (
+    run_segmentation,
+    run_segmentation_batch,
+    _executor,
+)
+from app.services.segmentation_batcher import SegmentationBatcher
+from benchmarks.synthetic_pages import make_pages
+
+logging.basicConfig(
+    level=logging.WARNING,
+    format='[%(asctime)s] %(levelname)s: %(message)s',
+    datefmt='%Y-%m-%d %H:%M:%S'
+)
+logger = logging.getLogger("segmentation_batching")
+
+
+def bench_unbatched(pages: list) -> float:
+    start = time.perf_counter()
+    for page in pages:
+        run_segmentation(page)
+    return time.perf_counter() - start
+
+
+def bench_batched(pages: list, batch_size: int) -> float:
+    start = time.perf_counter()
+    for i in range(0, len(pages), batch_size):
+        run_segmentation_batch(pages[i:i + batch_size])
+    return time.perf_counter() - start
+
+
+async def bench_scheduler(pages: list, batch_size: int, wait_ms: float) -> tuple:
+    # Simulates concurrent requests submitting one page each
+    batcher = SegmentationBatcher(run_segmentation_batch, _executor, batch_size, wait_ms)
+    start = time.perf_counter()
+    await asyncio.gather(*[batcher.submit(page) for page in pages])
+    elapsed = time.perf_counter() - start
+    await batcher.stop()
+    return elapsed, batcher.stats()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare batched and unbatched YOLO segmentation throughput.")
+    parser.add_argument("--pages", type=int, default=32, help="Number of synthetic pages")
+    parser.add_argument("--batch-size", type=int, nargs="+", default=[2, 4, 8], help="Batch sizes to compare")
+    parser.add_argument("--wait-ms", type=float, default=10.0, help="Scheduler max wait per batch")
+    parser.add_argument("--out", default=None, help="Write results as JSON to this file")
+    args = parser.parse_args()
+
+    pages = make_pages(args.pages)
+    # Warm-up both the main thread and the executor thread models, so no measured run pays for loading
+    run_segmentation(pages[0])
+    _executor.submit(run_segmentation, pages[0]).result()
+
+    unbatched = bench_unbatched(pages)
+    results = {
+        "pages": args.pages,
+        "unbatched": {"seconds": unbatched, "pages_per_second": args.pages / unbatched},
+        "batched": [],
+    }
+    for batch_size in args.batch_size:
+        batched = bench_batched(pages, batch_size)
+        scheduled, stats = asyncio.run(bench_scheduler(pages, batch_size, args.wait_ms))
+        results["batched"].append({
+            "batch_size": batch_size,
+            "seconds": batched,
+            "pages_per_second": args.pages / batched,
+            "speedup": unbatched / batched,
+            "scheduler_seconds": scheduled,
+            "scheduler_pages_per_second": args.pages / scheduled,
+            "scheduler_stats": stats,
+        })
+
+    output = json.dumps(results, indent=2)
+    print(output)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            f.write(output + "\n")
+
+
+if __name__ == "__main__":
+    main()
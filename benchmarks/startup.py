@@ -0,0 +1,103 @@
+import argparse
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+
+import httpx
+
+# Measures the cold start of the service in fresh processes, so nothing is shared between runs
+IMPORT_SNIPPET = "import time; start = time.perf_counter(); import app.main; print(time.perf_counter() - start)"
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def measure_import() -> float:
+    output = subprocess.run(
+        [sys.executable, "-c", IMPORT_SNIPPET], check=True, capture_output=True, text=True
+    ).stdout
+    return float(output.strip().splitlines()[-1])
+
+
+def measure_server(timeout: float, image: str | None) -> dict:
+    port = free_port()
+    url = f"http://127.0.0.1:{port}"
+    start = time.perf_counter()
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.main:app", "--host", "127.0.0.1", "--port", str(port)],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    result = {"live_seconds": None, "ready_seconds": None, "warm_up": None, "first_request_seconds": None}
+    try:
+        with httpx.Client(timeout=5.0) as client:
+            while time.perf_counter() - start < timeout:
+                if server.poll() is not None:
+                    raise RuntimeError(f"Server exited with code {server.returncode}")
+                try:
+                    if result["live_seconds"] is None and client.get(f"{url}/health").status_code == 200:
+                        result["live_seconds"] = time.perf_counter() - start
+                    if result["live_seconds"] is not None:
+                        response = client.get(f"{url}/ready")
+                        if response.status_code == 200 or response.json()["status"] == "failed":
+                            result["ready_seconds"] = time.perf_counter() - start
+                            result["warm_up"] = response.json()
+                            break
+                except httpx.TransportError:
+                    pass
+                time.sleep(0.05)
+            if image and result["ready_seconds"] is not None:
+                # Latency of the first real request right after the instance reports ready
+                with open(image, "rb") as f:
+                    files = {"file": (os.path.basename(image), f.read())}
+                request_start = time.perf_counter()
+                client.post(f"{url}/api/objects", files=files, params={"bbox_only": True}, timeout=timeout)
+                result["first_request_seconds"] = time.perf_counter() - request_start
+    finally:
+        server.terminate()
+        server.wait()
+    return result
+
+
+def summary(values: list) -> dict:
+    values = [value for value in values if value is not None]
+    if not values:
+        return {}
+    return {"mean": statistics.mean(values), "min": min(values), "max": max(values)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure import time, time to live and time to ready of the service.")
+    parser.add_argument("--runs", type=int, default=3, help="Number of cold starts")
+    parser.add_argument("--timeout", type=float, default=600.0, help="Max seconds to wait for readiness")
+    parser.add_argument("--image", default=None, help="Image to send as the first request (bbox_only) after ready")
+    parser.add_argument("--out", default=None, help="Write results as JSON to this file")
+    args = parser.parse_args()
+
+    imports = [measure_import() for _ in range(args.runs)]
+    starts = [measure_server(args.timeout, args.image) for _ in range(args.runs)]
+    results = {
+        "runs": args.runs,
+        "import_seconds": summary(imports),
+        "live_seconds": summary([run["live_seconds"] for run in starts]),
+        "ready_seconds": summary([run["ready_seconds"] for run in starts]),
+        "first_request_seconds": summary([run["first_request_seconds"] for run in starts]),
+        "starts": starts,
+    }
+
+    output = json.dumps(results, indent=2)
+    print(output)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            f.write(output + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,153 @@
+import argparse
+import asyncio
+import json
+import random
+import re
+import time
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+# OpenAI-compatible fake VLM: answers chat completions with canned JSON after a configurable delay
+app = FastAPI()
+config = {"latency_ms": 200.0, "jitter_ms": 0.0, "error_rate": 0.0, "token_ms": 0.0, "trailing_tokens": 0, "runaway_rate": 0.0, "malformed_rate": 0.0}
+stats = {"calls": 0, "errors": 0, "in_flight": 0, "max_in_flight": 0, "tokens": 0, "runaways": 0, "malformed": 0, "request_bytes": 0, "max_request_bytes": 0}
+rng = random.Random(0)
+
+MARKDOWN = "Lorem ipsum dolor sit amet, consectetur adipiscing elit, sed do eiusmod tempor incididunt ut labore."
+
+
+def _answer(body: dict) -> str:
+    # Picks the answer shape from the JSON schema the service asks for, or from the prompt in JSON mode
+    schema = json.dumps(body.get("response_format", {}))
+    messages = json.dumps(body.get("messages", []))
+    if '"objects"' in schema or "Detect all distinct" in messages:
+        return json.dumps({"objects": [
+            {"type": "heading", "bbox": [40, 40, 560, 80], "text": "# Title"},
+            {"type": "paragraph", "bbox": [40, 100, 560, 300], "text": MARKDOWN},
+            {"type": "image", "bbox": [40, 320, 560, 600], "text": ""},
+        ]})
+    if '"blocks"' in schema or "separate document blocks" in messages:
+        match = re.search(r"contains (\d+) separate", messages)
+        count = int(match.group(1)) if match else 1
+        return json.dumps({"blocks": [MARKDOWN] * count})
+    return json.dumps({"markdown": MARKDOWN})
+
+
+def _chunk(content: str | None, finish_reason: str | None) -> str:
+    delta = {"role": "assistant", "content": content} if content is not None else {}
+    chunk = {
+        "id": "stub", "object": "chat.completion.chunk", "created": int(time.time()), "model": "stub",
+        "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+    }
+    return f"data: {json.dumps(chunk)}\n\n"
+
+
+@app.post("/v1/chat/completions")
+async def chat_completions(request: Request):
+    raw = await request.body()
+    body = json.loads(raw)
+    stats["calls"] += 1
+    # Size of the prompt as sent, images included: it must not grow with the number of calls served
+    stats["request_bytes"] += len(raw)
+    stats["max_request_bytes"] = max(stats["max_request_bytes"], len(raw))
+    stats["in_flight"] += 1
+    stats["max_in_flight"] = max(stats["max_in_flight"], stats["in_flight"])
+    try:
+        delay = max(0.0, rng.gauss(config["latency_ms"], config["jitter_ms"])) / 1000
+        await asyncio.sleep(delay)
+        if rng.random() < config["error_rate"]:
+            stats["errors"] += 1
+            return JSONResponse(status_code=500, content={"error": {"message": "stub error", "type": "server_error"}})
+    finally:
+        stats["in_flight"] -= 1
+
+    content = _answer(body)
+    if rng.random() < config["malformed_rate"]:
+        # Answers of a backend that ignores the requested format: fenced, or with a sentence in front
+        stats["malformed"] += 1
+        content = rng.choice([f"```json\n{content}\n```", f"Here is the extracted content:\n{content}"])
+    if body.get("stream"):
+        max_tokens = body.get("max_tokens") or 4096
+        finish_reason = "stop"
+        runaway = rng.random() < config["runaway_rate"]
+        if runaway:
+            # A degenerate answer that repeats itself inside the last JSON string until the budget is spent
+            stats["runaways"] += 1
+            content = content.rstrip('"]}')
+        # One token is about four characters of the answer
+        tokens = [content[i:i + 4] for i in range(0, len(content), 4)]
+        if runaway:
+            tokens += [" lorem"] * max_tokens
+        else:
+            # Some backends keep emitting whitespace after the JSON object until they hit a limit
+            tokens += [" "] * config["trailing_tokens"]
+        if len(tokens) > max_tokens:
+            tokens, finish_reason = tokens[:max_tokens], "length"
+
+        async def stream():
+            if not config["token_ms"]:
+                # Two content chunks, like a real backend that streams tokens
+                middle = len(tokens) // 2
+                for part in (tokens[:middle], tokens[middle:]):
+                    stats["tokens"] += len(part)
+                    yield _chunk("".join(part), None)
+            for token in tokens if config["token_ms"] else []:
+                await asyncio.sleep(config["token_ms"] / 1000)
+                stats["tokens"] += 1
+                yield _chunk(token, None)
+            yield _chunk(None, finish_reason)
+            yield "data: [DONE]\n\n"
+        return StreamingResponse(stream(), media_type="text/event-stream")
+    finish_reason = "stop"
+    # One token is about four characters of the answer
+    if body.get("max_tokens") and len(content) > body["max_tokens"] * 4:
+        content, finish_reason = content[:body["max_tokens"] * 4], "length"
+    return {
+        "id": "stub", "object": "chat.completion", "created": int(time.time()), "model": "stub",
+        "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": finish_reason}],
+        "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0},
+    }
+
+
+@app.get("/v1/models")
+async def list_models():
+    # Used by the service's active health checks
+    return {"object": "list", "data": [{"id": "stub", "object": "model", "owned_by": "stub"}]}
+
+
+@app.get("/stats")
+async def get_stats():
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fake OpenAI-compatible VLM server for benchmarks.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=18000)
+    parser.add_argument("--latency-ms", type=float, default=200.0, help="Mean delay of every answer")
+    parser.add_argument("--jitter-ms", type=float, default=0.0, help="Standard deviation of the delay")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of calls answered with HTTP 500")
+    parser.add_argument("--token-ms", type=float, default=0.0, help="Delay of every streamed token (0 streams the answer in two chunks)")
+    parser.add_argument("--trailing-tokens", type=int, default=0, help="Whitespace tokens streamed after the JSON answer")
+    parser.add_argument("--runaway-rate", type=float, default=0.0, help="Share of streamed answers that repeat until max_tokens")
+    parser.add_argument("--malformed-rate", type=float, default=0.0, help="Share of answers wrapped in a code fence or preceded by prose")
+    parser.add_argument("--seed", type=int, default=0, help="Seed for delays and errors")
+    args = parser.parse_args()
+
+    config.update(
+        latency_ms=args.latency_ms,
+        jitter_ms=args.jitter_ms,
+        error_rate=args.error_rate,
+        token_ms=args.token_ms,
+        trailing_tokens=args.trailing_tokens,
+        runaway_rate=args.runaway_rate,
+        malformed_rate=args.malformed_rate,
+    )
+    rng.seed(args.seed)
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
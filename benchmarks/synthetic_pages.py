@@ -0,0 +1,38 @@
+import random
+from PIL import Image, ImageDraw
+
+
+def make_page(blocks: int = 12, size: tuple = (1240, 1754), seed: int = 0) -> Image.Image:
+    """
+    Draws a synthetic document page (A4 at 150 dpi by default): a title, then paragraphs
+    of fake text lines, so that the layout model finds a predictable number of blocks.
+    """
+    rnd = random.Random(seed)
+    width, height = size
+    page = Image.new("RGB", size, (255, 255, 255))
+    draw = ImageDraw.Draw(page)
+    margin = width // 12
+    y = margin
+    # Title
+    draw.rectangle([margin, y, width // 2, y + 28], fill=(30, 30, 30))
+    y += 70
+    block_height = max(40, (height - y - margin) // max(1, blocks) - 24)
+    for _ in range(blocks):
+        lines = max(1, block_height // 22)
+        for line in range(lines):
+            line_width = rnd.randint(width // 2, width - 2 * margin) if line == lines - 1 else width - 2 * margin
+            x = margin
+            # Words of random length separated by spaces
+            while x < margin + line_width:
+                word = rnd.randint(20, 90)
+                draw.rectangle([x, y + 4, min(x + word, margin + line_width), y + 14], fill=(40, 40, 40))
+                x += word + 10
+            y += 22
+        y += 24
+        if y > height - margin:
+            break
+    return page
+
+
+def make_pages(count: int, blocks: int = 12, size: tuple = (1240, 1754)) -> list:
+    return [make_page(blocks, size, seed=i) for i in range(count)]
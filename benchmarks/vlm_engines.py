@@ -0,0 +1,152 @@
+import argparse
+import asyncio
+import io
+import json
+import logging
+import os
+import subprocess
+import sys
+import time
+
+import httpx
+
+os.environ.setdefault("OPENAI_API_KEY", "stub")
+
+from app.services.cache_service import markdown_cache
+from app.services.vlm_service import VLMService
+from app.settings import settings
+from benchmarks.e2e import free_port, percentiles, wait_http
+from benchmarks.synthetic_pages import make_page
+
+logging.basicConfig(
+    level=logging.WARNING,
+    format='[%(asctime)s] %(levelname)s: %(message)s',
+    datefmt='%Y-%m-%d %H:%M:%S'
+)
+logger = logging.getLogger("vlm_engines")
+
+
+def make_inputs() -> dict:
+    # A single block crop, a tile of four blocks, and a reduced page, like the service sends them
+    page = make_page(12, seed=0)
+    inputs = {}
+    for kind, image in (
+        ("markdown", page.crop((100, 150, 1140, 400))),
+        ("blocks", page.crop((100, 150, 1140, 1150))),
+        ("objects", page.resize((620, 877))),
+    ):
+        buf = io.BytesIO()
+        image.save(buf, format="PNG")
+        inputs[kind] = buf.getvalue()
+    return inputs
+
+
+def call(service: VLMService, kind: str, image_bytes: bytes, usage: dict):
+    if kind == "markdown":
+        return service.aextract_markdown(image_bytes, usage=usage)
+    if kind == "blocks":
+        return service.aextract_markdown_blocks(image_bytes, 4, usage=usage)
+    return service.apredict_objects(image_bytes, usage=usage)
+
+
+async def bench_engine(engine: str, kinds: list, inputs: dict, calls: int, concurrency: int) -> list:
+    settings.vlm_engine = engine
+    service = VLMService()
+    service.warm_up()
+    results = []
+    try:
+        for kind in kinds:
+            # One untimed call opens the connection and builds the guidance prefix of the prompt
+            try:
+                await call(service, kind, inputs[kind], {})
+            except Exception:
+                pass
+            latencies, failures, usage = [], {}, {}
+            semaphore = asyncio.Semaphore(concurrency)
+
+            async def one() -> None:
+                async with semaphore:
+                    start = time.perf_counter()
+                    try:
+                        await call(service, kind, inputs[kind], usage)
+                    except Exception as e:
+                        failures[type(e).__name__] = failures.get(type(e).__name__, 0) + 1
+                        logger.debug(f"{engine} {kind} call failed: {e}")
+                    else:
+                        latencies.append(time.perf_counter() - start)
+
+            start = time.perf_counter()
+            await asyncio.gather(*(one() for _ in range(calls)))
+            wall = time.perf_counter() - start
+            failed = sum(failures.values())
+            results.append({
+                "engine": engine,
+                "kind": kind,
+                "concurrency": concurrency,
+                "calls": calls,
+                "wall_s": wall,
+                "calls_per_s": calls / wall,
+                "latency_ms": {key: value * 1000 for key, value in percentiles(latencies).items()},
+                "failures": failed,
+                "failure_rate": failed / calls,
+                "failure_types": failures,
+                "backend_calls": usage.get("vlm_calls", 0),
+            })
+    finally:
+        await service.aclose()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Per-call overhead and failure rate of the VLM engines against a local stub VLM.")
+    parser.add_argument("--engines", nargs="+", default=["guidance", "direct"], choices=["guidance", "direct"], help="Engines to compare")
+    parser.add_argument("--kinds", nargs="+", default=["markdown", "blocks", "objects"], choices=["markdown", "blocks", "objects"], help="Call types to run")
+    parser.add_argument("--calls", type=int, default=200, help="Calls per engine, call type and concurrency level")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8], help="Calls in flight to compare")
+    parser.add_argument("--response-format", default=settings.vlm_response_format, choices=["json_schema", "json_object", "none"], help="response_format of the direct engine")
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="Stub VLM latency, 0 leaves only the client-side overhead")
+    parser.add_argument("--malformed-rate", type=float, default=0.0, help="Share of stub answers wrapped in a code fence or preceded by prose")
+    parser.add_argument("--timeout", type=float, default=60.0, help="Max seconds to wait for the stub to be ready")
+    parser.add_argument("--out", default=None, help="Write results as JSON to this file")
+    args = parser.parse_args()
+
+    stub_url = f"http://127.0.0.1:{free_port()}"
+    stub = subprocess.Popen(
+        [sys.executable, "-m", "benchmarks.stub_vlm", "--port", stub_url.rsplit(":", 1)[1],
+         "--latency-ms", str(args.latency_ms), "--malformed-rate", str(args.malformed_rate)],
+    )
+    # Repeated inputs would be served from the cache after the first call
+    markdown_cache.enabled = False
+    settings.openai_base_url = f"{stub_url}/v1"
+    settings.openai_api_model = "stub"
+    settings.vlm_backends = []
+    settings.vlm_response_format = args.response_format
+    try:
+        wait_http(f"{stub_url}/stats", args.timeout, stub)
+        inputs = make_inputs()
+        results = {
+            "config": {
+                "calls": args.calls,
+                "response_format": args.response_format,
+                "latency_ms": args.latency_ms,
+                "malformed_rate": args.malformed_rate,
+            },
+            "runs": [],
+        }
+        for concurrency in args.concurrency:
+            for engine in args.engines:
+                results["runs"] += asyncio.run(bench_engine(engine, args.kinds, inputs, args.calls, concurrency))
+        results["stub"] = httpx.get(f"{stub_url}/stats").json()
+    finally:
+        stub.terminate()
+        stub.wait()
+
+    output = json.dumps(results, indent=2)
+    print(output)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            f.write(output + "\n")
+
+
+if __name__ == "__main__":
+    main()
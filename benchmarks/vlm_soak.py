@@ -0,0 +1,136 @@
+import argparse
+import asyncio
+import io
+import json
+import logging
+import os
+import subprocess
+import sys
+import time
+
+import httpx
+
+os.environ.setdefault("OPENAI_API_KEY", "stub")
+
+from app.services.cache_service import markdown_cache
+from app.services.vlm_service import VLMService
+from app.settings import settings
+from benchmarks.e2e import free_port, process_rss_mb, wait_http
+from benchmarks.synthetic_pages import make_page
+
+logging.basicConfig(
+    level=logging.WARNING,
+    format='[%(asctime)s] %(levelname)s: %(message)s',
+    datefmt='%Y-%m-%d %H:%M:%S'
+)
+logger = logging.getLogger("vlm_soak")
+
+
+def make_crops(count: int) -> list:
+    # Block crops of the same size but different content, so every prompt should weigh about the same
+    crops = []
+    for seed in range(count):
+        buf = io.BytesIO()
+        make_page(12, seed=seed).crop((100, 150, 1140, 400)).save(buf, format="PNG")
+        crops.append(buf.getvalue())
+    return crops
+
+
+async def soak(engine: str, crops: list, calls: int, window: int, concurrency: int, stub_url: str) -> list:
+    settings.vlm_engine = engine
+    service = VLMService()
+    service.warm_up()
+    windows = []
+    try:
+        async with httpx.AsyncClient() as client:
+            before = (await client.get(f"{stub_url}/stats")).json()
+            semaphore = asyncio.Semaphore(concurrency)
+            done = 0
+            while done < calls:
+                size = min(window, calls - done)
+                failures = 0
+
+                async def one(n: int) -> None:
+                    nonlocal failures
+                    async with semaphore:
+                        try:
+                            await service.aextract_markdown(crops[n % len(crops)])
+                        except Exception as e:
+                            failures += 1
+                            logger.debug(f"{engine} call failed: {e}")
+
+                start = time.perf_counter()
+                await asyncio.gather(*(one(done + n) for n in range(size)))
+                wall = time.perf_counter() - start
+                done += size
+                after = (await client.get(f"{stub_url}/stats")).json()
+                backend_calls = after["calls"] - before["calls"]
+                windows.append({
+                    "calls_done": done,
+                    "calls_per_s": size / wall,
+                    "failures": failures,
+                    "rss_mb": process_rss_mb(os.getpid()),
+                    # Mean size of the requests the backend got in this window
+                    "request_bytes": (after["request_bytes"] - before["request_bytes"]) / max(1, backend_calls),
+                })
+                before = after
+    finally:
+        await service.aclose()
+    return windows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Memory and prompt size of the VLM service over thousands of calls against a local stub VLM.")
+    parser.add_argument("--engine", default="guidance", choices=["guidance", "direct"], help="Engine to soak")
+    parser.add_argument("--calls", type=int, default=5000, help="Total calls of aextract_markdown")
+    parser.add_argument("--window", type=int, default=500, help="Calls between two samples of memory and request size")
+    parser.add_argument("--concurrency", type=int, default=8, help="Calls in flight")
+    parser.add_argument("--crops", type=int, default=8, help="Distinct block images the calls cycle through")
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="Stub VLM latency")
+    parser.add_argument("--timeout", type=float, default=60.0, help="Max seconds to wait for the stub to be ready")
+    parser.add_argument("--out", default=None, help="Write results as JSON to this file")
+    args = parser.parse_args()
+
+    stub_url = f"http://127.0.0.1:{free_port()}"
+    stub = subprocess.Popen(
+        [sys.executable, "-m", "benchmarks.stub_vlm", "--port", stub_url.rsplit(":", 1)[1], "--latency-ms", str(args.latency_ms)],
+    )
+    # Every call has to reach the backend, repeats would be served from the cache
+    markdown_cache.enabled = False
+    settings.openai_base_url = f"{stub_url}/v1"
+    settings.openai_api_model = "stub"
+    settings.vlm_backends = []
+    try:
+        wait_http(f"{stub_url}/stats", args.timeout, stub)
+        windows = asyncio.run(soak(args.engine, make_crops(args.crops), args.calls, args.window, args.concurrency, stub_url))
+        stub_stats = httpx.get(f"{stub_url}/stats").json()
+    finally:
+        stub.terminate()
+        stub.wait()
+
+    # The first window includes the warm-up allocations, growth is measured from its end
+    first, last = windows[0], windows[-1]
+    results = {
+        "config": {
+            "engine": args.engine,
+            "calls": args.calls,
+            "window": args.window,
+            "concurrency": args.concurrency,
+            "crops": args.crops,
+            "latency_ms": args.latency_ms,
+        },
+        "windows": windows,
+        "rss_growth_mb": last["rss_mb"] - first["rss_mb"],
+        "request_bytes_growth": last["request_bytes"] / first["request_bytes"] if first["request_bytes"] else None,
+        "failures": sum(w["failures"] for w in windows),
+        "stub": stub_stats,
+    }
+    output = json.dumps(results, indent=2)
+    print(output)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            f.write(output + "\n")
+
+
+if __name__ == "__main__":
+    main()
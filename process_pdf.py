@@ -1,13 +1,18 @@
 import argparse
+import hashlib
 import os
+import random
 import sys
 import time
 import logging
 import requests
 import json
-from pdf2image import convert_from_path
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pdf2image import convert_from_path, pdfinfo_from_path
 from PIL import Image
 import shutil
+from requests.adapters import HTTPAdapter
 
 logging.basicConfig(
     level=logging.INFO,
@@ -17,18 +22,72 @@ logging.basicConfig(
 logger = logging.getLogger("process_pdf")
 
 
-def pdf_to_pngs(pdf_path, out_dir):
-    logger.info(f"Converting PDF to PNG: {pdf_path}")
-    images = convert_from_path(pdf_path)
-    png_files = []
+def page_png_path(pdf_path, out_dir, page_number):
     base = os.path.splitext(os.path.basename(pdf_path))[0]
-    for i, img in enumerate(images):
-        png_name = f"{base}_page_{i + 1}.png"
-        png_path = os.path.join(out_dir, png_name)
-        img.save(png_path, "PNG")
-        png_files.append(png_path)
-        logger.info(f"Saved: {png_path}")
-    return png_files
+    return os.path.join(out_dir, f"{base}_page_{page_number}.png")
+
+
+def pdf_page_to_png(pdf_path, out_dir, page_number):
+    # Render a single page only, so selecting pages never rasterizes the whole document
+    png_path = page_png_path(pdf_path, out_dir, page_number)
+    images = convert_from_path(pdf_path, first_page=page_number, last_page=page_number)
+    images[0].save(png_path, "PNG")
+    logger.info(f"Saved: {png_path}")
+    return png_path
+
+
+def pdf_to_pngs(pdf_path, out_dir, page_numbers=None):
+    logger.info(f"Converting PDF to PNG: {pdf_path}")
+    if page_numbers is None:
+        page_numbers = range(1, count_pdf_pages(pdf_path) + 1)
+    return [pdf_page_to_png(pdf_path, out_dir, page_number) for page_number in page_numbers]
+
+
+def count_pdf_pages(pdf_path):
+    return int(pdfinfo_from_path(pdf_path)["Pages"])
+
+
+def make_session(pool_size):
+    # One pooled session shared by all workers, connections to the API are kept alive and reused
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+class Manifest:
+    """
+    Records finished pages in a JSON file next to the output, so an interrupted run
+    resumes where it stopped instead of starting over.
+    """
+
+    def __init__(self, path, pdf_path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.data = {"pdf": os.path.abspath(pdf_path), "pages": {}}
+        if os.path.isfile(path):
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    data = json.load(f)
+                if data.get("pdf") == self.data["pdf"]:
+                    self.data = data
+                else:
+                    logger.warning(f"Manifest {path} belongs to another PDF, starting over")
+            except (OSError, ValueError) as e:
+                logger.warning(f"Cannot read manifest {path}, starting over: {e}")
+
+    def is_done(self, page_number):
+        return self.data["pages"].get(str(page_number), {}).get("status") == "done"
+
+    def mark(self, page_number, status, md_path=None):
+        with self.lock:
+            self.data["pages"][str(page_number)] = {"status": status, "md": md_path, "time": time.time()}
+            # Write to a temporary file first, so a crash never leaves a broken manifest
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(self.data, f, indent=2)
+            os.replace(tmp_path, self.path)
 
 
 def post_image(api_url, image_path, retries=3, sleep_sec=2):
@@ -83,27 +142,58 @@ def extract_and_save_bbox_objects(objects, png_path, out_dir):
     return obj_dir
 
 
-def process_png(png_path, api_url, retries, out_dir):
-    # Process a single PNG file: send to API, handle response, save markdown and pictures
-    logger.info(f"Processing {png_path}")
-    with open(png_path, "rb") as f:
-        img_bytes = f.read()
+def retry_delay(attempt, response=None, base=1.0, cap=60.0):
+    # Waits as long as the server asks with Retry-After (503 when overloaded, 429),
+    # otherwise exponential backoff with full jitter so parallel pages do not retry in lockstep
+    if response is not None and response.headers.get("Retry-After", "").isdigit():
+        return min(cap, float(response.headers["Retry-After"]))
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+def pdf_digest(pdf_path):
+    # Stable id of the document, used as the API session so repeated headers and footers are transcribed once
+    digest = hashlib.sha256()
+    with open(pdf_path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()[:32]
+
+
+def post_with_retries(http, api_url, files, retries, params=None):
+    # POST the files to the API, returns the JSON of the first 200 response or None after all retries
     for attempt in range(retries):
+        response = None
         try:
-            response = requests.post(api_url, files={"file": (os.path.basename(png_path), img_bytes, "image/png")})
+            response = http.post(api_url, files=files, params=params, timeout=600)
             if response.status_code == 200:
-                data = response.json()
-                break
+                return response.json()
             else:
                 logger.warning(f"API returned status {response.status_code}: {response.text}")
         except Exception as e:
             logger.error(f"API request failed: {e}")
         if attempt < retries - 1:
-            logger.info(f"Retrying ({attempt+1}/{retries})...")
-            time.sleep(1)
-    else:
-        logger.error(f"Failed to get valid response from API after {retries} attempts.")
-        return
+            delay = retry_delay(attempt, response)
+            logger.info(f"Retrying ({attempt+1}/{retries}) in {delay:.1f}s...")
+            time.sleep(delay)
+    logger.error(f"Failed to get valid response from API after {retries} attempts.")
+    return None
+
+
+def process_png(png_path, api_url, retries, out_dir, session=None, params=None):
+    # Process a single PNG file: send to API, handle response, save markdown and pictures.
+    # Returns the markdown path, or None if the API did not return a valid response.
+    logger.info(f"Processing {png_path}")
+    with open(png_path, "rb") as f:
+        img_bytes = f.read()
+    files = {"file": (os.path.basename(png_path), img_bytes, "image/png")}
+    data = post_with_retries(session or requests, api_url, files, retries, params)
+    if data is None:
+        return None
+    return save_page_result(data, png_path, out_dir)
+
+
+def save_page_result(data, png_path, out_dir):
+    # Save the markdown and picture crops of one page from its API response, returns the markdown path
     # Open image for cropping
     img = Image.open(png_path).convert("RGB")
     # Prepare output paths
@@ -147,6 +237,43 @@ def process_png(png_path, api_url, retries, out_dir):
     with open(md_path, "w", encoding="utf-8") as f:
         f.write(md_text)
     logger.info(f"Saved markdown: {md_path}")
+    return md_path
+
+
+def process_page(pdf_path, page_number, api_url, retries, out_dir, session, manifest, params=None):
+    png_path = page_png_path(pdf_path, out_dir, page_number)
+    if not os.path.isfile(png_path):
+        png_path = pdf_page_to_png(pdf_path, out_dir, page_number)
+    md_path = process_png(png_path, api_url, retries, out_dir, session, params)
+    manifest.mark(page_number, "done" if md_path else "failed", md_path)
+    return md_path
+
+
+def process_batch(pdf_path, page_numbers, api_url, retries, out_dir, session, manifest, params=None):
+    # Send several pages in one /api/objects/batch request, returns the page numbers that failed
+    png_paths = []
+    for page_number in page_numbers:
+        png_path = page_png_path(pdf_path, out_dir, page_number)
+        if not os.path.isfile(png_path):
+            png_path = pdf_page_to_png(pdf_path, out_dir, page_number)
+        png_paths.append(png_path)
+    logger.info(f"Processing pages {page_numbers} in one batch")
+    files = []
+    for png_path in png_paths:
+        with open(png_path, "rb") as f:
+            files.append(("files", (os.path.basename(png_path), f.read(), "image/png")))
+    data = post_with_retries(session, api_url.rstrip("/") + "/batch", files, retries, params)
+    results = data["results"] if data else [None] * len(page_numbers)
+    failed = []
+    for page_number, png_path, result in zip(page_numbers, png_paths, results):
+        if result is None or result.get("error"):
+            if result is not None:
+                logger.error(f"Page {page_number} failed: {result['error']}")
+            manifest.mark(page_number, "failed")
+            failed.append(page_number)
+            continue
+        manifest.mark(page_number, "done", save_page_result(result, png_path, out_dir))
+    return failed
 
 
 def parse_pages(pages_str, total_pages):
@@ -182,6 +309,11 @@ def main():
     parser.add_argument("--retries", "-r", type=int, default=3, help="Number of retries for empty response")
     parser.add_argument("--out", "-o", default=None, help="Output folder (default: input folder)")
     parser.add_argument("--pages", type=str, default=None, help="Pages to process: e.g. 1,2,3 or 2 or ,8 or 3,5,7")
+    parser.add_argument("--concurrency", "-c", type=int, default=1, help="Number of pages sent to the API in parallel")
+    parser.add_argument("--manifest", "-m", default=None, help="Progress manifest file (default: <out>/<pdf name>.manifest.json)")
+    parser.add_argument("--batch-size", "-b", type=int, default=1, help="Pages sent in one /api/objects/batch request (1: one /api/objects request per page)")
+    parser.add_argument("--no-dedup", action="store_true", help="Transcribe repeated headers and footers on every page instead of once per PDF")
+    parser.add_argument("--no-resume", action="store_true", help="Process all selected pages even if the manifest marks them as done")
     args = parser.parse_args()
 
     input_pdf = args.input
@@ -194,13 +326,54 @@ def main():
         sys.exit(1)
 
     pdf_path = input_pdf
-    all_png_files = pdf_to_pngs(pdf_path, out_dir)
-    total_pages = len(all_png_files)
-    page_numbers = parse_pages(args.pages, total_pages)
-    # Filter PNG files by selected pages
-    png_files = [all_png_files[i - 1] for i in page_numbers if 1 <= i <= total_pages]
-    for png_path in png_files:
-        process_png(png_path, api_url, retries, out_dir)
+    os.makedirs(out_dir or ".", exist_ok=True)
+    total_pages = count_pdf_pages(pdf_path)
+    page_numbers = [i for i in parse_pages(args.pages, total_pages) if 1 <= i <= total_pages]
+
+    base = os.path.splitext(os.path.basename(pdf_path))[0]
+    manifest = Manifest(args.manifest or os.path.join(out_dir, f"{base}.manifest.json"), pdf_path)
+    if not args.no_resume:
+        done = [i for i in page_numbers if manifest.is_done(i)]
+        if done:
+            logger.info(f"Resuming: {len(done)} of {len(page_numbers)} pages already done according to {manifest.path}")
+        page_numbers = [i for i in page_numbers if i not in done]
+
+    concurrency = max(1, args.concurrency)
+    session = make_session(concurrency)
+    params = {"dedup": "false"} if args.no_dedup else {"session": pdf_digest(pdf_path)}
+    failed = []
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        if args.batch_size > 1:
+            batches = [page_numbers[i:i + args.batch_size] for i in range(0, len(page_numbers), args.batch_size)]
+            futures = {
+                executor.submit(process_batch, pdf_path, batch, api_url, retries, out_dir, session, manifest, params): batch
+                for batch in batches
+            }
+            for future in as_completed(futures):
+                try:
+                    failed += future.result()
+                except Exception as e:
+                    logger.error(f"Pages {futures[future]} failed: {e}")
+                    for page_number in futures[future]:
+                        manifest.mark(page_number, "failed")
+                    failed += futures[future]
+        else:
+            futures = {
+                executor.submit(process_page, pdf_path, page_number, api_url, retries, out_dir, session, manifest, params): page_number
+                for page_number in page_numbers
+            }
+            for future in as_completed(futures):
+                page_number = futures[future]
+                try:
+                    if future.result() is None:
+                        failed.append(page_number)
+                except Exception as e:
+                    logger.error(f"Page {page_number} failed: {e}")
+                    manifest.mark(page_number, "failed")
+                    failed.append(page_number)
+    if failed:
+        logger.error(f"Failed pages: {sorted(failed)}. Run again to retry only these pages.")
+        sys.exit(1)
 
 
 if __name__ == "__main__":
@@ -6,6 +6,8 @@ import MarkdownViewer from "./components/MarkdownViewer";
 import ImageModal from "./components/ImageModal";
 
 const API_URL = process.env.REACT_APP_API_URL || "http://localhost:8000/api/objects";
+// Queued images are sent together to the batch endpoint, up to this many per request
+const BATCH_SIZE = 8;
 
 function App() {
   const [images, setImages] = useState([]); // [{file, url, result, status: 'pending'|'loading'|'done'|'error'}]
@@ -44,48 +46,67 @@ function App() {
       isProcessingRef.current = true;
       
       while (queueRef.current.length > 0) {
-        const idx = queueRef.current.shift();
-        
-        // Check if image still exists and is not already processed
-        if (!images[idx] || images[idx].status === "done" || images[idx].status === "loading") {
+        // Take the next images that still exist and are not already processed
+        const batch = [];
+        while (queueRef.current.length > 0 && batch.length < BATCH_SIZE) {
+          const idx = queueRef.current.shift();
+          if (images[idx] && images[idx].status !== "done" && images[idx].status !== "loading" && !batch.includes(idx)) {
+            batch.push(idx);
+          }
+        }
+        if (batch.length === 0) {
           continue;
         }
         
         setImages((prev) => {
           const arr = [...prev];
-          if (arr[idx]) arr[idx].status = "loading";
+          batch.forEach((idx) => {
+            if (arr[idx]) arr[idx].status = "loading";
+          });
           return arr;
         });
         
         try {
           const formData = new FormData();
-          formData.append("file", images[idx].file);
-          const res = await fetch(API_URL, {
+          batch.forEach((idx) => formData.append("files", images[idx].file));
+          const res = await fetch(`${API_URL}/batch`, {
             method: "POST",
             body: formData,
           });
           const data = await res.json();
+          if (!Array.isArray(data.results)) {
+            throw new Error(typeof data.detail === "string" ? data.detail : `HTTP ${res.status}`);
+          }
           
-          // Use backend-provided bbox as-is ([x1, y1, x2, y2])
-          const mappedObjects = Array.isArray(data.objects)
-            ? data.objects.map(obj => ({ ...obj }))
-            : [];
-          
+          // Results come back in upload order, an image that failed has an error of its own
           setImages((prev) => {
             const arr = [...prev];
-            if (arr[idx]) {
-              arr[idx].result = { ...data, objects: mappedObjects };
+            batch.forEach((idx, i) => {
+              const item = data.results[i];
+              if (!arr[idx]) return;
+              if (!item || item.error) {
+                arr[idx].result = { error: item ? item.error : "No result" };
+                arr[idx].status = "error";
+                return;
+              }
+              // Use backend-provided bbox as-is ([x1, y1, x2, y2])
+              const mappedObjects = Array.isArray(item.objects)
+                ? item.objects.map(obj => ({ ...obj }))
+                : [];
+              arr[idx].result = { ...item, objects: mappedObjects };
               arr[idx].status = "done";
-            }
+            });
             return arr;
           });
         } catch (e) {
           setImages((prev) => {
             const arr = [...prev];
-            if (arr[idx]) {
-              arr[idx].result = { error: e.message };
-              arr[idx].status = "error";
-            }
+            batch.forEach((idx) => {
+              if (arr[idx]) {
+                arr[idx].result = { error: e.message };
+                arr[idx].status = "error";
+              }
+            });
             return arr;
           });
         }